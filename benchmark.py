@@ -0,0 +1,230 @@
+"""Micro-benchmarks for the AI engine, win detection and rendering.
+
+Runs every benchmark over a fixed, seeded corpus of positions, records the
+results as JSON and compares them with a stored baseline, exiting non-zero
+when a benchmark regresses beyond its allowed threshold.
+
+Usage:
+    python benchmark.py --save-baseline          # record benchmark_baseline.json
+    python benchmark.py                          # compare against it
+    python benchmark.py --max-regression 0.10 --threshold ai.get_move.hard=0.25
+    python benchmark.py --only ai. --repeat 3 --json results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import telebot
+
+from loadtest import FakeBotAPI
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+CORPUS_SEED = 2024
+CORPUS_SHAPE = {1: 4, 3: 12, 5: 12, 7: 8}  # Pieces on board -> number of positions
+
+# -------------------- SETUP --------------------
+def load_bot():
+    """Import the bot with its API pointed at a local fake and a scratch database"""
+    api = FakeBotAPI().start()
+    telebot.apihelper.API_URL = api.url + "/bot{0}/{1}"
+    os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+    os.chdir(tempfile.mkdtemp(prefix='tictactoe-bench-'))
+
+    import main
+    main.TRACE_SAMPLE_RATE = 0
+    main.init_database()
+    return main
+
+
+def build_corpus(main, seed=CORPUS_SEED):
+    """Non-terminal positions with O (the AI) to move, reproducible from `seed`"""
+    rng = random.Random(seed)
+    corpus = []
+    for pieces, count in CORPUS_SHAPE.items():
+        seen = set()
+        while len(seen) < count:
+            board = [[main.EMPTY] * main.BOARD_SIZE for _ in range(main.BOARD_SIZE)]
+            cells = [(r, c) for r in range(main.BOARD_SIZE) for c in range(main.BOARD_SIZE)]
+            rng.shuffle(cells)
+            for i, (r, c) in enumerate(cells[:pieces]):
+                board[r][c] = main.PLAYER_X if i % 2 == 0 else main.PLAYER_O
+            if main.check_win(board, main.PLAYER_X) or main.check_win(board, main.PLAYER_O):
+                continue
+            key = tuple(cell for row in board for cell in row)
+            if key not in seen:
+                seen.add(key)
+                corpus.append(board)
+    return corpus
+
+
+def build_game(main, board, players=(1001, 1002)):
+    p1_id, p2_id = players
+    for player_id in players:
+        main.update_user_stats(player_id, name=f"Bench{player_id}")
+    return {
+        'game_id': 'bench001',
+        'players': [p1_id, p2_id],
+        'player_symbols': {p1_id: main.PLAYER_X, p2_id: main.PLAYER_O},
+        'board': [row[:] for row in board],
+        'turn': p2_id,
+        'is_over': False,
+        'game_mode': 'friend_dm',
+        'move_history': [],
+        'hints_used': {p1_id: 0, p2_id: 0},
+        'empty_symbol': '⬜',
+        'created_at': time.time(),
+        'start_time': time.time(),
+    }
+
+# -------------------- BENCHMARKS --------------------
+def define_benchmarks(main, corpus):
+    """Name -> (callable running one pass over the corpus, operations per pass)"""
+    benchmarks = {}
+
+    for difficulty in ['easy', 'medium', 'hard', 'impossible']:
+        def run_ai(difficulty=difficulty):
+            random.seed(CORPUS_SEED)
+            ai = main.AdvancedAI(difficulty)
+            for board in corpus:
+                ai.get_move([row[:] for row in board], main.PLAYER_O)
+        benchmarks[f"ai.get_move.{difficulty}"] = (run_ai, len(corpus))
+
+    def run_check_win():
+        for board in corpus:
+            main.check_win(board, main.PLAYER_X)
+            main.check_win(board, main.PLAYER_O)
+    benchmarks['board.check_win'] = (run_check_win, len(corpus) * 2)
+
+    def run_is_board_full():
+        for board in corpus:
+            main.is_board_full(board)
+    benchmarks['board.is_board_full'] = (run_is_board_full, len(corpus))
+
+    games = [build_game(main, board) for board in corpus]
+
+    def run_board_markup():
+        for game in games:
+            main.create_enhanced_board_markup(game)
+    benchmarks['render.board_markup'] = (run_board_markup, len(games))
+
+    def run_status_text():
+        for game in games:
+            main.bump_game_version(game)
+            main.get_game_status_text(game, game['players'][0])
+    benchmarks['render.status_text'] = (run_status_text, len(games))
+
+    def run_status_text_cached():
+        for game in games:
+            main.get_game_status_text(game, game['players'][0])
+    benchmarks['render.status_text.cached'] = (run_status_text_cached, len(games))
+
+    return benchmarks
+
+
+def run_benchmarks(benchmarks, repeat, only=None):
+    results = {}
+    for name, (func, ops) in benchmarks.items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        func()  # Warm up
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) / ops * 1_000_000)
+        results[name] = {
+            'median_us': statistics.median(timings),
+            'min_us': min(timings),
+            'max_us': max(timings),
+            'ops_per_pass': ops,
+            'repeat': repeat,
+        }
+        print(f"{name:<28}{results[name]['median_us']:>14.2f} µs/op  (min {results[name]['min_us']:.2f})")
+    return results
+
+# -------------------- BASELINE COMPARISON --------------------
+def compare(results, baseline, max_regression, thresholds):
+    """Return (name, baseline_us, current_us, change) for every regressed benchmark"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous['median_us']:
+            continue
+        change = current['median_us'] / previous['median_us'] - 1
+        if change > thresholds.get(name, max_regression):
+            regressions.append((name, previous['median_us'], current['median_us'], change))
+    return regressions
+
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values or []:
+        name, _, fraction = value.partition('=')
+        thresholds[name] = float(fraction)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the AI engine and rendering")
+    parser.add_argument('--repeat', type=int, default=5, help="timed passes over the corpus per benchmark")
+    parser.add_argument('--only', action='append', help="run benchmarks whose name starts with this prefix")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--max-regression', type=float, default=0.15,
+                        help="allowed slowdown as a fraction of the baseline (default 0.15)")
+    parser.add_argument('--threshold', action='append', metavar='NAME=FRACTION',
+                        help="per-benchmark override of --max-regression")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.json) if args.json else None
+    thresholds = parse_thresholds(args.threshold)
+
+    bot_main = load_bot()
+    corpus = build_corpus(bot_main)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus_seed': CORPUS_SEED,
+        'corpus_size': len(corpus),
+        'results': run_benchmarks(define_benchmarks(bot_main, corpus), args.repeat, args.only),
+    }
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Baseline saved to {baseline_path}")
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print(f"\n⚠️ No baseline at {baseline_path}; run with --save-baseline first")
+        return 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare(report['results'], baseline, args.max_regression, thresholds)
+    if regressions:
+        print("\n❌ Regressions against baseline:")
+        for name, before, after, change in regressions:
+            print(f"  {name}: {before:.2f} -> {after:.2f} µs/op ({change:+.1%})")
+        return 1
+
+    print("\n✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,488 @@
+"""Load test for the Tic-Tac-Toe bot against a local fake Telegram Bot API.
+
+Starts a stand-in for the Bot API on localhost, points pyTelegramBotAPI at it,
+runs the real bot (polling, handlers, SQLite) in a scratch directory and drives
+simulated users through vs-AI, friend, quick-match, spectate and tournament flows.
+
+Usage:
+    python loadtest.py --users 50 --rate 200 --duration 60
+    python loadtest.py --flows vs_ai,quick_match --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import telebot
+
+BOT_USER = {'id': 424242, 'is_bot': True, 'first_name': 'TicTacToe', 'username': 'loadtest_bot'}
+FLOWS = ['vs_ai', 'friend', 'quick_match', 'spectate', 'tournament']
+REPLY_TIMEOUT = 10  # Seconds a simulated user waits for the bot before giving up
+
+# -------------------- FAKE BOT API --------------------
+class FakeBotAPI:
+    """In-process stand-in for the Bot API methods the bot uses.
+
+    Keeps the last text and inline keyboard of every message it "sent" so
+    simulated users can read their screen, and times every update from
+    injection to the bot's answer.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.lock = threading.Condition()
+        self.updates = []
+        self.next_update_id = 1
+        self.messages = defaultdict(dict)  # chat_id -> {message_id: {'text', 'markup'}}
+        self.next_message_id = defaultdict(lambda: 1)
+        self.chat_versions = defaultdict(int)
+        self.api_calls = defaultdict(int)
+        self.pending_callbacks = {}  # callback id -> (route, injected_at, event)
+        self.pending_messages = defaultdict(deque)  # chat_id -> [(route, injected_at)]
+        self.latencies = defaultdict(list)
+        self.completed = 0
+        self.errors = 0
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    content_type = self.headers.get('Content-Type', '')
+                    if content_type.startswith('application/json'):
+                        params.update(json.loads(body))
+                    elif content_type.startswith('application/x-www-form-urlencoded'):
+                        params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+                result = api.call(method, params)
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    # --- Bot API methods ---
+    def call(self, method, params):
+        with self.lock:
+            self.api_calls[method] += 1
+        handler = getattr(self, f"_api_{method}", None)
+        return handler(params) if handler else True
+
+    def _api_getMe(self, params):
+        return BOT_USER
+
+    def _api_getChat(self, params):
+        chat_id = int(params['chat_id'])
+        return {'id': chat_id, 'type': 'private', 'first_name': f"User{chat_id}"}
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self.lock:
+            while True:
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+                if self.updates or time.monotonic() >= deadline:
+                    return self.updates[:limit]
+                self.lock.wait(deadline - time.monotonic())
+
+    def _api_sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        with self.lock:
+            message_id = self.next_message_id[chat_id]
+            self.next_message_id[chat_id] += 1
+            self._store_message(chat_id, message_id, params)
+            if self.pending_messages[chat_id]:
+                route, injected_at = self.pending_messages[chat_id].popleft()
+                self._complete(route, injected_at)
+        return self._message_json(chat_id, message_id, params.get('text', ''))
+
+    def _api_editMessageText(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = int(params['message_id'])
+        with self.lock:
+            self._store_message(chat_id, message_id, params)
+        return self._message_json(chat_id, message_id, params.get('text', ''))
+
+    def _api_answerCallbackQuery(self, params):
+        with self.lock:
+            pending = self.pending_callbacks.pop(params.get('callback_query_id'), None)
+            if pending:
+                route, injected_at, event = pending
+                self._complete(route, injected_at)
+                if 'error occurred' in params.get('text', ''):
+                    self.errors += 1
+                event.set()
+        return True
+
+    def _store_message(self, chat_id, message_id, params):
+        markup = params.get('reply_markup')
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        buttons = [b for row in (markup or {}).get('inline_keyboard', []) for b in row]
+        self.messages[chat_id][message_id] = {'text': params.get('text', ''), 'buttons': buttons}
+        self.chat_versions[chat_id] += 1
+        self.lock.notify_all()
+
+    def _message_json(self, chat_id, message_id, text):
+        return {'message_id': message_id, 'date': int(time.time()), 'text': text,
+                'from': BOT_USER, 'chat': {'id': chat_id, 'type': 'private'}}
+
+    def _complete(self, route, injected_at):
+        self.latencies[route].append(time.perf_counter() - injected_at)
+        self.completed += 1
+
+    # --- Update injection ---
+    def inject(self, update, route, callback_id=None, chat_id=None):
+        """Queue an update for getUpdates; returns an Event set when a callback is answered"""
+        event = threading.Event()
+        with self.lock:
+            update['update_id'] = self.next_update_id
+            self.next_update_id += 1
+            injected_at = time.perf_counter()
+            if callback_id is not None:
+                self.pending_callbacks[callback_id] = (route, injected_at, event)
+            elif chat_id is not None:
+                self.pending_messages[chat_id].append((route, injected_at))
+            self.updates.append(update)
+            self.lock.notify_all()
+        return event
+
+    def wait_for_change(self, chat_id, version, timeout):
+        with self.lock:
+            self.lock.wait_for(lambda: self.chat_versions[chat_id] != version, timeout)
+            return self.chat_versions[chat_id]
+
+
+def start_bot(api, workdir=None, trace_rate=0.0):
+    """Import the bot, point it at `api` and start polling in a scratch directory"""
+    telebot.apihelper.API_URL = api.url + "/bot{0}/{1}"
+    os.chdir(workdir or tempfile.mkdtemp(prefix='tictactoe-loadtest-'))
+    os.environ.setdefault('BOT_TOKEN', '123456:loadtest')
+
+    import main
+    main.TRACE_SAMPLE_RATE = trace_rate
+    main.init_database()
+    threading.Thread(target=main.bot.infinity_polling,
+                     kwargs={'timeout': 10, 'long_polling_timeout': 1}, daemon=True).start()
+    return main
+
+# -------------------- SIMULATED USERS --------------------
+class RateLimiter:
+    """Token bucket shared by all simulated users (rate 0 = unlimited)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SimUser:
+    def __init__(self, user_id, api, limiter, route_of):
+        self.id = user_id
+        self.api = api
+        self.limiter = limiter
+        self.route_of = route_of
+        self.json = {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"}
+
+    def send_text(self, text):
+        self.limiter.wait()
+        message = {'message_id': random.randint(1, 2 ** 31), 'date': int(time.time()), 'text': text,
+                   'from': self.json, 'chat': {'id': self.id, 'type': 'private'}}
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        version = self.api.chat_versions[self.id]
+        self.api.inject({'message': message}, self.route_of(SimpleNamespace(text=text)), chat_id=self.id)
+        self.api.wait_for_change(self.id, version, REPLY_TIMEOUT)
+
+    def tap(self, message_id, data):
+        self.limiter.wait()
+        callback_id = f"{self.id}-{random.getrandbits(48)}"
+        screen = self.api.messages[self.id].get(message_id, {})
+        update = {'callback_query': {
+            'id': callback_id, 'from': self.json, 'chat_instance': str(self.id), 'data': data,
+            'message': {'message_id': message_id, 'date': int(time.time()), 'text': screen.get('text', ''),
+                        'from': BOT_USER, 'chat': {'id': self.id, 'type': 'private'}}}}
+        route = self.route_of(SimpleNamespace(data=data))
+        return self.api.inject(update, route, callback_id=callback_id).wait(REPLY_TIMEOUT)
+
+    def screen(self, message_id):
+        return self.api.messages[self.id].get(message_id, {'text': '', 'buttons': []})
+
+    def latest_message_id(self):
+        messages = self.api.messages[self.id]
+        return max(messages) if messages else None
+
+    def button(self, message_id, prefix):
+        for button in self.screen(message_id)['buttons']:
+            if button.get('callback_data', '').startswith(prefix):
+                return button['callback_data']
+        return None
+
+    def board_message_id(self):
+        """Most recent message showing a live board for this user"""
+        for message_id in sorted(self.api.messages[self.id], reverse=True):
+            if self.button(message_id, 'move_'):
+                return message_id
+        return None
+
+    def open_menu(self):
+        self.send_text('/start')
+        return self.latest_message_id()
+
+    def play(self, message_id, max_wait=REPLY_TIMEOUT):
+        """Play the game shown in `message_id` until it ends or the opponent stalls"""
+        while True:
+            version = self.api.chat_versions[self.id]
+            screen = self.screen(message_id)
+            free_cells = [b['callback_data'] for b in screen['buttons']
+                          if b.get('callback_data', '').startswith('move_') and b['text'] == '⬜']
+            if not self.button(message_id, 'move_') or not free_cells:
+                return True
+            if 'Your turn' in screen['text']:
+                self.tap(message_id, random.choice(free_cells))
+            elif self.api.wait_for_change(self.id, version, max_wait) == version:
+                resign = self.button(message_id, 'resign_')
+                if resign:
+                    self.tap(message_id, resign)
+                return False
+
+# -------------------- FLOWS --------------------
+def flow_vs_ai(a, b):
+    menu = a.open_menu()
+    a.tap(menu, 'vs_ai_menu')
+    a.tap(menu, f"ai_{random.choice(['easy', 'medium', 'hard', 'impossible'])}")
+    a.play(menu)
+
+
+def play_pair(a, b, a_message=None, b_message=None):
+    """Let both users play whatever boards they are shown, each in its own thread"""
+    def run(user, message_id):
+        deadline = time.monotonic() + REPLY_TIMEOUT
+        while message_id is None and time.monotonic() < deadline:
+            message_id = user.board_message_id()
+            if message_id is None:
+                user.api.wait_for_change(user.id, user.api.chat_versions[user.id], 0.5)
+        if message_id is not None:
+            user.play(message_id)
+
+    threads = [threading.Thread(target=run, args=(a, a_message)),
+               threading.Thread(target=run, args=(b, b_message))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def flow_friend(a, b):
+    menu = a.open_menu()
+    a.tap(menu, 'vs_friend_menu')
+    match = re.search(r'start=(\w+)', a.screen(menu)['text'])
+    if not match:
+        return
+    b.send_text(f"/start {match.group(1)}")
+    play_pair(a, b, menu, None)
+
+
+def flow_quick_match(a, b):
+    a_menu = a.open_menu()
+    b_menu = b.open_menu()
+    a.tap(a_menu, 'quick_match')
+    b.tap(b_menu, 'quick_match')
+    play_pair(a, b)
+    if a.button(a_menu, 'cancel_quick_match'):
+        a.tap(a_menu, 'cancel_quick_match')
+
+
+def flow_spectate(a, b):
+    menu = a.open_menu()
+    a.tap(menu, 'spectate')
+    game = a.button(menu, 'spectate_game_')
+    if not game:
+        return
+    a.tap(menu, game)
+    for _ in range(3):
+        refresh = a.button(menu, 'spectate_refresh_')
+        if not refresh:
+            break
+        a.tap(menu, refresh)
+        time.sleep(0.2)
+    stop = a.button(menu, 'stop_spectate_')
+    if stop:
+        a.tap(menu, stop)
+
+
+def flow_tournament(a, b):
+    menu = a.open_menu()
+    a.tap(menu, 'tournament_menu')
+    a.tap(menu, 'create_tournament')
+    a.send_text(f"Load Test {a.id}")
+    reply = a.latest_message_id()
+    a.tap(reply, 'tournament_players_4')
+    a.tap(reply, 'tournament_prize_glory')
+    created = a.latest_message_id()
+    view = a.button(created, 'view_tournament_')
+    if not view:
+        return
+    tournament_id = view.rsplit('_', 1)[-1]
+
+    b_menu = b.open_menu()
+    b.tap(b_menu, 'tournament_menu')
+    b.tap(b_menu, 'list_tournaments')
+    b.tap(b_menu, f"view_tournament_{tournament_id}")
+    b.tap(b_menu, f"join_tournament_direct_{tournament_id}")
+    a.tap(created, f"start_tournament_{tournament_id}")
+    play_pair(a, b)
+
+
+FLOW_FUNCTIONS = {
+    'vs_ai': flow_vs_ai,
+    'friend': flow_friend,
+    'quick_match': flow_quick_match,
+    'spectate': flow_spectate,
+    'tournament': flow_tournament,
+}
+
+# -------------------- REPORTING --------------------
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def build_report(api, elapsed):
+    routes = {}
+    for route, values in sorted(api.latencies.items()):
+        values = sorted(values)
+        routes[route] = {
+            'count': len(values),
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p90_ms': percentile(values, 0.90) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': values[-1] * 1000,
+        }
+    moves = routes.get('callback.move', {}).get('count', 0)
+    total_calls = sum(api.api_calls.values()) - api.api_calls.get('getUpdates', 0)
+    return {
+        'elapsed_s': elapsed,
+        'updates': api.completed,
+        'updates_per_s': api.completed / elapsed if elapsed else 0.0,
+        'errors': api.errors,
+        'moves': moves,
+        'api_calls': dict(api.api_calls),
+        'api_calls_per_move': total_calls / moves if moves else 0.0,
+        'routes': routes,
+    }
+
+
+def print_report(report):
+    print(f"\n⏱️  {report['elapsed_s']:.1f}s | {report['updates']} updates | "
+          f"{report['updates_per_s']:.1f} updates/s | {report['errors']} handler errors")
+    print(f"🎯 {report['moves']} moves | {report['api_calls_per_move']:.2f} API calls per move")
+    print(f"\n{'route':<28}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for route, row in report['routes'].items():
+        print(f"{route:<28}{row['count']:>8}{row['p50_ms']:>10.1f}{row['p90_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    print("\nAPI calls: " + ", ".join(f"{m}={n}" for m, n in sorted(report['api_calls'].items())))
+
+# -------------------- RUNNER --------------------
+def run_load_test(users, rate, duration, flows, trace_rate=0.0):
+    api = FakeBotAPI().start()
+    main = start_bot(api, trace_rate=trace_rate)
+    limiter = RateLimiter(rate)
+
+    sim_users = [SimUser(100000 + i, api, limiter, main.get_update_route) for i in range(max(2, users))]
+    main.ADMIN_IDS.extend(u.id for u in sim_users)  # Lets the tournament flow create tournaments
+    pairs = [(sim_users[i], sim_users[i + 1]) for i in range(0, len(sim_users) - 1, 2)]
+    stop_at = time.monotonic() + duration
+
+    def worker(a, b):
+        while time.monotonic() < stop_at:
+            try:
+                FLOW_FUNCTIONS[random.choice(flows)](a, b)
+            except Exception as e:
+                print(f"Flow error for users {a.id}/{b.id}: {e}")
+            a, b = b, a
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=pair, daemon=True) for pair in pairs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(duration + REPLY_TIMEOUT * 4)
+    elapsed = time.perf_counter() - started
+
+    main.bot.stop_polling()
+    api.stop()
+    return build_report(api, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot against a fake Bot API")
+    parser.add_argument('--users', type=int, default=20, help="simulated users (paired up)")
+    parser.add_argument('--rate', type=float, default=0, help="max injected updates per second (0 = unlimited)")
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run")
+    parser.add_argument('--flows', default=','.join(FLOWS), help="comma separated subset of: " + ', '.join(FLOWS))
+    parser.add_argument('--trace-rate', type=float, default=0.0, help="TRACE_SAMPLE_RATE for the bot under test")
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    flows = [f.strip() for f in args.flows.split(',') if f.strip()]
+    unknown = set(flows) - set(FLOWS)
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(sorted(unknown))}")
+
+    output = os.path.abspath(args.json) if args.json else None
+    report = run_load_test(args.users, args.rate, args.duration, flows, args.trace_rate)
+    print_report(report)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
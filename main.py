@@ -1,17 +1,35 @@
 import telebot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from telebot.apihelper import ApiTelegramException
 import uuid
 import json
 import os
+import io
+import sys
 import random
+import math
 import time
 import threading
-from datetime import datetime, timedelta
+import bisect
+import heapq
+import itertools
+import queue
+from datetime import datetime, timedelta, timezone
 import sqlite3
-from collections import defaultdict
+import gzip
+import csv
+import tempfile
+import argparse
+import hashlib
+import atexit
+import logging
+from logging.handlers import RotatingFileHandler
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from functools import wraps
+from collections import defaultdict, OrderedDict
 
 # -------------------- BOT CONFIGURATION --------------------
-BOT_TOKEN = ''  # Replace with your actual bot token
+BOT_TOKEN = os.environ.get('BOT_TOKEN', '')  # Replace with your actual bot token
 bot = telebot.TeleBot(BOT_TOKEN)
 
 # Admin Configuration
@@ -72,9 +90,248 @@ tournaments = {}
 spectators = defaultdict(set)
 game_history = defaultdict(list)
 quick_match_queue = []
-online_users = set()
+
+# -------------------- TRACING --------------------
+# Tracing Configuration
+TRACE_SAMPLE_RATE = 0.05  # Fraction of incoming updates that get traced (0 disables)
+TRACE_LOG_FILE = 'traces.jsonl'
+TRACE_LOG_MAX_BYTES = 10 * 1024 * 1024
+TRACE_LOG_BACKUP_COUNT = 5
+
+_trace_state = threading.local()
+_handler_state = threading.local()  # .active is set while an update handler runs
+_trace_logger = None
+_trace_logger_lock = threading.Lock()
+
+def _get_trace_logger():
+    global _trace_logger
+    with _trace_logger_lock:
+        if _trace_logger is None:
+            logger = logging.getLogger('tictactoe.traces')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(TRACE_LOG_FILE, maxBytes=TRACE_LOG_MAX_BYTES,
+                                          backupCount=TRACE_LOG_BACKUP_COUNT, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            _trace_logger = logger
+    return _trace_logger
+
+def _write_trace(trace):
+    """Write a finished trace as one Chrome trace event per line.
+
+    Wrap the lines in a JSON array to open them in chrome://tracing or Perfetto.
+    """
+    try:
+        logger = _get_trace_logger()
+        logger.info('\n'.join(json.dumps(event, ensure_ascii=False) for event in trace['events']))
+    except Exception as e:
+        print(f"Error writing trace: {e}")
+
+@contextmanager
+def trace_span(name, category='app', **args):
+    """Time a block as a span of the current trace (no-op when not sampled)"""
+    trace = getattr(_trace_state, 'trace', None)
+    if trace is None or not trace['sampled']:
+        yield
+        return
+    
+    start_wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        args['trace_id'] = trace['id']
+        trace['events'].append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int(start_wall * 1_000_000),
+            'dur': int((time.perf_counter() - start) * 1_000_000),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        })
+
+@contextmanager
+def trace_update(name, **args):
+    """Start a trace for one incoming update; nested calls become child spans"""
+    if getattr(_trace_state, 'trace', None) is not None:
+        # Re-dispatched update (e.g. a handler calling another handler)
+        with trace_span(name, 'handler', **args):
+            yield
+        return
+    
+    sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    _trace_state.trace = {'id': uuid.uuid4().hex[:16], 'sampled': sampled, 'events': []}
+    try:
+        with trace_span(name, 'update', **args):
+            yield
+    finally:
+        trace = _trace_state.trace
+        _trace_state.trace = None
+        if trace['sampled']:
+            _write_trace(trace)
+
+def traced(category, name=None):
+    """Decorator recording each call of a function as a span"""
+    def decorator(func):
+        span_name = name or func.__name__
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def get_update_route(update):
+    """Short route name for a message or callback query, used to label traces"""
+    data = getattr(update, 'data', None)
+    if data is not None:
+        return f"callback.{data.split('_')[0]}"
+    text = getattr(update, 'text', None) or ''
+    if text.startswith('/'):
+        return f"command.{text.split()[0][1:].split('@')[0]}"
+    return "message.text"
+
+def traced_handler(func):
+    """Decorator giving every update reaching a bot handler its own trace"""
+    @wraps(func)
+    def wrapper(update):
+        user = getattr(update, 'from_user', None)
+        if user is not None:
+            presence.touch(user.id)
+        if RECORD_UPDATES_FILE and getattr(_trace_state, 'trace', None) is None:
+            record_update(update)
+        outer = getattr(_handler_state, 'active', False)
+        _handler_state.active = True
+        try:
+            with trace_update(get_update_route(update), handler=func.__name__,
+                              user_id=getattr(user, 'id', None)):
+                return func(update)
+        finally:
+            _handler_state.active = outer
+    return wrapper
+
+def _trace_bot_api_calls(methods=('get_me', 'get_chat', 'send_message', 'edit_message_text',
+                                  'answer_callback_query', 'reply_to', 'send_document')):
+    """Record every Bot API call made through `bot` as an 'api' span"""
+    for method_name in methods:
+        method = getattr(bot, method_name, None)
+        if method is not None:
+            setattr(bot, method_name, traced('api', f"api.{method_name}")(method))
+
+_trace_bot_api_calls()
+
+# -------------------- UPDATE RECORDING --------------------
+# Opt-in recording of incoming updates for replay load tests (see replay.py)
+RECORD_UPDATES_FILE = None  # e.g. 'updates.ndjson.gz'; None disables recording
+RECORD_SALT = os.environ.get('RECORD_SALT') or uuid.uuid4().hex  # Keys the user ID pseudonyms
+RECORD_FLUSH_EVERY = 100  # Records buffered before flushing the gzip stream
+
+_record_lock = threading.Lock()
+_record_file = None
+_record_pending = 0
+
+def anonymize_user_id(user_id):
+    """Stable pseudonym for a user ID, unlinkable without RECORD_SALT"""
+    digest = hashlib.blake2b(str(user_id).encode(), key=RECORD_SALT.encode()[:64], digest_size=6).digest()
+    return int.from_bytes(digest, 'big')
+
+def _anonymize_argument(arg):
+    """Pseudonymize a numeric command argument, keep game/tournament IDs, mask anything else
+    
+    In `key=value` arguments the key is masked too; only the '=' is kept.
+    """
+    key, sep, value = arg.rpartition('=')
+    if value.isdigit():
+        value = str(anonymize_user_id(int(value)))
+    elif not (len(value) == 8 and all(c in '0123456789abcdef' for c in value)):
+        value = 'x' * len(value)
+    return 'x' * len(key) + sep + value
+
+def _anonymize_text(user_id, text):
+    """Keep command names and typed game/tournament IDs; pseudonymize user IDs and mask any other free text"""
+    if text.startswith('/'):
+        command, *args = text.split()
+        return ' '.join([command.split('@')[0]] + [_anonymize_argument(arg) for arg in args])
+    if user_input_state.get(user_id, {}).get('state') == 'join_tournament':
+        return text
+    return 'x' * len(text)
+
+def record_update(update):
+    """Append an anonymized, timestamped copy of an incoming update to RECORD_UPDATES_FILE"""
+    global _record_file, _record_pending
+    try:
+        user_id = update.from_user.id
+        record = {'t': round(time.time(), 3), 'user': anonymize_user_id(user_id)}
+        
+        if getattr(update, 'data', None) is not None:
+            record['kind'] = 'callback'
+            record['data'] = update.data
+            record['message_id'] = getattr(update.message, 'message_id', None)
+        else:
+            text = update.text or ''
+            record['kind'] = 'message'
+            record['chat_type'] = update.chat.type
+            record['text'] = _anonymize_text(user_id, text)
+            payload = text.split(' ')[1] if text.startswith('/start ') else None
+            if payload and payload in games:
+                record['invite_from'] = anonymize_user_id(games[payload]['players'][0])
+        
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with _record_lock:
+            if _record_file is None:
+                _record_file = gzip.open(RECORD_UPDATES_FILE, 'ab')
+            _record_file.write(line)
+            _record_pending += 1
+            if _record_pending >= RECORD_FLUSH_EVERY:
+                _record_file.flush()
+                _record_pending = 0
+    except Exception as e:
+        print(f"Error recording update: {e}")
+
+@atexit.register
+def close_update_recording():
+    global _record_file
+    with _record_lock:
+        if _record_file is not None:
+            _record_file.close()
+            _record_file = None
 
 # -------------------- DATABASE SETUP --------------------
+def add_missing_column(cursor, table, column, definition):
+    """Add a column to a table created by an older version of the bot"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def run_migrations():
+    """Apply the one-time data migrations in MIGRATIONS that haven't run yet"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name TEXT PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT name FROM schema_migrations')
+    applied = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    conn.close()
+    
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        print(f"🔧 Running migration {name}...")
+        migrate()
+        conn = sqlite3.connect('tictactoe_advanced.db')
+        conn.execute('INSERT OR IGNORE INTO schema_migrations (name) VALUES (?)', (name,))
+        conn.commit()
+        conn.close()
+
 def init_database():
     conn = sqlite3.connect('tictactoe_advanced.db')
     cursor = conn.cursor()
@@ -116,7 +373,8 @@ def init_database():
             duration INTEGER,
             moves_count INTEGER,
             board_state TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            move_log BLOB
         )
     ''')
     
@@ -135,7 +393,8 @@ def init_database():
             started_at TIMESTAMP,
             finished_at TIMESTAMP,
             winner_id INTEGER,
-            current_round INTEGER DEFAULT 1
+            current_round INTEGER DEFAULT 1,
+            format TEXT DEFAULT 'elimination'
         )
     ''')
     
@@ -169,155 +428,1303 @@ def init_database():
         )
     ''')
     
+    # Tournament events table (append-only log of tournament progress)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tournament_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tournament_id TEXT,
+            seq INTEGER,
+            event_type TEXT,
+            round_number INTEGER,
+            match_number INTEGER,
+            player_id INTEGER,
+            data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (tournament_id, seq)
+        )
+    ''')
+    
+    # Rating history table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rating_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            game_id TEXT,
+            rating_before INTEGER,
+            rating_after INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Checkpoint of an interrupted rating recompute (at most one row)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rating_recompute (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_history_id INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Which archive months hold each user's games, and each month's id range
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_user_months (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_months (
+            month TEXT PRIMARY KEY,
+            min_id INTEGER,
+            max_id INTEGER
+        )
+    ''')
+    
+    # Analytics rollups, kept up to date by save_game_history
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_games (
+            period TEXT,
+            bucket TEXT,
+            game_mode TEXT,
+            games INTEGER DEFAULT 0,
+            draws INTEGER DEFAULT 0,
+            total_duration INTEGER DEFAULT 0,
+            total_moves INTEGER DEFAULT 0,
+            PRIMARY KEY (period, bucket, game_mode)
+        ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_ai (
+            difficulty TEXT PRIMARY KEY,
+            games INTEGER DEFAULT 0,
+            ai_wins INTEGER DEFAULT 0,
+            human_wins INTEGER DEFAULT 0,
+            draws INTEGER DEFAULT 0
+        )
+    ''')
+    
+    # Daily HyperLogLog sketches of active users
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS presence_sketches (
+            day TEXT PRIMARY KEY,
+            registers BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Admin broadcasts; last_user_id is the resume checkpoint
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            status TEXT DEFAULT 'running',
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    
+    # Cross-process user_stats cache invalidations (USER_STATS_SHARED_INVALIDATION)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Columns added after the first release
+    add_missing_column(cursor, 'tournaments', 'format', "TEXT DEFAULT 'elimination'")
+    add_missing_column(cursor, 'game_history', 'move_log', 'BLOB')
+    add_missing_column(cursor, 'user_stats', 'blocked_at', 'TIMESTAMP')  # Set when a broadcast finds the bot blocked
+    add_missing_column(cursor, 'user_stats', 'friend_games', 'INTEGER DEFAULT 0')
+    add_missing_column(cursor, 'user_stats', 'achievement_bits', 'INTEGER DEFAULT 0')  # Replaces the JSON achievements
+    add_missing_column(cursor, 'user_stats', 'last_unlocked_bits', 'INTEGER DEFAULT 0')
+    
+    # Indexes
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tournaments_status_created
+        ON tournaments (status, created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_game_history_created
+        ON game_history (created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_game_history_player1
+        ON game_history (player1_id, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_game_history_player2
+        ON game_history (player2_id, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_rating_history_user
+        ON rating_history (user_id, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tournament_matches_round
+        ON tournament_matches (tournament_id, round_number)
+    ''')
+    
     conn.commit()
     conn.close()
+    
+    run_migrations()
+
+# -------------------- USER STATS CACHE --------------------
+USER_STATS_CACHE_SIZE = 5000  # Max cached user_stats rows
+USER_STATS_SHARED_INVALIDATION = False  # Enable when several bot processes share the database
+USER_STATS_INVALIDATION_POLL = 1.0  # Seconds between checks for other processes' writes
+USER_STATS_INVALIDATION_KEEP = 3600  # Seconds invalidation rows are kept
+
+class StatsCache:
+    """Thread-safe LRU of user_stats rows, kept current by the writers (write-through)
+    
+    Readers fill it on a miss. A read that raced with a write is not stored, so
+    a stale row never replaces a newer one.
+    """
+    
+    def __init__(self, max_size=USER_STATS_CACHE_SIZE):
+        self.max_size = max_size
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0  # Bumped by every write
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, user_id):
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                self.misses += 1
+                return None, self._generation
+            self._rows.move_to_end(user_id)
+            self.hits += 1
+            return dict(row), self._generation
+    
+    def fill(self, user_id, row, generation):
+        """Store a row read from the database unless a write happened since `generation`"""
+        with self._lock:
+            if generation == self._generation:
+                self._store(user_id, row)
+    
+    def put(self, user_id, row):
+        """Store a row just written to the database"""
+        with self._lock:
+            self._generation += 1
+            self._store(user_id, row)
+    
+    def update(self, user_id, changes):
+        with self._lock:
+            self._generation += 1
+            row = self._rows.get(user_id)
+            if row is not None:
+                row.update(changes)
+    
+    def invalidate(self, user_id=None):
+        """Drop one user's row, or every row"""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._rows.clear()
+            else:
+                self._rows.pop(user_id, None)
+    
+    def _store(self, user_id, row):
+        self._rows[user_id] = dict(row)
+        self._rows.move_to_end(user_id)
+        while len(self._rows) > self.max_size:
+            self._rows.popitem(last=False)
+
+user_stats_cache = StatsCache()
+
+def publish_stats_invalidation(cursor, user_ids):
+    """Tell other processes to drop cached rows, inside the writer's transaction; None means all"""
+    if USER_STATS_SHARED_INVALIDATION:
+        cursor.executemany('INSERT INTO user_stats_invalidations (user_id) VALUES (?)',
+                           [(user_id,) for user_id in user_ids])
+
+def _run_stats_invalidation_listener():
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM user_stats_invalidations').fetchone()[0]
+    last_pruned = time.monotonic()
+    while True:
+        time.sleep(USER_STATS_INVALIDATION_POLL)
+        try:
+            rows = conn.execute('''
+                SELECT id, user_id FROM user_stats_invalidations WHERE id > ? ORDER BY id
+            ''', (last_id,)).fetchall()
+            for last_id, user_id in rows:
+                user_stats_cache.invalidate(user_id)
+            
+            if time.monotonic() - last_pruned > USER_STATS_INVALIDATION_KEEP:
+                conn.execute("DELETE FROM user_stats_invalidations WHERE created_at < datetime('now', ?)",
+                             (f'-{USER_STATS_INVALIDATION_KEEP} seconds',))
+                conn.commit()
+                last_pruned = time.monotonic()
+        except Exception as e:
+            print(f"Error polling user_stats invalidations: {e}")
+
+def start_stats_invalidation_listener():
+    if USER_STATS_SHARED_INVALIDATION:
+        threading.Thread(target=_run_stats_invalidation_listener, name='stats-invalidation', daemon=True).start()
+
+def row_to_dict(cursor, row):
+    return dict(zip([description[0] for description in cursor.description], row))
 
 # -------------------- DATABASE OPERATIONS --------------------
+@traced('db')
 def get_user_stats(user_id):
+    cached, generation = user_stats_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
     conn = sqlite3.connect('tictactoe_advanced.db')
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
     result = cursor.fetchone()
     
     if result:
-        columns = [description[0] for description in cursor.description]
-        user_data = dict(zip(columns, result))
+        user_data = row_to_dict(cursor, result)
         conn.close()
-        return user_data
+        user_stats_cache.fill(user_id, user_data, generation)
+        return dict(user_data)
     
     conn.close()
     return None
 
+@traced('db')
 def update_user_stats(user_id, **kwargs):
     conn = sqlite3.connect('tictactoe_advanced.db')
     cursor = conn.cursor()
     
     # Check if user exists
-    if not get_user_stats(user_id):
+    created = not get_user_stats(user_id)
+    if created:
         cursor.execute('''
             INSERT INTO user_stats (user_id, name) VALUES (?, ?)
         ''', (user_id, kwargs.get('name', 'Player')))
     
     # Update stats
+    row = None
     if kwargs:
         set_clause = ', '.join([f'{key} = ?' for key in kwargs.keys()])
         values = list(kwargs.values()) + [user_id]
-        cursor.execute(f'UPDATE user_stats SET {set_clause}, last_active = CURRENT_TIMESTAMP WHERE user_id = ?', values)
+        cursor.execute(f'UPDATE user_stats SET {set_clause}, last_active = CURRENT_TIMESTAMP WHERE user_id = ? RETURNING *', values)
+        result = cursor.fetchone()
+        row = row_to_dict(cursor, result) if result else None
     
+    publish_stats_invalidation(cursor, [user_id])
     conn.commit()
     conn.close()
+    
+    if row:
+        user_stats_cache.put(user_id, row)
+    else:
+        user_stats_cache.invalidate(user_id)
+    
+    if 'name' in kwargs:
+        name_cache.invalidate(user_id)
 
-def save_game_history(game_data):
+@traced('db')
+def save_game_history(game_data, ai_outcome=None, is_draw=False):
+    """Insert a finished game and fold it into the analytics rollups in the same transaction
+    
+    `ai_outcome` is (difficulty, ai_won, human_won) for games against the bot.
+    A game without a winner that isn't a draw (an aborted game) adds to the
+    game totals only.
+    """
     conn = sqlite3.connect('tictactoe_advanced.db')
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO game_history (game_id, player1_id, player2_id, winner_id, game_mode, duration, moves_count, board_state)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', game_data)
-    conn.commit()
-    conn.close()
+    try:
+        cursor.execute('''
+            INSERT INTO game_history (game_id, player1_id, player2_id, winner_id, game_mode, duration, moves_count, move_log)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', game_data)
+        _, _, _, _, game_mode, duration, moves_count, _ = game_data
+        add_to_rollups(cursor, 'now', game_mode, 1, int(is_draw), duration, moves_count)
+        if ai_outcome:
+            difficulty, ai_won, human_won = ai_outcome
+            cursor.execute('''
+                INSERT INTO rollup_ai (difficulty, games, ai_wins, human_wins, draws) VALUES (?, 1, ?, ?, ?)
+                ON CONFLICT (difficulty) DO UPDATE SET
+                    games = games + 1,
+                    ai_wins = ai_wins + excluded.ai_wins,
+                    human_wins = human_wins + excluded.human_wins,
+                    draws = draws + excluded.draws
+            ''', (difficulty, int(ai_won), int(human_won), int(is_draw)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
+@traced('db')
 def get_game_history(user_id, limit=10):
-    conn = sqlite3.connect('tictactoe_advanced.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM game_history 
+    """A user's latest games, continuing into the monthly archives when needed"""
+    query = '''
+        SELECT id, game_id, player1_id, player2_id, winner_id, game_mode, duration, moves_count, created_at
+        FROM {table}
         WHERE player1_id = ? OR player2_id = ? 
-        ORDER BY created_at DESC 
+        ORDER BY id DESC 
         LIMIT ?
-    ''', (user_id, user_id, limit))
+    '''
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    cursor.execute(query.format(table='main.game_history'), (user_id, user_id, limit))
     results = cursor.fetchall()
+    
+    # Only the months the user played in, newest first
+    cursor.execute('SELECT month FROM archive_user_months WHERE user_id = ? ORDER BY month DESC', (user_id,))
+    for month in [row[0] for row in cursor.fetchall()]:
+        if len(results) >= limit:
+            break
+        with attached_archive(cursor, month):
+            cursor.execute(query.format(table='archive.game_history'), (user_id, user_id, limit - len(results)))
+            results.extend(cursor.fetchall())
+    
     conn.close()
     return results
 
-# -------------------- ENHANCED AI LOGIC --------------------
-class AdvancedAI:
-    def __init__(self, difficulty='medium'):
-        self.difficulty = difficulty
-        self.move_history = []
+@traced('db')
+def get_game_record(history_id):
+    query = '''
+        SELECT id, game_id, player1_id, player2_id, winner_id, game_mode, move_log, created_at
+        FROM {table} WHERE id = ?
+    '''
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute(query.format(table='main.game_history'), (history_id,))
+    row = cursor.fetchone()
     
-    def get_move(self, board, player_symbol):
-        if self.difficulty == 'easy':
-            return self._random_move(board)
-        elif self.difficulty == 'medium':
-            return self._medium_move(board, player_symbol)
-        elif self.difficulty == 'hard':
-            return self._minimax_move(board, player_symbol)
-        elif self.difficulty == 'impossible':
-            return self._impossible_move(board, player_symbol)
+    months = []
+    if not row:
+        cursor.execute('SELECT month FROM archive_months WHERE ? BETWEEN min_id AND max_id', (history_id,))
+        months = [month for month, in cursor.fetchall()]
+    for month in months:
+        with attached_archive(cursor, month):
+            cursor.execute(query.format(table='archive.game_history'), (history_id,))
+            row = cursor.fetchone()
+        if row:
+            break
     
-    def _random_move(self, board):
-        empty_cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE) if board[r][c] == EMPTY]
-        return random.choice(empty_cells) if empty_cells else (-1, -1)
+    conn.close()
+    return dict(row) if row else None
+
+# -------------------- ANALYTICS ROLLUPS --------------------
+ROLLUP_PERIODS = {'hour': '%Y-%m-%d %H:00', 'day': '%Y-%m-%d'}  # Period -> bucket format (UTC)
+DASHBOARD_DAYS = 30
+SPARKLINE_BLOCKS = '▁▂▃▄▅▆▇█'
+
+def add_to_rollups(cursor, created_at, game_mode, games, draws, duration, moves):
+    """Add game totals to the hour and day buckets containing `created_at` (a timestamp or 'now')"""
+    cursor.executemany('''
+        INSERT INTO rollup_games (period, bucket, game_mode, games, draws, total_duration, total_moves)
+        VALUES (?, strftime(?, ?), ?, ?, ?, ?, ?)
+        ON CONFLICT (period, bucket, game_mode) DO UPDATE SET
+            games = games + excluded.games,
+            draws = draws + excluded.draws,
+            total_duration = total_duration + excluded.total_duration,
+            total_moves = total_moves + excluded.total_moves
+    ''', [(period, bucket_format, created_at, game_mode, games, draws, duration or 0, moves or 0)
+          for period, bucket_format in ROLLUP_PERIODS.items()])
+
+def backfill_rollups():
+    """Build rollup_games from the games saved before rollups existed
     
-    def _medium_move(self, board, player_symbol):
-        # 70% chance to play optimally, 30% random
-        if random.random() < 0.7:
-            return self._minimax_move(board, player_symbol)
-        return self._random_move(board)
+    Old rows don't say whether a game without a winner was drawn or aborted,
+    so, as on a live save, only those that filled the board count as draws.
+    """
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    totals = defaultdict(lambda: [0, 0, 0, 0])
     
-    def _minimax_move(self, board, player_symbol):
-        opponent_symbol = PLAYER_X if player_symbol == PLAYER_O else PLAYER_O
-        best_score = -float('inf')
-        best_move = (-1, -1)
-        
-        for r in range(BOARD_SIZE):
-            for c in range(BOARD_SIZE):
-                if board[r][c] == EMPTY:
-                    board[r][c] = player_symbol
-                    score = self._minimax(board, 0, False, player_symbol, opponent_symbol)
-                    board[r][c] = EMPTY
-                    if score > best_score:
-                        best_score = score
-                        best_move = (r, c)
+    try:
+        # Totals are keyed by hour, so memory is bounded by the hours with games
+        columns = 'id, created_at, game_mode, winner_id, duration, moves_count'
+        for rows in iter_history_batches(cursor, columns, batch_size=MIGRATION_BATCH_SIZE):
+            for _, created_at, game_mode, winner_id, duration, moves_count in rows:
+                total = totals[(created_at[:13] + ':00:00', game_mode)]
+                total[0] += 1
+                total[1] += int(winner_id is None and (moves_count or 0) >= BOARD_SIZE * BOARD_SIZE)
+                total[2] += duration or 0
+                total[3] += moves_count or 0
         
-        return best_move
-    
-    def _impossible_move(self, board, player_symbol):
-        # Perfect play with strategic opening moves
-        move_count = sum(1 for row in board for cell in row if cell != EMPTY)
+        cursor.execute('DELETE FROM rollup_games')
+        for (hour, game_mode), total in totals.items():
+            add_to_rollups(cursor, hour, game_mode, *total)
+        cursor.execute('DELETE FROM rollup_ai')  # Difficulty wasn't saved with old games
+        conn.commit()
+    finally:
+        conn.close()
+
+def sparkline(values):
+    peak = max(values, default=0)
+    if not peak:
+        return SPARKLINE_BLOCKS[0] * len(values)
+    return ''.join(SPARKLINE_BLOCKS[round(value / peak * (len(SPARKLINE_BLOCKS) - 1))] for value in values)
+
+@traced('db')
+def get_dashboard_text():
+    """Admin dashboard built from the rollup tables only"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    try:
+        now = datetime.now(timezone.utc)
+        hours = [(now - timedelta(hours=i)).strftime(ROLLUP_PERIODS['hour']) for i in range(23, -1, -1)]
+        cursor.execute('''
+            SELECT bucket, SUM(games) FROM rollup_games
+            WHERE period = 'hour' AND bucket >= ?
+            GROUP BY bucket
+        ''', (hours[0],))
+        per_hour = dict(cursor.fetchall())
         
-        # Opening strategy
-        if move_count == 0:
-            return (1, 1)  # Center
-        elif move_count == 1:
-            if board[1][1] == EMPTY:
-                return (1, 1)  # Take center
-            else:
-                return (0, 0)  # Take corner
+        since = (now - timedelta(days=DASHBOARD_DAYS - 1)).strftime(ROLLUP_PERIODS['day'])
+        cursor.execute('''
+            SELECT game_mode, SUM(games), SUM(draws), SUM(total_duration), SUM(total_moves)
+            FROM rollup_games
+            WHERE period = 'day' AND bucket >= ?
+            GROUP BY game_mode
+            ORDER BY SUM(games) DESC
+        ''', (since,))
+        modes = cursor.fetchall()
         
-        return self._minimax_move(board, player_symbol)
+        cursor.execute('SELECT difficulty, games, ai_wins, human_wins, draws FROM rollup_ai ORDER BY games DESC')
+        ai_rows = cursor.fetchall()
+    finally:
+        conn.close()
     
-    def _minimax(self, board, depth, is_maximizing, max_player, min_player):
-        if self._check_win(board, max_player):
-            return 10 - depth
-        if self._check_win(board, min_player):
-            return depth - 10
-        if self._is_board_full(board):
-            return 0
-        
-        if is_maximizing:
-            best_score = -float('inf')
-            for r in range(BOARD_SIZE):
-                for c in range(BOARD_SIZE):
-                    if board[r][c] == EMPTY:
-                        board[r][c] = max_player
-                        score = self._minimax(board, depth + 1, False, max_player, min_player)
-                        board[r][c] = EMPTY
-                        best_score = max(score, best_score)
-            return best_score
-        else:
-            best_score = float('inf')
-            for r in range(BOARD_SIZE):
-                for c in range(BOARD_SIZE):
-                    if board[r][c] == EMPTY:
-                        board[r][c] = min_player
-                        score = self._minimax(board, depth + 1, True, max_player, min_player)
-                        board[r][c] = EMPTY
-                        best_score = min(score, best_score)
-            return best_score
+    hourly = [per_hour.get(hour, 0) for hour in hours]
+    active = presence.metrics()
+    text = f"📊 Dashboard\n\n"
+    text += f"👥 Online ({ONLINE_WINDOW_MINUTES} min): ~{active['online']}\n"
+    text += f"📅 DAU ~{active['dau']} | WAU ~{active['wau']} | MAU ~{active['mau']}\n\n"
+    text += f"🕐 Last 24h: {sum(hourly)} games (peak {max(hourly)}/h)\n"
+    text += f"{sparkline(hourly)}\n\n"
     
-    def _check_win(self, board, player):
+    total_games = sum(row[1] for row in modes)
+    text += f"🎮 Last {DASHBOARD_DAYS} days: {total_games} games\n"
+    for game_mode, games, draws, duration, moves in modes:
+        text += (f"• {game_mode}: {games} ({games / total_games:.0%}), "
+                 f"avg {duration / games:.0f}s, {moves / games:.1f} moves, {draws / games:.0%} draws\n")
+    
+    if ai_rows:
+        text += f"\n{EMOJI_AI} AI results (all time)\n"
+        for difficulty, games, ai_wins, human_wins, draws in ai_rows:
+            text += (f"• {difficulty.title()}: {games} games, AI {ai_wins / games:.0%} / "
+                     f"players {human_wins / games:.0%} / draws {draws / games:.0%}\n")
+    return text
+
+# -------------------- PRESENCE --------------------
+HLL_PRECISION = 12  # 4096 one-byte registers per sketch, ~1.6% standard error
+ONLINE_WINDOW_MINUTES = 5
+PRESENCE_KEEP_DAYS = 30  # Enough for MAU
+PRESENCE_SAVE_INTERVAL = 60
+
+class HyperLogLog:
+    """Fixed-size distinct counter over 64-bit hashes"""
+    _INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+    
+    def __init__(self, registers=None):
+        self.size = 1 << HLL_PRECISION
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+    
+    def add(self, hashed):
+        index = hashed >> (64 - HLL_PRECISION)
+        rank = (64 - HLL_PRECISION) - (hashed & ((1 << (64 - HLL_PRECISION)) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+    
+    def clear(self):
+        self.registers[:] = bytes(self.size)
+    
+    def count(self):
+        powers = self._INVERSE_POWERS
+        estimate = 0.7213 / (1 + 1.079 / self.size) * self.size ** 2 / sum(powers[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)  # Linear counting for small sets
+        return round(estimate)
+
+def hash_user_id(user_id):
+    return int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'big')
+
+class PresenceTracker:
+    """Online users over the last few minutes plus DAU/WAU/MAU, in constant memory
+    
+    Each update costs one hash and two register writes: one into the sketch
+    for the current minute (a ring of ONLINE_WINDOW_MINUTES slots, recycled
+    as minutes pass) and one into the sketch for the current UTC day.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.minutes = [HyperLogLog() for _ in range(ONLINE_WINDOW_MINUTES)]
+        self.minute_keys = [None] * ONLINE_WINDOW_MINUTES
+        self.days = OrderedDict()
+        self.dirty_days = set()
+    
+    def touch(self, user_id, now=None):
+        now = time.time() if now is None else now
+        hashed = hash_user_id(user_id)
+        minute = int(now // 60)
+        day = time.strftime('%Y-%m-%d', time.gmtime(now))
+        with self.lock:
+            slot = minute % ONLINE_WINDOW_MINUTES
+            if self.minute_keys[slot] is None or minute > self.minute_keys[slot]:
+                self.minutes[slot].clear()
+                self.minute_keys[slot] = minute
+            if minute == self.minute_keys[slot]:
+                self.minutes[slot].add(hashed)
+            
+            sketch = self.days.get(day)
+            if sketch is None:
+                sketch = self.days[day] = HyperLogLog()
+                while len(self.days) > PRESENCE_KEEP_DAYS:
+                    self.days.popitem(last=False)
+            sketch.add(hashed)
+            self.dirty_days.add(day)
+    
+    def _merged(self, sketches):
+        merged = HyperLogLog()
+        for sketch in sketches:
+            merged.merge(sketch)
+        return merged.count()
+    
+    def metrics(self, now=None):
+        now = time.time() if now is None else now
+        minute = int(now // 60)
+        today = datetime.fromtimestamp(now, timezone.utc).date()
+        recent_days = lambda n: {(today - timedelta(days=i)).isoformat() for i in range(n)}
+        with self.lock:
+            online = [sketch for key, sketch in zip(self.minute_keys, self.minutes)
+                      if key is not None and minute - key < ONLINE_WINDOW_MINUTES]
+            week, month = recent_days(7), recent_days(PRESENCE_KEEP_DAYS)
+            return {
+                'online': self._merged(online),
+                'dau': self.days[today.isoformat()].count() if today.isoformat() in self.days else 0,
+                'wau': self._merged(sketch for day, sketch in self.days.items() if day in week),
+                'mau': self._merged(sketch for day, sketch in self.days.items() if day in month),
+            }
+    
+    @traced('db')
+    def load(self):
+        """Restore the daily sketches saved by earlier runs"""
+        conn = sqlite3.connect('tictactoe_advanced.db')
+        try:
+            cutoff = (datetime.now(timezone.utc).date() - timedelta(days=PRESENCE_KEEP_DAYS - 1)).isoformat()
+            rows = conn.execute('''
+                SELECT day, registers FROM presence_sketches WHERE day >= ? ORDER BY day
+            ''', (cutoff,)).fetchall()
+            conn.execute('DELETE FROM presence_sketches WHERE day < ?', (cutoff,))
+            conn.commit()
+        finally:
+            conn.close()
+        with self.lock:
+            for day, registers in rows:
+                if len(registers) != 1 << HLL_PRECISION:
+                    continue
+                sketch = HyperLogLog(registers)
+                if day in self.days:
+                    sketch.merge(self.days[day])
+                self.days[day] = sketch
+            self.days = OrderedDict(sorted(self.days.items())[-PRESENCE_KEEP_DAYS:])
+    
+    @traced('db')
+    def save(self):
+        """Write the daily sketches changed since the last save"""
+        with self.lock:
+            rows = [(day, bytes(self.days[day].registers)) for day in self.dirty_days if day in self.days]
+            self.dirty_days.clear()
+        if not rows:
+            return
+        conn = sqlite3.connect('tictactoe_advanced.db')
+        try:
+            conn.executemany('''
+                INSERT INTO presence_sketches (day, registers) VALUES (?, ?)
+                ON CONFLICT (day) DO UPDATE SET registers = excluded.registers, updated_at = CURRENT_TIMESTAMP
+            ''', rows)
+            conn.commit()
+        except Exception as e:
+            print(f"Error saving presence sketches: {e}")
+            with self.lock:
+                self.dirty_days.update(day for day, _ in rows)
+        finally:
+            conn.close()
+
+presence = PresenceTracker()
+
+def _run_presence_saver():
+    while True:
+        time.sleep(PRESENCE_SAVE_INTERVAL)
+        presence.save()
+
+def start_presence_tracking():
+    presence.load()
+    atexit.register(presence.save)
+    threading.Thread(target=_run_presence_saver, name='presence-saver', daemon=True).start()
+
+# -------------------- ACHIEVEMENTS --------------------
+# Bit i of user_stats.achievement_bits is ACHIEVEMENTS[i]: only ever append.
+# Conditions are SQL over user_stats columns, written as {column}.
+ACHIEVEMENTS = [
+    {'id': 'first_win', 'name': 'First Victory', 'desc': 'Win your first game', 'icon': '🥇',
+     'condition': '{wins} >= 1'},
+    {'id': 'streak_5', 'name': 'Streak Master', 'desc': 'Win 5 games in a row', 'icon': '🔥',
+     'condition': '{current_streak} >= 5'},
+    {'id': 'ai_destroyer', 'name': 'AI Destroyer', 'desc': 'Beat the AI 10 times', 'icon': '🤖💥',
+     'condition': '{ai_wins} >= 10'},
+    {'id': 'social_player', 'name': 'Social Player', 'desc': 'Play 25 games with friends', 'icon': '👥',
+     'condition': '{friend_games} >= 25'},
+    {'id': 'veteran', 'name': 'Veteran', 'desc': 'Play 100 total games', 'icon': '🎖️',
+     'condition': '{total_games} >= 100'},
+    {'id': 'unbeatable', 'name': 'Unbeatable', 'desc': 'Win 10 games in a row', 'icon': '🛡️',
+     'condition': '{current_streak} >= 10'},
+    {'id': 'tournament_champion', 'name': 'Tournament Champion', 'desc': 'Win a tournament', 'icon': '🏆',
+     'condition': '{tournament_wins} >= 1'},
+    {'id': 'speed_demon', 'name': 'Speed Demon', 'desc': 'Win a game in under 10 seconds', 'icon': '⚡',
+     'condition': '{fastest_win} BETWEEN 1 AND 9'},
+    {'id': 'perfectionist', 'name': 'Perfectionist', 'desc': 'Win 5 games with your first three moves', 'icon': '💎',
+     'condition': '{perfect_games} >= 5'},
+]
+ACHIEVEMENT_BITS = {achievement['id']: 1 << i for i, achievement in enumerate(ACHIEVEMENTS)}
+FRIEND_GAME_MODES = ('friend_dm', 'group')  # Counted towards Social Player
+PERFECT_GAME_MOVES = 3  # A win with at most this many of the winner's own moves counts towards Perfectionist
+
+class _OldValues(dict):
+    def __missing__(self, column):
+        return column
+
+def achievement_assignments(new_values):
+    """SET clauses unlocking achievements inside an UPDATE of user_stats
+    
+    `new_values` maps each column the UPDATE changes to its new value as an
+    expression of the old row. Only achievements reading one of those columns
+    are checked, and last_unlocked_bits gets the bits this UPDATE added.
+    """
+    values = _OldValues({column: f'({expression})' for column, expression in new_values.items()})
+    earned = ' | '.join(
+        f"(CASE WHEN {achievement['condition'].format_map(values)} THEN {1 << i} ELSE 0 END)"
+        for i, achievement in enumerate(ACHIEVEMENTS)
+        if not new_values or any(f'{{{column}}}' in achievement['condition'] for column in new_values)
+    ) or '0'
+    return f"achievement_bits = achievement_bits | {earned}, last_unlocked_bits = ({earned}) & ~achievement_bits"
+
+def build_stats_update(new_values):
+    assignments = ', '.join(f'{column} = {expression}' for column, expression in new_values.items())
+    return f'''
+        UPDATE user_stats SET {assignments}, {achievement_assignments(new_values)},
+            last_active = CURRENT_TIMESTAMP
+        WHERE user_id = :user_id
+        RETURNING *
+    '''
+
+# One statement per player and game: counters, rating and achievements together
+GAME_RESULT_UPDATE = build_stats_update({
+    'wins': 'wins + :won',
+    'losses': 'losses + :lost',
+    'draws': 'draws + :drew',
+    'total_games': 'total_games + 1',
+    'current_streak': 'CASE WHEN :won THEN current_streak + 1 WHEN :lost THEN 0 ELSE current_streak END',
+    'longest_streak': 'MAX(longest_streak, CASE WHEN :won THEN current_streak + 1 ELSE 0 END)',
+    'ai_wins': 'ai_wins + (:vs_ai AND :won)',
+    'ai_losses': 'ai_losses + (:vs_ai AND :lost)',
+    'friend_games': 'friend_games + :friend_game',
+    'fastest_win': 'CASE WHEN :won AND (fastest_win = 0 OR :duration < fastest_win) THEN :duration ELSE fastest_win END',
+    'perfect_games': 'perfect_games + :perfect',
+    'elo_rating': 'elo_rating + :rating_change',
+})
+TOURNAMENT_WIN_UPDATE = build_stats_update({'tournament_wins': 'tournament_wins + 1'})
+
+def describe_achievements(bits):
+    return ', '.join(f"{achievement['icon']} {achievement['name']}"
+                     for i, achievement in enumerate(ACHIEVEMENTS) if bits >> i & 1)
+
+def count_achievements(stats):
+    return bin(stats.get('achievement_bits') or 0).count('1')
+
+@traced('db')
+def award_tournament_win(user_id):
+    """Count a tournament win; returns the achievement bits it unlocked"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    try:
+        cursor.execute(TOURNAMENT_WIN_UPDATE, {'user_id': user_id})
+        result = cursor.fetchone()
+        if result is None:
+            return 0
+        row = row_to_dict(cursor, result)
+        publish_stats_invalidation(cursor, [user_id])
+        conn.commit()
+        user_stats_cache.put(user_id, row)
+        return row['last_unlocked_bits']
+    except Exception as e:
+        print(f"Error awarding tournament win: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def migrate_achievements_to_bits():
+    """Fold the JSON achievement lists into achievement_bits, then award what the stats already earn"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    last_user_id = -2 ** 63
+    try:
+        while True:
+            cursor.execute('''
+                SELECT user_id, achievements FROM user_stats
+                WHERE user_id > ? AND achievements IS NOT NULL AND achievements NOT IN ('', '[]')
+                ORDER BY user_id LIMIT ?
+            ''', (last_user_id, MIGRATION_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            updates = []
+            for user_id, achievements in rows:
+                try:
+                    unlocked = json.loads(achievements)
+                except ValueError:
+                    unlocked = []
+                updates.append((sum(ACHIEVEMENT_BITS.get(a, 0) for a in set(unlocked)), user_id))
+            cursor.executemany('UPDATE user_stats SET achievement_bits = achievement_bits | ? WHERE user_id = ?', updates)
+            conn.commit()
+            last_user_id = rows[-1][0]
+        
+        cursor.execute(f'UPDATE user_stats SET {achievement_assignments({})}')
+        cursor.execute('UPDATE user_stats SET last_unlocked_bits = 0')
+        conn.commit()
+    finally:
+        conn.close()
+
+# -------------------- MOVE LOG --------------------
+MOVE_LOG_VERSION = 1  # Moves in play order, followed by time deltas
+MOVE_LOG_RECONSTRUCTED = 0  # Rebuilt from a final board: order approximate, no timing
+MOVE_LOG_TIME_UNIT = 0.1  # Seconds per time-delta step
+MIGRATION_BATCH_SIZE = 1000
+
+def encode_move_log(cells, times=None, start_time=0.0):
+    """Pack moves as [version, count, one cell index per move, varint time deltas]
+    
+    X always moves first, so a move's player follows from its position.
+    """
+    log = bytearray([MOVE_LOG_VERSION if times is not None else MOVE_LOG_RECONSTRUCTED, len(cells)])
+    log.extend(cells)
+    if times is not None:
+        previous = start_time
+        for moved_at in times:
+            delta = max(0, round((moved_at - previous) / MOVE_LOG_TIME_UNIT))
+            while delta >= 0x80:
+                log.append((delta & 0x7F) | 0x80)
+                delta >>= 7
+            log.append(delta)
+            previous = moved_at
+    return bytes(log)
+
+def encode_game_moves(game):
+    moves = game.get('move_history', [])
+    cells = [r * BOARD_SIZE + c for _, r, c, _ in moves]
+    times = [moved_at for _, _, _, moved_at in moves]
+    return encode_move_log(cells, times, game.get('start_time', times[0] if times else 0.0))
+
+def move_log_length(log):
+    return log[1] if log else 0
+
+def iter_move_log(log):
+    """Yield (row, col, seconds since the previous move or None), decoding as it goes"""
+    if not log:
+        return
+    count = log[1]
+    timed = log[0] == MOVE_LOG_VERSION
+    pos = 2 + count
+    for i in range(count):
+        delay = None
+        if timed:
+            value = shift = 0
+            while True:
+                byte = log[pos]
+                pos += 1
+                value |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            delay = value * MOVE_LOG_TIME_UNIT
+        row, col = divmod(log[2 + i], BOARD_SIZE)
+        yield row, col, delay
+
+def board_to_move_log(board):
+    """Move log for a final board saved before move logs existed (X and O interleaved)"""
+    cells = {PLAYER_X: [], PLAYER_O: []}
+    for r in range(BOARD_SIZE):
+        for c in range(BOARD_SIZE):
+            if board[r][c] in cells:
+                cells[board[r][c]].append(r * BOARD_SIZE + c)
+    x_cells, o_cells = cells[PLAYER_X], cells[PLAYER_O]
+    order = []
+    for i in range(max(len(x_cells), len(o_cells))):
+        order.extend(x_cells[i:i + 1] + o_cells[i:i + 1])
+    return encode_move_log(order)
+
+def migrate_board_state_to_move_log():
+    """Rewrite JSON board_state rows as move logs, one committed batch at a time"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    converted = 0
+    
+    try:
+        while True:
+            cursor.execute('''
+                SELECT id, board_state FROM game_history
+                WHERE move_log IS NULL AND board_state IS NOT NULL
+                LIMIT ?
+            ''', (MIGRATION_BATCH_SIZE,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            updates = []
+            for history_id, board_state in rows:
+                try:
+                    log = board_to_move_log(json.loads(board_state))
+                except (ValueError, TypeError, IndexError):
+                    log = encode_move_log([])
+                updates.append((log, history_id))
+            cursor.executemany('''
+                UPDATE game_history SET move_log = ?, board_state = NULL WHERE id = ?
+            ''', updates)
+            conn.commit()
+            converted += len(rows)
+    finally:
+        conn.close()
+    
+    if converted:
+        print(f"✅ Converted {converted} saved boards to move logs (run VACUUM to reclaim the space)")
+
+def index_existing_archives():
+    """Build the archive index for months archived before it existed"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    try:
+        for month in list_archive_months():
+            with attached_archive(cursor, month):
+                index_archived_games(cursor, month, 'archive.game_history')
+                conn.commit()
+    finally:
+        conn.close()
+
+MIGRATIONS = [
+    ('0001_game_history_move_log', migrate_board_state_to_move_log),
+    ('0002_archive_index', index_existing_archives),
+    ('0003_rollup_games_backfill', backfill_rollups),
+    ('0004_achievements_bitset', migrate_achievements_to_bits),
+]
+
+# -------------------- HISTORY ARCHIVE --------------------
+HISTORY_HOT_DAYS = 30  # Games older than this move out of the main database
+ARCHIVE_DIR = 'history_archive'  # One game_history_YYYY_MM.db file per month
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_BATCH_PAUSE = 0.2  # Seconds between batches, so live writes never wait long
+ARCHIVE_INTERVAL = 3600  # Seconds between archiver runs
+GAME_HISTORY_COLUMNS = ('id, game_id, player1_id, player2_id, winner_id, game_mode, '
+                        'duration, moves_count, board_state, created_at, move_log')
+
+def archive_path(month):
+    return os.path.join(ARCHIVE_DIR, f"game_history_{month.replace('-', '_')}.db")
+
+def list_archive_months(newest_first=True):
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    months = [name[len('game_history_'):-len('.db')].replace('_', '-')
+              for name in os.listdir(ARCHIVE_DIR)
+              if name.startswith('game_history_') and name.endswith('.db')]
+    return sorted(months, reverse=newest_first)
+
+@contextmanager
+def attached_archive(cursor, month, create=False):
+    """ATTACH one month's archive as `archive` for the duration of the block
+    
+    Commit before leaving the block: SQLite can't detach inside a transaction.
+    """
+    if create:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    cursor.execute('ATTACH DATABASE ? AS archive', (archive_path(month),))
+    try:
+        if create:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS archive.game_history (
+                    id INTEGER PRIMARY KEY,
+                    game_id TEXT,
+                    player1_id INTEGER,
+                    player2_id INTEGER,
+                    winner_id INTEGER,
+                    game_mode TEXT,
+                    duration INTEGER,
+                    moves_count INTEGER,
+                    board_state TEXT,
+                    created_at TIMESTAMP,
+                    move_log BLOB
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_game_history_player1 ON game_history (player1_id, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_game_history_player2 ON game_history (player2_id, id)')
+        yield
+    finally:
+        cursor.execute('DETACH DATABASE archive')
+
+def iter_history_batches(cursor, columns, after_id=0, where='1', params=(), batch_size=ARCHIVE_BATCH_SIZE,
+                         first_month=None, last_month=None):
+    """Yield game_history rows in id order, oldest archive first and the main table last
+    
+    The first selected column must be `id`. Archives outside first_month..last_month
+    ('YYYY-MM', inclusive) are skipped. Commit any writes made between batches
+    before asking for the next one.
+    """
+    sources = [(month, 'archive.game_history') for month in list_archive_months(newest_first=False)
+               if (not first_month or month >= first_month) and (not last_month or month <= last_month)]
+    sources.append((None, 'main.game_history'))
+    for month, table in sources:
+        with attached_archive(cursor, month) if month else nullcontext():
+            while True:
+                cursor.execute(f'''
+                    SELECT {columns} FROM {table}
+                    WHERE id > ? AND ({where})
+                    ORDER BY id LIMIT ?
+                ''', (after_id, *params, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                after_id = rows[-1][0]
+                yield rows
+
+def index_archived_games(cursor, month, table, where='1', params=()):
+    """Add the players and ids of the matching `table` rows to the index of `month`'s archive"""
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO main.archive_user_months (user_id, month)
+        SELECT player1_id, ? FROM {table} WHERE ({where}) AND player1_id IS NOT NULL
+        UNION
+        SELECT player2_id, ? FROM {table} WHERE ({where}) AND player2_id IS NOT NULL
+    ''', (month, *params, month, *params))
+    cursor.execute(f'''
+        INSERT INTO main.archive_months (month, min_id, max_id)
+        SELECT ?, min(id), max(id) FROM {table} WHERE {where} HAVING count(*) > 0
+        ON CONFLICT (month) DO UPDATE SET
+            min_id = min(min_id, excluded.min_id),
+            max_id = max(max_id, excluded.max_id)
+    ''', (month, *params))
+
+def archive_old_games():
+    """Move games older than HISTORY_HOT_DAYS into their monthly archive files"""
+    moved = 0
+    while True:
+        conn = sqlite3.connect('tictactoe_advanced.db', timeout=30)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                SELECT id, substr(created_at, 1, 7) FROM game_history
+                WHERE created_at < datetime('now', ?)
+                ORDER BY created_at LIMIT ?
+            ''', (f'-{HISTORY_HOT_DAYS} days', ARCHIVE_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            by_month = defaultdict(list)
+            for history_id, month in rows:
+                by_month[month].append(history_id)
+            
+            for month, ids in by_month.items():
+                placeholders = ', '.join('?' * len(ids))
+                with attached_archive(cursor, month, create=True):
+                    # Copy and delete in one transaction; INSERT OR IGNORE makes a retry after a crash harmless
+                    cursor.execute(f'''
+                        INSERT OR IGNORE INTO archive.game_history ({GAME_HISTORY_COLUMNS})
+                        SELECT {GAME_HISTORY_COLUMNS} FROM main.game_history WHERE id IN ({placeholders})
+                    ''', ids)
+                    index_archived_games(cursor, month, 'main.game_history', f'id IN ({placeholders})', ids)
+                    cursor.execute(f'DELETE FROM main.game_history WHERE id IN ({placeholders})', ids)
+                    conn.commit()
+                moved += len(ids)
+        except Exception as e:
+            print(f"Error archiving game history: {e}")
+            break
+        finally:
+            conn.close()
+        
+        time.sleep(ARCHIVE_BATCH_PAUSE)
+    
+    return moved
+
+def _run_history_archiver():
+    while True:
+        moved = archive_old_games()
+        if moved:
+            print(f"🗄️ Archived {moved} games older than {HISTORY_HOT_DAYS} days")
+        time.sleep(ARCHIVE_INTERVAL)
+
+def start_history_archiver():
+    threading.Thread(target=_run_history_archiver, name='history-archiver', daemon=True).start()
+
+# -------------------- RATINGS --------------------
+ELO_DEFAULT_RATING = 1200
+ELO_K_FACTOR = 32
+RATED_GAME_MODES = ('friend_dm', 'quick_match', 'tournament', 'group')  # Games against the bot are unrated
+RECOMPUTE_BATCH_SIZE = 5000
+
+def elo_deltas(rating1, rating2, score1):
+    """Rating changes for both players; score1 is 1, 0.5 or 0 from player 1's side"""
+    expected1 = 1 / (1 + 10 ** ((rating2 - rating1) / 400))
+    delta1 = round(ELO_K_FACTOR * (score1 - expected1))
+    return delta1, -delta1
+
+@traced('db')
+def record_game_result(game_id, players, winner_id, rated, game_mode='unknown', duration=0, own_moves=None):
+    """Apply a finished game's stat deltas, rating changes and achievements in one transaction
+    
+    `players` are the human players of the game and `own_moves` maps each to
+    the number of moves they made. Counters are updated in SQL, so the only
+    read is the two ratings of a rated game. Returns each player's rating
+    change and the achievement bits the game unlocked.
+    """
+    own_moves = own_moves or {}
+    rating_changes = {player_id: 0 for player_id in players}
+    unlocked = {player_id: 0 for player_id in players}
+    updated_rows = {}
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany('''
+            INSERT OR IGNORE INTO user_stats (user_id, name) VALUES (?, 'Player')
+        ''', [(player_id,) for player_id in players])
+        
+        if rated and len(players) == 2:
+            p1_id, p2_id = players
+            cursor.execute('''
+                SELECT user_id, elo_rating FROM user_stats WHERE user_id IN (?, ?)
+            ''', (p1_id, p2_id))
+            ratings = dict(cursor.fetchall())
+            score1 = 0.5 if winner_id is None else (1.0 if winner_id == p1_id else 0.0)
+            rating_changes[p1_id], rating_changes[p2_id] = elo_deltas(ratings[p1_id], ratings[p2_id], score1)
+            cursor.executemany('''
+                INSERT INTO rating_history (user_id, game_id, rating_before, rating_after)
+                VALUES (?, ?, ?, ?)
+            ''', [(player_id, game_id, ratings[player_id], ratings[player_id] + rating_changes[player_id])
+                  for player_id in players])
+        
+        for player_id in players:
+            won = int(winner_id == player_id)
+            cursor.execute(GAME_RESULT_UPDATE, {
+                'user_id': player_id,
+                'won': won,
+                'lost': int(winner_id is not None and not won),
+                'drew': int(winner_id is None),
+                'vs_ai': int(game_mode == 'vs_ai'),
+                'friend_game': int(game_mode in FRIEND_GAME_MODES),
+                'duration': max(duration, 1),
+                'perfect': int(won and own_moves.get(player_id, PERFECT_GAME_MOVES + 1) <= PERFECT_GAME_MOVES),
+                'rating_change': rating_changes[player_id],
+            })
+            updated_rows[player_id] = row_to_dict(cursor, cursor.fetchone())
+            unlocked[player_id] = updated_rows[player_id]['last_unlocked_bits']
+        
+        publish_stats_invalidation(cursor, players)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error recording game result: {e}")
+        raise
+    finally:
+        conn.close()
+    
+    # The UPDATE returned the new rows, so the cache is refreshed without another read
+    for player_id, row in updated_rows.items():
+        user_stats_cache.put(player_id, row)
+    return rating_changes, unlocked
+
+def recompute_ratings(batch_size=RECOMPUTE_BATCH_SIZE, restart=False):
+    """Rebuild every rating by replaying game_history (archives included) in order
+    
+    Each batch commits its rating history, the touched ratings and a checkpoint
+    together, so an interrupted run resumes where it stopped. Run it while the
+    bot is stopped.
+    """
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    processed = 0
+    
+    try:
+        cursor.execute('SELECT last_history_id FROM rating_recompute WHERE id = 1')
+        checkpoint = cursor.fetchone()
+        if restart or checkpoint is None:
+            cursor.execute('UPDATE user_stats SET elo_rating = ?', (ELO_DEFAULT_RATING,))
+            cursor.execute('DELETE FROM rating_history')
+            cursor.execute('INSERT OR REPLACE INTO rating_recompute (id, last_history_id) VALUES (1, 0)')
+            conn.commit()
+            last_id = 0
+        else:
+            last_id = checkpoint[0]
+            print(f"↩️ Resuming after game_history id {last_id}")
+        
+        ratings = {}  # user_id -> current rating, loaded the first time a player shows up
+        batches = iter_history_batches(
+            cursor, 'id, game_id, player1_id, player2_id, winner_id', after_id=last_id,
+            where=f"game_mode IN ({', '.join('?' * len(RATED_GAME_MODES))})",
+            params=RATED_GAME_MODES, batch_size=batch_size
+        )
+        for rows in batches:
+            unseen = list({p for row in rows for p in row[2:4] if p is not None and p not in ratings})
+            for i in range(0, len(unseen), 500):
+                chunk = unseen[i:i + 500]
+                cursor.execute(f'''
+                    SELECT user_id, elo_rating FROM user_stats WHERE user_id IN ({', '.join('?' * len(chunk))})
+                ''', chunk)
+                ratings.update(cursor.fetchall())
+            for player_id in unseen:
+                ratings.setdefault(player_id, ELO_DEFAULT_RATING)
+            
+            history = []
+            touched = set()
+            for _, game_id, p1_id, p2_id, winner_id in rows:
+                if p1_id is None or p2_id is None or p1_id == p2_id:
+                    continue
+                rating1, rating2 = ratings[p1_id], ratings[p2_id]
+                score1 = 0.5 if winner_id is None else (1.0 if winner_id == p1_id else 0.0)
+                delta1, delta2 = elo_deltas(rating1, rating2, score1)
+                ratings[p1_id], ratings[p2_id] = rating1 + delta1, rating2 + delta2
+                history.append((p1_id, game_id, rating1, rating1 + delta1))
+                history.append((p2_id, game_id, rating2, rating2 + delta2))
+                touched.update((p1_id, p2_id))
+            
+            last_id = rows[-1][0]
+            cursor.executemany('''
+                INSERT INTO rating_history (user_id, game_id, rating_before, rating_after)
+                VALUES (?, ?, ?, ?)
+            ''', history)
+            cursor.executemany('''
+                UPDATE user_stats SET elo_rating = ? WHERE user_id = ?
+            ''', [(ratings[player_id], player_id) for player_id in touched])
+            cursor.execute('''
+                UPDATE rating_recompute SET last_history_id = ?, updated_at = CURRENT_TIMESTAMP WHERE id = 1
+            ''', (last_id,))
+            conn.commit()
+            
+            processed += len(rows)
+            print(f"📈 {processed} games replayed (up to id {last_id})")
+        
+        cursor.execute('DELETE FROM rating_recompute')
+        publish_stats_invalidation(cursor, [None])
+        conn.commit()
+        print(f"✅ Ratings recomputed for {len(ratings)} players")
+    except Exception as e:
+        print(f"Error recomputing ratings: {e}")
+    finally:
+        conn.close()
+        user_stats_cache.invalidate()
+    
+    return processed
+
+# -------------------- ENHANCED AI LOGIC --------------------
+class AdvancedAI:
+    def __init__(self, difficulty='medium'):
+        self.difficulty = difficulty
+        self.move_history = []
+    
+    @traced('ai', 'ai.get_move')
+    def get_move(self, board, player_symbol):
+        if self.difficulty == 'easy':
+            return self._random_move(board)
+        elif self.difficulty == 'medium':
+            return self._medium_move(board, player_symbol)
+        elif self.difficulty == 'hard':
+            return self._minimax_move(board, player_symbol)
+        elif self.difficulty == 'impossible':
+            return self._impossible_move(board, player_symbol)
+    
+    def _random_move(self, board):
+        empty_cells = [(r, c) for r in range(BOARD_SIZE) for c in range(BOARD_SIZE) if board[r][c] == EMPTY]
+        return random.choice(empty_cells) if empty_cells else (-1, -1)
+    
+    def _medium_move(self, board, player_symbol):
+        # 70% chance to play optimally, 30% random
+        if random.random() < 0.7:
+            return self._minimax_move(board, player_symbol)
+        return self._random_move(board)
+    
+    def _minimax_move(self, board, player_symbol):
+        opponent_symbol = PLAYER_X if player_symbol == PLAYER_O else PLAYER_O
+        best_score = -float('inf')
+        best_move = (-1, -1)
+        
+        for r in range(BOARD_SIZE):
+            for c in range(BOARD_SIZE):
+                if board[r][c] == EMPTY:
+                    board[r][c] = player_symbol
+                    score = self._minimax(board, 0, False, player_symbol, opponent_symbol)
+                    board[r][c] = EMPTY
+                    if score > best_score:
+                        best_score = score
+                        best_move = (r, c)
+        
+        return best_move
+    
+    def _impossible_move(self, board, player_symbol):
+        # Perfect play with strategic opening moves
+        move_count = sum(1 for row in board for cell in row if cell != EMPTY)
+        
+        # Opening strategy
+        if move_count == 0:
+            return (1, 1)  # Center
+        elif move_count == 1:
+            if board[1][1] == EMPTY:
+                return (1, 1)  # Take center
+            else:
+                return (0, 0)  # Take corner
+        
+        return self._minimax_move(board, player_symbol)
+    
+    def _minimax(self, board, depth, is_maximizing, max_player, min_player):
+        if self._check_win(board, max_player):
+            return 10 - depth
+        if self._check_win(board, min_player):
+            return depth - 10
+        if self._is_board_full(board):
+            return 0
+        
+        if is_maximizing:
+            best_score = -float('inf')
+            for r in range(BOARD_SIZE):
+                for c in range(BOARD_SIZE):
+                    if board[r][c] == EMPTY:
+                        board[r][c] = max_player
+                        score = self._minimax(board, depth + 1, False, max_player, min_player)
+                        board[r][c] = EMPTY
+                        best_score = max(score, best_score)
+            return best_score
+        else:
+            best_score = float('inf')
+            for r in range(BOARD_SIZE):
+                for c in range(BOARD_SIZE):
+                    if board[r][c] == EMPTY:
+                        board[r][c] = min_player
+                        score = self._minimax(board, depth + 1, True, max_player, min_player)
+                        board[r][c] = EMPTY
+                        best_score = min(score, best_score)
+            return best_score
+    
+    def _check_win(self, board, player):
         # Check rows, columns, and diagonals
         for i in range(BOARD_SIZE):
             if all(board[i][j] == player for j in range(BOARD_SIZE)):
@@ -336,11 +1743,227 @@ class AdvancedAI:
         return all(cell != EMPTY for row in board for cell in row)
 
 # -------------------- TOURNAMENT SYSTEM --------------------
+TOURNAMENT_FORMATS = {
+    'elimination': "🥊 Single Elimination",
+    'swiss': "🇨🇭 Swiss",
+    'round_robin': "🔁 Round Robin"
+}
+DEFAULT_TOURNAMENT_FORMAT = 'elimination'
+SWISS_PAIRING_WINDOW = 32  # Candidates looked at below a player to avoid a rematch
+
+def new_match(player1, player2):
+    return {'player1': player1, 'player2': player2, 'winner': None, 'game_id': None, 'status': 'pending'}
+
+def new_bye(player):
+    """A bye is a completed match without an opponent, won by its only player"""
+    return {'player1': player, 'player2': None, 'winner': player, 'game_id': None, 'status': 'completed'}
+
+def pair_in_order(players):
+    """Pair neighbours; an odd player out gets a bye instead of being dropped"""
+    matches = [new_match(players[i], players[i + 1]) for i in range(0, len(players) - 1, 2)]
+    if len(players) % 2:
+        matches.append(new_bye(players[-1]))
+    return matches
+
+def pair_swiss(ranking, standings):
+    """Pair a ranked field within score groups, floating down to avoid rematches
+    
+    Each player takes the highest-ranked free opponent they haven't met, looking
+    at most SWISS_PAIRING_WINDOW candidates ahead, so a round is linear in the
+    field size. A rematch the greedy pass can't avoid is repaired by swapping
+    partners with one of the SWISS_PAIRING_WINDOW pairs above it. The bye goes
+    to the lowest-ranked player who hasn't had one.
+    """
+    ranking = list(ranking)
+    matches = []
+    if len(ranking) % 2:
+        bye_index = next((i for i in range(len(ranking) - 1, -1, -1) if not standings[ranking[i]]['byes']),
+                         len(ranking) - 1)
+        matches.append(new_bye(ranking.pop(bye_index)))
+    
+    paired = [False] * len(ranking)
+    for i, player in enumerate(ranking):
+        if paired[i]:
+            continue
+        paired[i] = True
+        opponents = standings[player]['opponents']
+        first_free = None
+        chosen = None
+        scanned = 0
+        for j in range(i + 1, len(ranking)):
+            if paired[j]:
+                continue
+            if first_free is None:
+                first_free = j
+            if ranking[j] not in opponents:
+                chosen = j
+                break
+            scanned += 1
+            if scanned >= SWISS_PAIRING_WINDOW:
+                break
+        if chosen is None:
+            chosen = first_free
+        paired[chosen] = True
+        matches.append(new_match(player, ranking[chosen]))
+    
+    # The greedy pass can leave two players who already met at the bottom of the
+    # field; swap partners with a nearby pair above them instead
+    for m in range(len(matches) - 1, -1, -1):
+        player1, player2 = matches[m]['player1'], matches[m]['player2']
+        if player2 is None or player2 not in standings[player1]['opponents']:
+            continue
+        for k in range(m - 1, max(-1, m - 1 - SWISS_PAIRING_WINDOW), -1):
+            other1, other2 = matches[k]['player1'], matches[k]['player2']
+            if other2 is None:
+                continue
+            swap = next(((pair1, pair2) for pair1, pair2 in (((other1, player1), (other2, player2)),
+                                                             ((other1, player2), (other2, player1)))
+                         if pair1[1] not in standings[pair1[0]]['opponents']
+                         and pair2[1] not in standings[pair2[0]]['opponents']), None)
+            if swap:
+                matches[k], matches[m] = new_match(*swap[0]), new_match(*swap[1])
+                break
+    return matches
+
+def pair_round_robin(players, round_number):
+    """Circle-method pairings for a 1-based round; odd fields rotate the bye"""
+    field = list(players) + ([None] if len(players) % 2 else [])
+    rest = field[1:]
+    shift = (round_number - 1) % len(rest)
+    order = [field[0]] + rest[len(rest) - shift:] + rest[:len(rest) - shift]
+    
+    matches = []
+    for i in range(len(order) // 2):
+        player1, player2 = order[i], order[-1 - i]
+        if round_number % 2 == 0:
+            player1, player2 = player2, player1
+        if player1 is None or player2 is None:
+            matches.append(new_bye(player1 if player2 is None else player2))
+        else:
+            matches.append(new_match(player1, player2))
+    return matches
+
+def count_tournament_rounds(tournament_format, players):
+    if tournament_format == 'round_robin':
+        return players - 1 if players % 2 == 0 else players
+    rounds = max(1, math.ceil(math.log2(players))) if players > 1 else 1
+    if tournament_format == 'swiss':
+        return min(rounds, max(1, players - 1))
+    return rounds
+
+def new_standing():
+    return {'points': 0.0, 'wins': 0, 'draws': 0, 'losses': 0, 'byes': 0, 'opponents': set()}
+
 class TournamentManager:
+    """Tournaments persisted in SQLite and rehydrated into memory on first access
+    
+    Progress after the start is a sequence of events (round_opened, match_started,
+    match_won/match_drawn, round_closed, tournament_finished). Events are applied
+    to the in-memory tournament by _apply_event under the tournament's lock and
+    written, together with the tournament_matches/tournaments rows they change,
+    in one transaction per batch.
+    """
+    
     def __init__(self):
         self.tournaments = {}
+        self._load_lock = threading.Lock()
+        self._listing = None  # Cached open/active tournaments, dropped on every change
+        self._listing_generation = 0
+    
+    def invalidate_listing(self):
+        self._listing_generation += 1
+        self._listing = None
+    
+    def get_tournament(self, tournament_id):
+        """Return the live tournament, loading it (and its bracket) from the database if needed"""
+        tournament = self.tournaments.get(tournament_id)
+        if tournament is not None:
+            return tournament
+        
+        with self._load_lock:
+            if tournament_id not in self.tournaments:
+                tournament = self._load_tournament(tournament_id)
+                if tournament is None:
+                    return None
+                self.tournaments[tournament_id] = tournament
+            return self.tournaments[tournament_id]
+    
+    @traced('db')
+    def _load_tournament(self, tournament_id):
+        conn = sqlite3.connect('tictactoe_advanced.db')
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('SELECT * FROM tournaments WHERE tournament_id = ?', (tournament_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            cursor.execute('''
+                SELECT user_id FROM tournament_participants WHERE tournament_id = ? ORDER BY id
+            ''', (tournament_id,))
+            participants = [r['user_id'] for r in cursor.fetchall()]
+            
+            cursor.execute('''
+                SELECT round_number, player1_id, player2_id, winner_id, game_id, status
+                FROM tournament_matches WHERE tournament_id = ?
+                ORDER BY round_number, match_number
+            ''', (tournament_id,))
+            bracket = defaultdict(list)
+            for m in cursor.fetchall():
+                bracket[m['round_number']].append({
+                    'player1': m['player1_id'],
+                    'player2': m['player2_id'],
+                    'winner': m['winner_id'],
+                    'game_id': m['game_id'],
+                    'status': m['status']
+                })
+            
+            tournament = {
+                'id': tournament_id,
+                'name': row['name'],
+                'creator': row['creator_id'],
+                'participants': participants,
+                'status': row['status'],
+                'max_players': row['max_players'],
+                'prize_pool': row['prize_pool'] or "Glory",
+                'format': row['format'] or DEFAULT_TOURNAMENT_FORMAT,
+                'bracket': dict(bracket),
+                'current_round': row['current_round'] or 1,
+                'total_rounds': None,
+                'winner': row['winner_id'],
+                'standings': {},
+                'ranking': None,
+                'open_matches': 0,
+                'event_seq': 0,
+                'lock': threading.RLock(),
+                'matches': {},
+                'created_at': time.time()
+            }
+            
+            # Standings are rebuilt once here and then kept up to date per result
+            if tournament['status'] != 'waiting':
+                self._init_standings(tournament)
+                for round_matches in tournament['bracket'].values():
+                    for match in round_matches:
+                        if match['status'] == 'completed':
+                            self._apply_result(tournament, match)
+            
+            current_matches = tournament['bracket'].get(tournament['current_round'], [])
+            tournament['open_matches'] = sum(1 for m in current_matches if m['status'] != 'completed')
+            cursor.execute('SELECT MAX(seq) FROM tournament_events WHERE tournament_id = ?', (tournament_id,))
+            tournament['event_seq'] = cursor.fetchone()[0] or 0
+            return tournament
+        except Exception as e:
+            print(f"Error loading tournament: {e}")
+            return None
+        finally:
+            conn.close()
     
-    def create_tournament(self, creator_id, name, max_players=8, prize_pool="Glory"):
+    @traced('db')
+    def create_tournament(self, creator_id, name, max_players=8, prize_pool="Glory",
+                          tournament_format=DEFAULT_TOURNAMENT_FORMAT):
         tournament_id = str(uuid.uuid4())[:8]
         
         conn = sqlite3.connect('tictactoe_advanced.db')
@@ -348,9 +1971,9 @@ class TournamentManager:
         
         try:
             cursor.execute('''
-                INSERT INTO tournaments (tournament_id, name, creator_id, max_players, prize_pool, current_players)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (tournament_id, name, creator_id, max_players, prize_pool, 1))
+                INSERT INTO tournaments (tournament_id, name, creator_id, max_players, prize_pool, current_players, format)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (tournament_id, name, creator_id, max_players, prize_pool, 1, tournament_format))
             
             cursor.execute('''
                 INSERT INTO tournament_participants (tournament_id, user_id)
@@ -367,11 +1990,20 @@ class TournamentManager:
                 'status': 'waiting',
                 'max_players': max_players,
                 'prize_pool': prize_pool,
+                'format': tournament_format,
                 'bracket': {},
                 'current_round': 1,
+                'total_rounds': None,
+                'winner': None,
+                'standings': {},
+                'ranking': None,
+                'open_matches': 0,
+                'event_seq': 0,
+                'lock': threading.RLock(),
                 'matches': {},
                 'created_at': time.time()
             }
+            self.invalidate_listing()
             
             return tournament_id
         except Exception as e:
@@ -380,163 +2012,295 @@ class TournamentManager:
         finally:
             conn.close()
     
+    @traced('db')
     def join_tournament(self, tournament_id, user_id):
-        if tournament_id not in self.tournaments:
+        tournament = self.get_tournament(tournament_id)
+        if not tournament:
             return False, "Tournament not found"
         
-        tournament = self.tournaments[tournament_id]
-        
-        if tournament['status'] != 'waiting':
-            return False, "Tournament has already started"
-        
-        if len(tournament['participants']) >= tournament['max_players']:
-            return False, "Tournament is full"
-        
-        if user_id in tournament['participants']:
-            return False, "You're already in this tournament"
-        
-        tournament['participants'].append(user_id)
-        
-        conn = sqlite3.connect('tictactoe_advanced.db')
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO tournament_participants (tournament_id, user_id)
-                VALUES (?, ?)
-            ''', (tournament_id, user_id))
+        with tournament['lock']:
+            if tournament['status'] != 'waiting':
+                return False, "Tournament has already started"
             
-            cursor.execute('''
-                UPDATE tournaments SET current_players = ? WHERE tournament_id = ?
-            ''', (len(tournament['participants']), tournament_id))
+            if len(tournament['participants']) >= tournament['max_players']:
+                return False, "Tournament is full"
             
-            conn.commit()
-            return True, "Successfully joined tournament"
-        except Exception as e:
-            print(f"Error joining tournament: {e}")
-            return False, "Database error"
-        finally:
-            conn.close()
+            if user_id in tournament['participants']:
+                return False, "You're already in this tournament"
+            
+            conn = sqlite3.connect('tictactoe_advanced.db')
+            cursor = conn.cursor()
+            
+            try:
+                cursor.execute('''
+                    INSERT INTO tournament_participants (tournament_id, user_id)
+                    VALUES (?, ?)
+                ''', (tournament_id, user_id))
+                
+                cursor.execute('''
+                    UPDATE tournaments SET current_players = ? WHERE tournament_id = ?
+                ''', (len(tournament['participants']) + 1, tournament_id))
+                
+                conn.commit()
+            except Exception as e:
+                print(f"Error joining tournament: {e}")
+                return False, "Database error"
+            finally:
+                conn.close()
+            
+            tournament['participants'].append(user_id)
+        
+        self.invalidate_listing()
+        return True, "Successfully joined tournament"
     
+    @traced('db')
     def start_tournament(self, tournament_id, starter_id):
-        if tournament_id not in self.tournaments:
+        tournament = self.get_tournament(tournament_id)
+        if not tournament:
             return False, "Tournament not found"
         
-        tournament = self.tournaments[tournament_id]
-        
         if tournament['creator'] != starter_id and starter_id not in ADMIN_IDS:
             return False, "Only the creator or admin can start the tournament"
         
-        if len(tournament['participants']) < 2:
-            return False, "Need at least 2 players to start"
+        with tournament['lock']:
+            if len(tournament['participants']) < 2:
+                return False, "Need at least 2 players to start"
+            
+            if tournament['status'] != 'waiting':
+                return False, "Tournament has already started"
+            
+            events = []
+            self._new_event(tournament, events, 'tournament_started')
+            self._new_event(tournament, events, 'round_opened', 1,
+                            data={'pairs': self._pairs(self._pair_round(tournament, 1))})
+            
+            try:
+                # The status change and all first round matches go in one transaction
+                self._persist_events(tournament, events)
+            except Exception as e:
+                print(f"Error starting tournament: {e}")
+                return False, "Database error"
+            
+            self._init_standings(tournament)
+            for event in events:
+                self._apply_event(tournament, event)
         
-        tournament['status'] = 'active'
-        tournament['bracket'] = self._create_bracket(tournament['participants'])
+        self.invalidate_listing()
+        return True, "Tournament started successfully"
+    
+    def _init_standings(self, tournament):
+        tournament['standings'] = {player_id: new_standing() for player_id in tournament['participants']}
+        tournament['ranking'] = None
+        tournament['total_rounds'] = count_tournament_rounds(tournament['format'], len(tournament['participants']))
+    
+    def _pair_round(self, tournament, round_number):
+        """Matches for a round of the tournament's format"""
+        tournament_format = tournament['format']
+        if tournament_format == 'round_robin':
+            return pair_round_robin(tournament['participants'], round_number)
         
-        conn = sqlite3.connect('tictactoe_advanced.db')
-        cursor = conn.cursor()
+        if round_number == 1:
+            field = tournament['participants'][:]
+            random.shuffle(field)
+            return pair_in_order(field)
+        
+        if tournament_format == 'swiss':
+            return pair_swiss(self.get_ranking(tournament), tournament['standings'])
+        
+        winners = [match['winner'] for match in tournament['bracket'][round_number - 1]]
+        if len(winners) % 2:
+            # Pass the bye on to the last winner who hasn't had one yet
+            standings = tournament['standings']
+            bye_index = next((i for i in range(len(winners) - 1, -1, -1) if not standings[winners[i]]['byes']),
+                             len(winners) - 1)
+            winners.append(winners.pop(bye_index))
+        return pair_in_order(winners)
+    
+    def _apply_result(self, tournament, match):
+        """Fold one finished match into the standings"""
+        standings = tournament['standings']
+        player1, player2, winner = match['player1'], match['player2'], match['winner']
+        if player2 is None:
+            standings[player1]['points'] += 1
+            standings[player1]['byes'] += 1
+        else:
+            standings[player1]['opponents'].add(player2)
+            standings[player2]['opponents'].add(player1)
+            if winner is None:
+                for player_id in (player1, player2):
+                    standings[player_id]['points'] += 0.5
+                    standings[player_id]['draws'] += 1
+            else:
+                loser = player2 if winner == player1 else player1
+                standings[winner]['points'] += 1
+                standings[winner]['wins'] += 1
+                standings[loser]['losses'] += 1
+        tournament['ranking'] = None
+    
+    def get_ranking(self, tournament):
+        """Participants ordered by points, then wins; cached until the next result"""
+        ranking = tournament.get('ranking')
+        if ranking is None:
+            standings = tournament['standings']
+            seed = {player_id: i for i, player_id in enumerate(tournament['participants'])}
+            ranking = sorted(standings, key=lambda p: (-standings[p]['points'], -standings[p]['wins'], seed[p]))
+            tournament['ranking'] = ranking
+        return ranking
+    
+    @staticmethod
+    def _pairs(matches):
+        return [[match['player1'], match['player2']] for match in matches]
+    
+    def _new_event(self, tournament, events, event_type, round_number=None, match_number=None, player_id=None, data=None):
+        """Queue an event for the next batched write; the tournament is left unchanged"""
+        event = {
+            'seq': tournament['event_seq'] + len(events) + 1,
+            'type': event_type,
+            'round': round_number,
+            'match': match_number,
+            'player': player_id,
+            'data': data
+        }
+        events.append(event)
+        return event
+    
+    def _preview_result(self, tournament, round_number, match_number, winner_id):
+        """A view of the tournament with one more result folded in, to decide the next round on.
+        
+        Only the round's match list and the two players' standings are copied;
+        everything else is shared with the live tournament and must not be changed.
+        """
+        round_matches = list(tournament['bracket'][round_number])
+        match = round_matches[match_number] = dict(round_matches[match_number], winner=winner_id, status='completed')
+        standings = dict(tournament['standings'])
+        for player_id in (match['player1'], match['player2']):
+            standings[player_id] = dict(standings[player_id], opponents=set(standings[player_id]['opponents']))
+        bracket = dict(tournament['bracket'])
+        bracket[round_number] = round_matches
+        preview = dict(tournament, bracket=bracket, standings=standings, ranking=None)
+        self._apply_result(preview, match)
+        return preview
+    
+    def _apply_event(self, tournament, event):
+        """The only place tournament progress changes in memory (caller holds the lock)"""
+        event_type = event['type']
+        bracket = tournament['bracket']
+        tournament['event_seq'] = event['seq']
         
-        try:
-            cursor.execute('''
-                UPDATE tournaments SET status = 'active', started_at = CURRENT_TIMESTAMP
-                WHERE tournament_id = ?
-            ''', (tournament_id,))
-            
-            # Create first round matches
-            self._create_tournament_matches(tournament_id, tournament['bracket'])
-            
-            conn.commit()
-            return True, "Tournament started successfully"
-        except Exception as e:
-            print(f"Error starting tournament: {e}")
-            return False, "Database error"
-        finally:
-            conn.close()
+        if event_type == 'tournament_started':
+            tournament['status'] = 'active'
+        elif event_type == 'round_opened':
+            matches = [new_bye(p1) if p2 is None else new_match(p1, p2) for p1, p2 in event['data']['pairs']]
+            bracket[event['round']] = matches
+            tournament['current_round'] = event['round']
+            tournament['open_matches'] = sum(1 for m in matches if m['status'] != 'completed')
+            for match in matches:
+                if match['status'] == 'completed':
+                    self._apply_result(tournament, match)
+        elif event_type == 'match_started':
+            match = bracket[event['round']][event['match']]
+            match['game_id'] = event['data']['game_id']
+            match['status'] = 'active'
+        elif event_type in ('match_won', 'match_drawn'):
+            match = bracket[event['round']][event['match']]
+            match['winner'] = event['player']
+            match['status'] = 'completed'
+            tournament['open_matches'] -= 1
+            self._apply_result(tournament, match)
+        elif event_type == 'tournament_finished':
+            tournament['status'] = 'completed'
+            tournament['winner'] = event['player']
+        # round_closed only marks the end of a round in the log
     
-    def _create_bracket(self, participants):
-        random.shuffle(participants)
-        bracket = {}
-        round_num = 1
-        current_participants = participants[:]
-        
-        while len(current_participants) > 1:
-            bracket[round_num] = []
-            next_round = []
-            
-            for i in range(0, len(current_participants), 2):
-                if i + 1 < len(current_participants):
-                    match = {
-                        'player1': current_participants[i],
-                        'player2': current_participants[i + 1],
-                        'winner': None,
-                        'game_id': None,
-                        'status': 'pending'
-                    }
-                    bracket[round_num].append(match)
-                else:
-                    # Bye - player advances automatically
-                    next_round.append(current_participants[i])
-            
-            current_participants = next_round
-            round_num += 1
+    def _write_events(self, cursor, tournament_id, events):
+        """Append events and update the rows they change, batched per statement"""
+        cursor.executemany('''
+            INSERT INTO tournament_events 
+            (tournament_id, seq, event_type, round_number, match_number, player_id, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(tournament_id, e['seq'], e['type'], e['round'], e['match'], e['player'],
+               json.dumps(e['data']) if e['data'] is not None else None) for e in events])
         
-        return bracket
+        new_matches = []
+        started = []
+        results = []
+        for event in events:
+            if event['type'] == 'tournament_started':
+                cursor.execute('''
+                    UPDATE tournaments SET status = 'active', started_at = CURRENT_TIMESTAMP, current_round = 1
+                    WHERE tournament_id = ?
+                ''', (tournament_id,))
+            elif event['type'] == 'round_opened':
+                for match_number, (p1, p2) in enumerate(event['data']['pairs']):
+                    bye = p2 is None
+                    new_matches.append((tournament_id, event['round'], match_number, p1, p2,
+                                        p1 if bye else None, 'completed' if bye else 'pending'))
+                cursor.execute('''
+                    UPDATE tournaments SET current_round = ? WHERE tournament_id = ?
+                ''', (event['round'], tournament_id))
+            elif event['type'] == 'match_started':
+                started.append((event['data']['game_id'], tournament_id, event['round'], event['match']))
+            elif event['type'] in ('match_won', 'match_drawn'):
+                results.append((event['player'], tournament_id, event['round'], event['match']))
+            elif event['type'] == 'tournament_finished':
+                cursor.execute('''
+                    UPDATE tournaments 
+                    SET status = 'completed', winner_id = ?, finished_at = CURRENT_TIMESTAMP
+                    WHERE tournament_id = ?
+                ''', (event['player'], tournament_id))
+        
+        if new_matches:
+            cursor.executemany('''
+                INSERT INTO tournament_matches 
+                (tournament_id, round_number, match_number, player1_id, player2_id, winner_id, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', new_matches)
+        if started:
+            cursor.executemany('''
+                UPDATE tournament_matches SET game_id = ?, status = 'active'
+                WHERE tournament_id = ? AND round_number = ? AND match_number = ?
+            ''', started)
+        if results:
+            cursor.executemany('''
+                UPDATE tournament_matches 
+                SET winner_id = ?, status = 'completed', completed_at = CURRENT_TIMESTAMP
+                WHERE tournament_id = ? AND round_number = ? AND match_number = ?
+            ''', results)
     
-    def _create_tournament_matches(self, tournament_id, bracket):
+    @traced('db')
+    def _persist_events(self, tournament, events):
+        """Write events in one transaction; raises if they could not be saved"""
+        if not events:
+            return
+        
         conn = sqlite3.connect('tictactoe_advanced.db')
         cursor = conn.cursor()
         
         try:
-            for round_num, matches in bracket.items():
-                for match_num, match in enumerate(matches):
-                    cursor.execute('''
-                        INSERT INTO tournament_matches 
-                        (tournament_id, round_number, match_number, player1_id, player2_id, status)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (tournament_id, round_num, match_num, match['player1'], match['player2'], 'pending'))
-            
+            self._write_events(cursor, tournament['id'], events)
             conn.commit()
-        except Exception as e:
-            print(f"Error creating tournament matches: {e}")
+        except Exception:
+            conn.rollback()
+            raise
         finally:
             conn.close()
     
     def get_tournament_info(self, tournament_id):
-        if tournament_id in self.tournaments:
-            return self.tournaments[tournament_id]
-        
-        # Try to load from database
-        conn = sqlite3.connect('tictactoe_advanced.db')
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('SELECT * FROM tournaments WHERE tournament_id = ?', (tournament_id,))
-            tournament_data = cursor.fetchone()
-            
-            if tournament_data:
-                cursor.execute('SELECT user_id FROM tournament_participants WHERE tournament_id = ?', (tournament_id,))
-                participants = [row[0] for row in cursor.fetchall()]
-                
-                tournament_info = {
-                    'id': tournament_data[1],
-                    'name': tournament_data[2],
-                    'creator': tournament_data[3],
-                    'status': tournament_data[4],
-                    'max_players': tournament_data[5],
-                    'participants': participants,
-                    'prize_pool': tournament_data[7] or "Glory",
-                    'current_round': tournament_data[11] or 1
-                }
-                
-                return tournament_info
-        except Exception as e:
-            print(f"Error getting tournament info: {e}")
-        finally:
-            conn.close()
-        
-        return None
+        return self.get_tournament(tournament_id)
     
     def get_active_tournaments(self):
+        """Open and active tournaments, newest first; served from memory between changes"""
+        listing = self._listing
+        if listing is None:
+            generation = self._listing_generation
+            listing = self._load_active_tournaments()
+            # Don't cache a load that raced with a change or failed
+            if listing is not None and generation == self._listing_generation:
+                self._listing = listing
+        return listing or []
+    
+    @traced('db')
+    def _load_active_tournaments(self):
         conn = sqlite3.connect('tictactoe_advanced.db')
         cursor = conn.cursor()
         
@@ -563,85 +2327,824 @@ class TournamentManager:
             return tournaments
         except Exception as e:
             print(f"Error getting active tournaments: {e}")
-            return []
+            return None
         finally:
             conn.close()
     
+    @traced('db')
     def advance_tournament(self, tournament_id, match_winner_id):
         """Advance a player to the next round"""
-        if tournament_id not in self.tournaments:
-            return False
+        tournament = self.get_tournament(tournament_id)
+        if not tournament:
+            return False, "Tournament not found"
         
-        tournament = self.tournaments[tournament_id]
-        current_round = tournament['current_round']
+        with tournament['lock']:
+            current_round = tournament['current_round']
+            for match_number, match in enumerate(tournament['bracket'].get(current_round, [])):
+                if match['status'] != 'completed' and match_winner_id in (match['player1'], match['player2']):
+                    return self.record_result(tournament_id, current_round, match_number, match_winner_id)
         
-        # Update bracket with winner
-        for match in tournament['bracket'].get(current_round, []):
-            if match['player1'] == match_winner_id or match['player2'] == match_winner_id:
-                match['winner'] = match_winner_id
-                match['status'] = 'completed'
-                break
+        return False, "Match not found"
+    
+    @traced('db')
+    def record_result(self, tournament_id, round_number, match_number, winner_id):
+        """Record a match result (winner_id None for a draw) and move the tournament on
+        
+        Nothing changes in memory unless the resulting events were saved; a
+        failed write raises.
+        """
+        tournament = self.get_tournament(tournament_id)
+        if not tournament:
+            return False, "Tournament not found"
         
-        # Check if round is complete
-        round_matches = tournament['bracket'].get(current_round, [])
-        if all(match['status'] == 'completed' for match in round_matches):
-            # Advance to next round
-            winners = [match['winner'] for match in round_matches if match['winner']]
+        with tournament['lock']:
+            current_round = tournament['current_round']
+            round_matches = tournament['bracket'].get(current_round, [])
+            if round_number != current_round or match_number >= len(round_matches):
+                return False, "Match not found"
             
-            if len(winners) == 1:
-                # Tournament complete
-                tournament['status'] = 'completed'
-                tournament['winner'] = winners[0]
-                
-                # Update database
-                conn = sqlite3.connect('tictactoe_advanced.db')
-                cursor = conn.cursor()
-                try:
-                    cursor.execute('''
-                        UPDATE tournaments 
-                        SET status = 'completed', winner_id = ?, finished_at = CURRENT_TIMESTAMP
-                        WHERE tournament_id = ?
-                    ''', (winners[0], tournament_id))
-                    
-                    # Update winner stats
-                    stats = get_user_stats(winners[0]) or {}
-                    update_user_stats(winners[0], 
-                        tournament_wins=stats.get('tournament_wins', 0) + 1)
-                    
-                    conn.commit()
-                except Exception as e:
-                    print(f"Error completing tournament: {e}")
-                finally:
-                    conn.close()
+            if round_matches[match_number]['status'] == 'completed':
+                return False, "Match already completed"
+            if winner_id is None and tournament['format'] == 'elimination':
+                return False, "Elimination matches need a winner"
+            
+            events = []
+            self._new_event(tournament, events, 'match_won' if winner_id else 'match_drawn',
+                            current_round, match_number, winner_id)
+            
+            champion = None
+            if tournament['open_matches'] == 1:
+                self._new_event(tournament, events, 'round_closed', current_round)
+                preview = self._preview_result(tournament, current_round, match_number, winner_id)
                 
-                return True, f"Tournament completed! Winner: {get_user_name(winners[0])}"
-            else:
-                # Create next round
-                tournament['current_round'] += 1
-                next_round_bracket = self._create_next_round(winners)
-                tournament['bracket'][tournament['current_round']] = next_round_bracket
+                if tournament['format'] == 'elimination':
+                    winners = [m['winner'] for m in preview['bracket'][current_round]]
+                    if len(winners) == 1:
+                        champion = winners[0]
+                elif current_round >= tournament['total_rounds']:
+                    champion = self.get_ranking(preview)[0]
                 
-                return True, f"Round {current_round} completed! Starting round {tournament['current_round']}"
+                if champion is not None:
+                    self._new_event(tournament, events, 'tournament_finished', current_round, player_id=champion)
+                else:
+                    next_round = self._pair_round(preview, current_round + 1)
+                    self._new_event(tournament, events, 'round_opened', current_round + 1,
+                                    data={'pairs': self._pairs(next_round)})
+            
+            self._persist_events(tournament, events)
+            for event in events:
+                self._apply_event(tournament, event)
+        
+        if champion is not None:
+            self.invalidate_listing()
+            award_tournament_win(champion)
+            return True, f"Tournament completed! Winner: {get_user_name(champion)}"
         
+        if len(events) > 1:
+            return True, f"Round {current_round} completed! Starting round {current_round + 1}"
         return True, "Match completed"
     
-    def _create_next_round(self, winners):
-        """Create matches for the next round"""
-        matches = []
-        for i in range(0, len(winners), 2):
-            if i + 1 < len(winners):
-                match = {
-                    'player1': winners[i],
-                    'player2': winners[i + 1],
-                    'winner': None,
-                    'game_id': None,
-                    'status': 'pending'
-                }
-                matches.append(match)
-        return matches
-
+    def record_match_starts(self, tournament_id, starts):
+        """Log (round_number, match_number, game_id) starts in one batched write; raises if it fails"""
+        tournament = self.get_tournament(tournament_id)
+        if not tournament:
+            return
+        
+        with tournament['lock']:
+            events = []
+            for round_number, match_number, game_id in starts:
+                self._new_event(tournament, events, 'match_started', round_number, match_number,
+                                data={'game_id': game_id})
+            self._persist_events(tournament, events)
+            for event in events:
+                self._apply_event(tournament, event)
+    
 tournament_manager = TournamentManager()
 
+# -------------------- ACTIVE GAMES INDEX --------------------
+MAX_ACTIVE_GAMES_PER_USER = 3  # Live games (and pending invitations) a user may have at once
+
+user_games = defaultdict(set)  # user_id -> ids of the user's live games
+pair_games = {}  # frozenset of two user ids -> id of their live game
+_game_index_lock = threading.Lock()
+
+def index_game(game_id, enforce_limit=True):
+    """Record a game under each human player (call again when a player joins).
+    
+    The limit check and the index update share one lock, so two concurrent
+    requests can't both take a user's last free slot. Returns False, leaving
+    the index unchanged, if a player already has MAX_ACTIVE_GAMES_PER_USER
+    other live games and `enforce_limit` is set.
+    """
+    game = games.get(game_id)
+    if not game:
+        return False
+    bot_id = get_bot_id()
+    humans = [p for p in game['players'] if p != bot_id]
+    with _game_index_lock:
+        for player_id in humans:
+            game_ids = user_games.get(player_id, ())
+            if enforce_limit and game_id not in game_ids and len(game_ids) >= MAX_ACTIVE_GAMES_PER_USER:
+                return False
+        for player_id in humans:
+            user_games[player_id].add(game_id)
+        if len(humans) == 2:
+            pair_games[frozenset(humans)] = game_id
+    return True
+
+def unindex_game(game_id, game):
+    with _game_index_lock:
+        for player_id in game['players']:
+            game_ids = user_games.get(player_id)
+            if game_ids is not None:
+                game_ids.discard(game_id)
+                if not game_ids:
+                    del user_games[player_id]
+        pair = frozenset(game['players'])
+        if pair_games.get(pair) == game_id:
+            del pair_games[pair]
+
+def get_user_game_ids(user_id):
+    with _game_index_lock:
+        return list(user_games.get(user_id, ()))
+
+def can_start_game(user_id):
+    """Quick pre-check for menus; index_game enforces the limit atomically"""
+    return len(user_games.get(user_id, ())) < MAX_ACTIVE_GAMES_PER_USER
+
+def get_pair_game(user_id, other_id):
+    """Id of the live game between two users, if any"""
+    return pair_games.get(frozenset((user_id, other_id)))
+
+def get_pending_invitation(user_id):
+    """Id of the user's friend invitation that nobody has accepted yet, if any"""
+    for game_id in get_user_game_ids(user_id):
+        game = games.get(game_id)
+        if game and len(game['players']) == 1:
+            return game_id
+    return None
+
+def cancel_pending_invitations(user_id):
+    """Drop a user's friend invitations that nobody has accepted yet"""
+    for game_id in get_user_game_ids(user_id):
+        game = games.get(game_id)
+        if game and len(game['players']) == 1:
+            unindex_game(game_id, game)
+            games.pop(game_id, None)
+
+# -------------------- TURN CLOCKS --------------------
+TIME_CONTROLS = {
+    'blitz': {'name': "⚡ Blitz", 'initial': 60, 'increment': 2},
+    'correspondence': {'name': "📅 Correspondence", 'initial': 24 * 3600, 'increment': 0},
+    'tournament': {'name': "🏟️ Tournament", 'initial': 180, 'increment': 5}
+}
+TOURNAMENT_TIME_CONTROL = 'tournament'  # Also the forfeit deadline for a player who never moves
+DEFAULT_FRIEND_TIME_CONTROL = 'correspondence'
+QUICK_MATCH_TIME_CONTROL = 'blitz'
+INVITATION_TTL = 600  # Seconds before an unanswered friend invitation expires
+CLOCK_TICK_INTERVAL = 0  # Seconds between "time left" refreshes while a player thinks (0 disables)
+CLOCK_WORKERS = 2  # Threads running due deadlines and refreshes
+CLOCK_COMPACT_MIN = 64  # Superseded deadlines kept before the heap is compacted
+
+class ClockScheduler:
+    """Runs every move deadline and clock refresh from one thread and a min-heap.
+    
+    A key (such as a game's turn deadline) has at most one live entry:
+    scheduling it again or cancelling it makes the old entry stale. Stale
+    entries are skipped when they come due and compacted away once they are
+    half the heap. Due callbacks run on CLOCK_WORKERS worker threads, so a
+    slow callback never delays the next deadline.
+    """
+    
+    def __init__(self, workers=CLOCK_WORKERS):
+        self._heap = []
+        self._live = {}  # key -> sequence number of its live entry
+        self._stale = 0
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._workers = workers
+        self._due = queue.Queue()
+    
+    def schedule(self, when, callback, *args, key=None):
+        seq = next(self._counter)
+        entry = (when, seq, key, callback, args)
+        with self._condition:
+            if key is not None:
+                if key in self._live:
+                    self._stale += 1
+                self._live[key] = seq
+            heapq.heappush(self._heap, entry)
+            self._compact()
+            if self._heap[0] is entry:
+                self._condition.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='clock-scheduler', daemon=True)
+                self._thread.start()
+                for i in range(self._workers):
+                    threading.Thread(target=self._work, name=f'clock-worker-{i}', daemon=True).start()
+    
+    def cancel(self, key):
+        with self._condition:
+            if self._live.pop(key, None) is not None:
+                self._stale += 1
+                self._compact()
+    
+    def __len__(self):
+        return len(self._heap) - self._stale
+    
+    def _is_live(self, entry):
+        key = entry[2]
+        return key is None or self._live.get(key) == entry[1]
+    
+    def _compact(self):
+        if self._stale > CLOCK_COMPACT_MIN and self._stale * 2 > len(self._heap):
+            self._heap = [entry for entry in self._heap if self._is_live(entry)]
+            heapq.heapify(self._heap)
+            self._stale = 0
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                entry = heapq.heappop(self._heap)
+                if not self._is_live(entry):
+                    self._stale -= 1
+                    continue
+                if entry[2] is not None:
+                    del self._live[entry[2]]
+            self._due.put(entry)
+    
+    def _work(self):
+        while True:
+            _, _, _, callback, args = self._due.get()
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in scheduled {getattr(callback, '__name__', callback)}: {e}")
+
+clock_scheduler = ClockScheduler()
+
+def start_game_clock(game, time_control):
+    """Give both players a clock and start the first player's turn"""
+    game['time_control'] = time_control
+    game['clocks'] = {p_id: TIME_CONTROLS[time_control]['initial'] for p_id in game['players']}
+    _start_turn_clock(game)
+
+def _start_turn_clock(game):
+    game['clock_token'] = game.get('clock_token', 0) + 1
+    game['turn_started_at'] = time.time()
+    remaining = game['clocks'][game['turn']]
+    clock_scheduler.schedule(game['turn_started_at'] + remaining, _on_turn_timeout,
+                             game['game_id'], game['clock_token'], key=('timeout', game['game_id']))
+    if CLOCK_TICK_INTERVAL > 0 and remaining > CLOCK_TICK_INTERVAL:
+        clock_scheduler.schedule(game['turn_started_at'] + CLOCK_TICK_INTERVAL, _on_clock_tick,
+                                 game['game_id'], game['clock_token'], key=('tick', game['game_id']))
+
+def switch_turn_clock(game, moved_player_id):
+    """Charge the player who just moved, add the increment and start the next turn"""
+    if 'clocks' not in game:
+        return
+    elapsed = time.time() - game['turn_started_at']
+    increment = TIME_CONTROLS[game['time_control']]['increment']
+    game['clocks'][moved_player_id] = max(0, game['clocks'][moved_player_id] - elapsed) + increment
+    _start_turn_clock(game)
+
+def stop_game_clock(game):
+    if 'clocks' in game:
+        game['clock_token'] = game.get('clock_token', 0) + 1
+        clock_scheduler.cancel(('timeout', game['game_id']))
+        clock_scheduler.cancel(('tick', game['game_id']))
+
+def get_time_left(game, player_id):
+    remaining = game['clocks'][player_id]
+    if player_id == game.get('turn') and not game.get('is_over'):
+        remaining -= time.time() - game['turn_started_at']
+    return max(0, remaining)
+
+def format_clock(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def _on_turn_timeout(game_id, token):
+    game = games.get(game_id)
+    if not game:
+        return
+    with game_lock(game):
+        if game.get('is_over') or game.get('clock_token') != token:
+            return  # A move got in first
+        end_game(game_id, timed_out_id=game['turn'])
+
+def _on_clock_tick(game_id, token):
+    game = games.get(game_id)
+    if not game:
+        return
+    with game_lock(game):
+        if game.get('is_over') or game.get('clock_token') != token:
+            return
+        bump_game_version(game)
+        update_game_state(game_id)
+        if get_time_left(game, game['turn']) > CLOCK_TICK_INTERVAL:
+            clock_scheduler.schedule(time.time() + CLOCK_TICK_INTERVAL, _on_clock_tick, game_id, token,
+                                     key=('tick', game_id))
+
+def _expire_invitation(game_id):
+    game = games.get(game_id)
+    if not game or len(game['players']) > 1:
+        return
+    unindex_game(game_id, game)
+    games.pop(game_id, None)
+    inviter_id = game['players'][0]
+    markup = InlineKeyboardMarkup()
+    markup.add(
+        InlineKeyboardButton(f"{EMOJI_REFRESH} New Invitation", callback_data="vs_friend_menu"),
+        InlineKeyboardButton(f"{EMOJI_BACK} Main Menu", callback_data="main_menu")
+    )
+    safe_edit_message(inviter_id, game['message_ids'][inviter_id],
+                      "⌛ Your invitation expired before anyone joined." + WATERMARK, markup)
+
+# -------------------- OUTBOUND MESSAGE QUEUE --------------------
+SEND_RATE_GLOBAL = 25  # Messages per second across all chats (the Bot API allows about 30)
+SEND_RATE_BULK = 15  # Bulk messages leave the rest of the budget to handlers replying directly
+SEND_INTERVAL_PER_CHAT = 1.0  # Minimum seconds between messages to the same chat
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+class OutboundSender:
+    """Background worker sending bot-initiated messages within Bot API flood limits.
+    
+    Interactive messages (e.g. tournament pairings) always go before bulk ones.
+    A message for a chat that got one too recently is set aside until that chat
+    is ready, so it never holds up messages for other chats. `on_sent(message)`
+    or `on_failed(error)` runs on a separate callback thread once the message
+    has been delivered or has permanently failed.
+    """
+    
+    def __init__(self, rate=SEND_RATE_GLOBAL, per_chat_interval=SEND_INTERVAL_PER_CHAT, bulk_rate=SEND_RATE_BULK):
+        self.rate = rate
+        self.bulk_rate = bulk_rate
+        self.per_chat_interval = per_chat_interval
+        self._queue = queue.PriorityQueue()
+        self._delayed = []  # (ready_at, seq, entry) heap of messages waiting for their chat, worker-only
+        self._callbacks = queue.Queue()
+        self._counter = itertools.count()
+        self._next_slot = 0.0
+        self._chat_ready_at = {}
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def send(self, chat_id, text, markup=None, on_sent=None, on_failed=None, priority=PRIORITY_INTERACTIVE):
+        self._queue.put((priority, next(self._counter), chat_id, text, markup, on_sent, on_failed, 0))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='outbound-sender', daemon=True)
+                self._thread.start()
+                threading.Thread(target=self._run_callbacks, name='outbound-callbacks', daemon=True).start()
+    
+    def pending(self):
+        return self._queue.qsize() + len(self._delayed)
+    
+    def _wait_for_slot(self, priority):
+        now = time.monotonic()
+        ready_at = max(self._next_slot, now)
+        if ready_at > now:
+            time.sleep(ready_at - now)
+        self._next_slot = ready_at + 1.0 / (self.rate if priority == PRIORITY_INTERACTIVE else self.bulk_rate)
+    
+    def _next_entry(self):
+        """The next message whose chat is ready, moving set-aside messages back as they become due"""
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._queue.put(heapq.heappop(self._delayed)[2])
+            try:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            ready_at = self._chat_ready_at.get(entry[2], 0.0)
+            if ready_at <= time.monotonic():
+                return entry
+            heapq.heappush(self._delayed, (ready_at, entry[1], entry))
+    
+    def _run(self):
+        while True:
+            entry = self._next_entry()
+            priority, seq, chat_id, text, markup, on_sent, on_failed, attempt = entry
+            self._wait_for_slot(priority)
+            try:
+                message = bot.send_message(chat_id, text, reply_markup=markup)
+            except ApiTelegramException as e:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after')
+                if e.error_code == 429 and retry_after and attempt < 2:
+                    self._next_slot = time.monotonic() + retry_after
+                    self._queue.put(entry[:-1] + (attempt + 1,))
+                    continue
+                self._callbacks.put((on_failed, e))
+            except Exception as e:
+                print(f"Error sending queued message to {chat_id}: {e}")
+                self._callbacks.put((on_failed, e))
+            else:
+                self._callbacks.put((on_sent, message))
+            
+            now = time.monotonic()
+            self._chat_ready_at[chat_id] = now + self.per_chat_interval
+            if len(self._chat_ready_at) > 10000:
+                self._chat_ready_at = {c: t for c, t in self._chat_ready_at.items() if t > now}
+    
+    def _run_callbacks(self):
+        while True:
+            callback, value = self._callbacks.get()
+            if callback is None:
+                continue
+            try:
+                callback(value)
+            except Exception as e:
+                print(f"Error in outbound message callback: {e}")
+
+outbound_sender = OutboundSender()
+
+# -------------------- EVENT BUS --------------------
+EVENT_QUEUE_SIZE = 1000  # Events buffered per subscriber before publishers wait
+EVENT_DRAIN_TIMEOUT = 10  # Seconds to let queued events finish at exit
+EVENT_PUBLISH_TIMEOUT = 2  # Longest an update handler waits on a full queue
+EVENT_RETRY_ATTEMPTS = 4  # Tries for a stage's writes before giving up on them
+EVENT_RETRY_DELAY = 0.5  # Seconds before the first retry, doubling each time
+FAILED_GAMES_FILE = 'failed_games.jsonl'  # Finished games that couldn't be saved, replayed at startup
+
+_failed_games_lock = threading.Lock()
+
+def run_with_retries(func, attempts=EVENT_RETRY_ATTEMPTS, delay=EVENT_RETRY_DELAY):
+    """Call func until it returns, backing off between failures; the last error is raised"""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            print(f"Retrying after error ({attempt + 1}/{attempts}): {e}")
+            time.sleep(delay * 2 ** attempt)
+
+class EventBus:
+    """In-process publish/subscribe so handlers don't wait on follow-up work
+    
+    Every subscriber has its own bounded queue and worker thread, so one event
+    type is handled in publish order. When a queue is full, update handlers
+    wait up to EVENT_PUBLISH_TIMEOUT, slowing the incoming updates down.
+    Internal threads (clock, sender, event workers) never wait: the event is
+    handed to an overflow thread so they keep running, and may then be
+    handled after events published later.
+    """
+    
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._overflow = 0
+    
+    def subscribe(self, event_type, handler, name=None):
+        subscriber = {
+            'name': name or handler.__name__,
+            'handler': handler,
+            'queue': queue.Queue(maxsize=self.queue_size),
+            'thread': None,
+        }
+        with self._lock:
+            self._subscribers[event_type].append(subscriber)
+    
+    def publish(self, event_type, event):
+        for subscriber in self._subscribers.get(event_type, ()):
+            with self._lock:
+                if subscriber['thread'] is None:
+                    subscriber['thread'] = threading.Thread(target=self._run, args=(subscriber,),
+                                                            name=f"events-{subscriber['name']}", daemon=True)
+                    subscriber['thread'].start()
+            try:
+                if getattr(_handler_state, 'active', False):
+                    subscriber['queue'].put(event, timeout=EVENT_PUBLISH_TIMEOUT)
+                else:
+                    subscriber['queue'].put_nowait(event)
+            except queue.Full:
+                print(f"⚠️ {subscriber['name']} event queue is full, queueing {event_type} in the background")
+                with self._lock:
+                    self._overflow += 1
+                threading.Thread(target=self._put_overflow, args=(subscriber, event), daemon=True).start()
+    
+    def _put_overflow(self, subscriber, event):
+        subscriber['queue'].put(event)
+        with self._lock:
+            self._overflow -= 1
+    
+    def pending(self):
+        return {subscriber['name']: subscriber['queue'].unfinished_tasks
+                for subscribers in self._subscribers.values() for subscriber in subscribers}
+    
+    def drain(self, timeout=EVENT_DRAIN_TIMEOUT):
+        """Wait until every queued event has been handled, including events published meanwhile"""
+        deadline = time.monotonic() + timeout
+        while self._overflow or any(self.pending().values()):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+    
+    def _run(self, subscriber):
+        while True:
+            event = subscriber['queue'].get()
+            try:
+                subscriber['handler'](event)
+            except Exception as e:
+                print(f"Error in {subscriber['name']} event handler: {e}")
+            finally:
+                subscriber['queue'].task_done()
+
+event_bus = EventBus()
+atexit.register(event_bus.drain)
+
+# -------------------- TOURNAMENT RUNNER --------------------
+def launch_tournament_round(tournament_id):
+    """Create a game for every match of the current round and invite both players"""
+    tournament = tournament_manager.get_tournament(tournament_id)
+    if not tournament:
+        return
+    
+    with tournament['lock']:
+        if tournament['status'] != 'active':
+            return
+        
+        round_number = tournament['current_round']
+        matches = tournament['bracket'].get(round_number, [])
+        starts = [(round_number, match_number, new_game_id())
+                  for match_number, match in enumerate(matches)
+                  if match['status'] != 'completed' and match['game_id'] not in games]
+        
+        # Games are only created once their start is saved, so results always have a match to land on
+        tournament_manager.record_match_starts(tournament_id, starts)
+        for _, match_number, game_id in starts:
+            launch_tournament_match(tournament, round_number, match_number, matches[match_number], game_id)
+
+def resume_tournaments():
+    """Relaunch the games of active tournaments that were interrupted by a restart"""
+    resumed = 0
+    for info in tournament_manager.get_active_tournaments():
+        if info['status'] == 'active':
+            try:
+                launch_tournament_round(info['id'])
+                resumed += 1
+            except Exception as e:
+                print(f"Error resuming tournament {info['id']}: {e}")
+    return resumed
+
+def new_game_id():
+    return str(uuid.uuid4())[:8]
+
+def launch_tournament_match(tournament, round_number, match_number, match, game_id, swap_symbols=False):
+    p1_id, p2_id = match['player1'], match['player2']
+    if swap_symbols:
+        p1_id, p2_id = p2_id, p1_id
+    
+    game = {
+        'game_id': game_id,
+        'players': [p1_id, p2_id],
+        'player_symbols': {p1_id: PLAYER_X, p2_id: PLAYER_O},
+        'board': [[EMPTY] * BOARD_SIZE for _ in range(BOARD_SIZE)],
+        'turn': p1_id,
+        'is_over': False,
+        'game_mode': 'tournament',
+        'tournament_id': tournament['id'],
+        'tournament_round': round_number,
+        'match_number': match_number,
+        'message_ids': {},
+        'move_history': [],
+        'hints_used': {p1_id: 0, p2_id: 0},
+        'empty_symbol': '⬜',
+        'created_at': time.time(),
+        'start_time': time.time()
+    }
+    games[game_id] = game
+    snapshot_player_names(game)
+    index_game(game_id, enforce_limit=False)  # A tournament match is played whatever else is going on
+    register_spectatable_game(game)
+    
+    for player_id in (p1_id, p2_id):
+        opponent_id = p2_id if player_id == p1_id else p1_id
+        text = f"{EMOJI_TOURNAMENT} {tournament['name']} - Round {round_number}\n\n"
+        text += f"{EMOJI_CHALLENGE} Your match vs {get_player_name(game, opponent_id)} is starting..."
+        outbound_sender.send(
+            player_id, text + WATERMARK,
+            on_sent=lambda message, player_id=player_id: _on_tournament_invite_sent(game_id, player_id, message),
+            on_failed=lambda error, player_id=player_id: end_game(game_id, resigned_id=player_id)
+        )
+    return game_id
+
+def _on_tournament_invite_sent(game_id, player_id, message):
+    """Start the clocks once both players have their board message"""
+    game = games.get(game_id)
+    if not game or game.get('is_over'):
+        return
+    game['message_ids'][player_id] = message.message_id
+    if len(game['message_ids']) == 2:
+        start_game_clock(game, TOURNAMENT_TIME_CONTROL)
+        bump_game_version(game)
+        update_game_state(game_id)
+
+def on_tournament_game_finished(game, winner_id, is_draw):
+    """Advance the bracket after a tournament game; returns a status line for the players"""
+    tournament_id = game['tournament_id']
+    tournament = tournament_manager.get_tournament(tournament_id)
+    if not tournament:
+        return None
+    
+    round_number, match_number = game['tournament_round'], game['match_number']
+    with tournament['lock']:
+        matches = tournament['bracket'].get(round_number, [])
+        if match_number >= len(matches) or matches[match_number]['game_id'] != game['game_id']:
+            return None  # A game replaced by a relaunch
+        
+        if not winner_id and tournament['format'] == 'elimination':
+            # Elimination matches need a winner: replay with the symbols swapped
+            match = matches[match_number]
+            game_id = new_game_id()
+            tournament_manager.record_match_starts(tournament_id, [(round_number, match_number, game_id)])
+            launch_tournament_match(tournament, round_number, match_number, match, game_id,
+                                    swap_symbols=game['players'][0] == match['player1'])
+            return "Draw! A deciding game is starting now."
+        
+        msg = None
+        if matches[match_number]['status'] != 'completed':
+            success, msg = tournament_manager.record_result(tournament_id, round_number, match_number, winner_id)
+            if not success:
+                return None
+        # Otherwise an earlier attempt recorded the result but failed to launch the next round
+        
+        if tournament['status'] == 'completed':
+            announce_tournament_winner(tournament)
+        elif tournament['current_round'] != round_number:
+            launch_tournament_round(tournament_id)
+    return msg
+
+def announce_tournament_winner(tournament):
+    text = f"{EMOJI_TROPHY} {tournament['name']} has finished!\n\n"
+    text += f"{EMOJI_CROWN} Champion: {get_user_name(tournament['winner'])}"
+    for participant_id in tournament['participants']:
+        outbound_sender.send(participant_id, text + WATERMARK, priority=PRIORITY_BULK)
+
+# -------------------- BROADCASTS --------------------
+BROADCAST_BATCH_SIZE = 100  # Recipients queued per checkpoint; a restart resends at most one batch
+
+_broadcast_lock = threading.Lock()
+_broadcast_cancelled = threading.Event()
+
+@traced('db')
+def create_broadcast(text, created_by):
+    """Store a new broadcast and return its id, or None if one is still running"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute("SELECT 1 FROM broadcasts WHERE status = 'running'")
+        if cursor.fetchone():
+            conn.rollback()
+            return None
+        cursor.execute('INSERT INTO broadcasts (text, created_by) VALUES (?, ?)', (text, created_by))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+@traced('db')
+def get_broadcast(broadcast_id=None):
+    """A broadcast by id, or the latest one"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    conn.row_factory = sqlite3.Row
+    try:
+        if broadcast_id is None:
+            row = conn.execute('SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1').fetchone()
+        else:
+            row = conn.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def _send_broadcast_batch(text, recipients):
+    """Queue one batch as bulk messages and wait until every one is sent or has failed"""
+    results = {'sent': 0, 'failed': 0, 'blocked': []}
+    remaining = [len(recipients)]
+    done = threading.Event()
+    lock = threading.Lock()
+    
+    def finish(user_id, error=None):
+        with lock:
+            if error is None:
+                results['sent'] += 1
+            elif isinstance(error, ApiTelegramException) and error.error_code == 403:
+                results['blocked'].append(user_id)
+            else:
+                results['failed'] += 1
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+    
+    for user_id in recipients:
+        outbound_sender.send(user_id, text,
+                             on_sent=lambda message, user_id=user_id: finish(user_id),
+                             on_failed=lambda error, user_id=user_id: finish(user_id, error),
+                             priority=PRIORITY_BULK)
+    done.wait()
+    return results
+
+def run_broadcast(broadcast_id):
+    """Send a broadcast to every user who hasn't blocked the bot, resuming from its checkpoint"""
+    if not _broadcast_lock.acquire(blocking=False):
+        return
+    try:
+        broadcast = get_broadcast(broadcast_id)
+        if not broadcast or broadcast['status'] != 'running':
+            return
+        text = broadcast['text'] + WATERMARK
+        last_user_id = broadcast['last_user_id']
+        _broadcast_cancelled.clear()
+        
+        while not _broadcast_cancelled.is_set():
+            conn = sqlite3.connect('tictactoe_advanced.db')
+            try:
+                recipients = [row[0] for row in conn.execute('''
+                    SELECT user_id FROM user_stats
+                    WHERE user_id > ? AND blocked_at IS NULL
+                    ORDER BY user_id LIMIT ?
+                ''', (last_user_id, BROADCAST_BATCH_SIZE))]
+            finally:
+                conn.close()
+            if not recipients:
+                break
+            
+            results = _send_broadcast_batch(text, recipients)
+            last_user_id = recipients[-1]
+            
+            conn = sqlite3.connect('tictactoe_advanced.db')
+            try:
+                conn.executemany('UPDATE user_stats SET blocked_at = CURRENT_TIMESTAMP WHERE user_id = ?',
+                                 [(user_id,) for user_id in results['blocked']])
+                publish_stats_invalidation(conn, results['blocked'])
+                conn.execute('''
+                    UPDATE broadcasts SET
+                        last_user_id = ?,
+                        sent = sent + ?,
+                        failed = failed + ?,
+                        blocked = blocked + ?
+                    WHERE id = ?
+                ''', (last_user_id, results['sent'], results['failed'], len(results['blocked']), broadcast_id))
+                conn.commit()
+            finally:
+                conn.close()
+            for user_id in results['blocked']:
+                user_stats_cache.invalidate(user_id)
+        
+        status = 'cancelled' if _broadcast_cancelled.is_set() else 'done'
+        conn = sqlite3.connect('tictactoe_advanced.db')
+        try:
+            conn.execute('UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         (status, broadcast_id))
+            conn.commit()
+        finally:
+            conn.close()
+        
+        broadcast = get_broadcast(broadcast_id)
+        if broadcast['created_by']:
+            outbound_sender.send(broadcast['created_by'], format_broadcast_status(broadcast) + WATERMARK)
+    except Exception as e:
+        print(f"Error running broadcast {broadcast_id}: {e}")
+    finally:
+        _broadcast_lock.release()
+
+def start_broadcast(broadcast_id):
+    threading.Thread(target=run_broadcast, args=(broadcast_id,), name='broadcast', daemon=True).start()
+
+def resume_broadcasts():
+    """Continue a broadcast that was interrupted by a restart"""
+    broadcast = get_broadcast()
+    if broadcast and broadcast['status'] == 'running':
+        start_broadcast(broadcast['id'])
+        return broadcast['id']
+    return None
+
+def format_broadcast_status(broadcast):
+    status_emoji = {'running': '📤', 'done': '✅', 'cancelled': '⏹️'}.get(broadcast['status'], '📣')
+    text = f"{status_emoji} Broadcast #{broadcast['id']}: {broadcast['status']}\n\n"
+    text += f"✉️ Sent: {broadcast['sent']}\n"
+    text += f"🚫 Blocked: {broadcast['blocked']}\n"
+    text += f"❌ Failed: {broadcast['failed']}\n"
+    if broadcast['status'] == 'running':
+        text += f"📬 Queued: {outbound_sender.pending()}\n"
+    return text
+
 # -------------------- QUICK MATCH SYSTEM --------------------
 def add_to_quick_match_queue(user_id):
     if user_id not in quick_match_queue:
@@ -657,11 +3160,13 @@ def remove_from_quick_match_queue(user_id):
 
 def find_quick_match(user_id):
     if len(quick_match_queue) >= 1:  # Changed from >= 2 to >= 1
-        # Find opponent from queue (excluding the requesting user)
-        available_opponents = [uid for uid in quick_match_queue if uid != user_id]
+        # Find opponent from queue (excluding the requesting user and anyone already playing them)
+        # Queued players may have started other games since they joined the queue
+        available_opponents = (uid for uid in quick_match_queue
+                               if uid != user_id and not get_pair_game(user_id, uid) and can_start_game(uid))
+        opponent_id = next(available_opponents, None)
         
-        if available_opponents:
-            opponent_id = available_opponents[0]
+        if opponent_id:
             # Remove both players from queue
             remove_from_quick_match_queue(opponent_id)
             remove_from_quick_match_queue(user_id)
@@ -671,31 +3176,233 @@ def find_quick_match(user_id):
 # -------------------- SPECTATOR SYSTEM --------------------
 def add_spectator(game_id, user_id):
     if game_id in games:
-        spectators[game_id].add(user_id)
+        if user_id not in spectators[game_id]:
+            spectators[game_id].add(user_id)
+            bump_game_version(games[game_id])
+            spectate_registry.set_spectators(game_id, len(spectators[game_id]))
         return True
     return False
 
 def remove_spectator(game_id, user_id):
     if game_id in spectators:
-        spectators[game_id].discard(user_id)
+        if user_id in spectators[game_id]:
+            spectators[game_id].discard(user_id)
+            spectate_registry.set_spectators(game_id, len(spectators[game_id]))
+            if game_id in games:
+                bump_game_version(games[game_id])
         return True
     return False
 
+SPECTATE_PAGE_SIZE = 5
+SPECTATE_SORTS = {'recent': "🕒 Recent", 'popular': "🔥 Popular"}
+SPECTATE_COMPACT_MIN = 256  # Dead keys tolerated before the sort lists are compacted
+SPECTATE_PAGE_CACHE_SIZE = 200  # Rendered lobby pages kept
+
+class SpectateRegistry:
+    """Index of live games that can be spectated, maintained as games start and end.
+    
+    Both sort orders are kept as ascending key lists updated in place: a
+    removed or re-sorted game leaves a dead key behind that pages skip, and
+    the lists are compacted once dead keys outnumber live ones. Lobby pages
+    are served by cursor (the sort key of the last game shown) and cached
+    with the key range they cover, so a change only drops the pages whose
+    range it falls in.
+    """
+    
+    def __init__(self):
+        self._entries = {}  # game_id -> entry
+        self._recent = []  # seq keys, ascending
+        self._popular = []  # (spectators, seq) keys, ascending
+        self._by_seq = {}  # seq -> game_id
+        self._dead = 0  # Dead keys across both lists
+        self._pages = {}  # (sort, cursor) -> (low, high, lines, markup)
+        self._next_seq = 1
+        self._version = 0
+        self._lock = threading.Lock()
+    
+    def _changed(self, sort, key):
+        """Drop the cached pages of `sort` whose key range contains `key`"""
+        self._version += 1
+        for cache_key, (low, high, _, _) in list(self._pages.items()):
+            if cache_key[0] == sort and (low is None or low <= key) and (high is None or key < high):
+                del self._pages[cache_key]
+    
+    def _is_live(self, key):
+        if isinstance(key, tuple):
+            game_id = self._by_seq.get(key[1])
+            return game_id is not None and self._entries[game_id]['spectators'] == key[0]
+        return key in self._by_seq
+    
+    def _compact(self):
+        if self._dead > len(self._entries) + SPECTATE_COMPACT_MIN:
+            self._recent = [key for key in self._recent if self._is_live(key)]
+            self._popular = [key for key in self._popular if self._is_live(key)]
+            self._dead = 0
+    
+    def add(self, game):
+        game_id = game['game_id']
+        with self._lock:
+            if game_id in self._entries:
+                return
+            seq = self._next_seq
+            self._next_seq += 1
+            entry = {
+                'id': game_id,
+                'seq': seq,
+                'players': [get_player_name(game, p) for p in game['players']],
+                'spectators': len(spectators.get(game_id, ())),
+                'mode': game.get('game_mode', 'unknown')
+            }
+            self._entries[game_id] = entry
+            self._by_seq[seq] = game_id
+            self._recent.append(seq)
+            bisect.insort(self._popular, (entry['spectators'], seq))
+            self._changed('recent', seq)
+            self._changed('popular', (entry['spectators'], seq))
+    
+    def remove(self, game_id):
+        with self._lock:
+            entry = self._entries.pop(game_id, None)
+            if entry is None:
+                return
+            del self._by_seq[entry['seq']]
+            self._dead += 2
+            self._changed('recent', entry['seq'])
+            self._changed('popular', (entry['spectators'], entry['seq']))
+            self._compact()
+    
+    def set_spectators(self, game_id, count):
+        with self._lock:
+            entry = self._entries.get(game_id)
+            if entry is None or entry['spectators'] == count:
+                return
+            old_key = (entry['spectators'], entry['seq'])
+            entry['spectators'] = count
+            new_key = (count, entry['seq'])
+            index = bisect.bisect_left(self._popular, new_key)
+            if index < len(self._popular) and self._popular[index] == new_key:
+                pass  # The key left behind by an earlier count is live again
+            else:
+                self._popular.insert(index, new_key)
+                self._dead += 1
+            self._changed('recent', entry['seq'])
+            self._changed('popular', old_key)
+            self._changed('popular', new_key)
+            self._compact()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _key_to_entry(self, key):
+        seq = key[1] if isinstance(key, tuple) else key
+        return self._entries[self._by_seq[seq]]
+    
+    @staticmethod
+    def encode_cursor(key):
+        return f"{key[0]}.{key[1]}" if isinstance(key, tuple) else str(key)
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        if not cursor:
+            return None
+        if '.' in cursor:
+            spectator_count, seq = cursor.split('.')
+            return (int(spectator_count), int(seq))
+        return int(cursor)
+    
+    def _walk(self, sort, cursor, size):
+        """Up to `size` live keys below `cursor`, descending, and the next live key after them"""
+        keys = self._popular if sort == 'popular' else self._recent
+        key = self.decode_cursor(cursor)
+        index = len(keys) if key is None else bisect.bisect_left(keys, key)
+        found = []
+        while index > 0:
+            index -= 1
+            if self._is_live(keys[index]):
+                if len(found) == size:
+                    return found, keys[index]
+                found.append(keys[index])
+        return found, None
+    
+    def page(self, sort='recent', cursor=None, size=SPECTATE_PAGE_SIZE):
+        """Entries after `cursor` in `sort` order, plus the cursor of the next page"""
+        with self._lock:
+            keys, more = self._walk(sort, cursor, size)
+            next_cursor = self.encode_cursor(keys[-1]) if more is not None else None
+            return [self._key_to_entry(key) for key in keys], next_cursor
+    
+    def render_page(self, sort='recent', cursor=None):
+        """Lobby text and markup for a page; the game list is rendered once until a change touches it"""
+        total = len(self._entries)
+        if not total:
+            text = f"👁️ Spectate Games\n\nNo active games to spectate right now.\nCheck back later!"
+            markup = InlineKeyboardMarkup()
+            markup.add(InlineKeyboardButton(f"{EMOJI_BACK} Back", callback_data="main_menu"))
+            return text, markup
+        header = f"👁️ Active Games ({total} available)\n"
+        
+        cache_key = (sort, cursor or '')
+        with self._lock:
+            cached = self._pages.get(cache_key)
+            if cached is not None:
+                return header + cached[2], cached[3]
+            version = self._version
+            keys, more = self._walk(sort, cursor, SPECTATE_PAGE_SIZE)
+            entries = [dict(self._key_to_entry(key)) for key in keys]
+        next_cursor = self.encode_cursor(keys[-1]) if more is not None else None
+        
+        text = f"Sorted by: {SPECTATE_SORTS[sort]}\n\n"
+        markup = InlineKeyboardMarkup(row_width=1)
+        
+        for game in entries:
+            players_text = " vs ".join(game['players'])
+            spectator_text = f" ({game['spectators']} watching)" if game['spectators'] > 0 else ""
+            markup.add(InlineKeyboardButton(
+                f"👁️ {players_text}{spectator_text}",
+                callback_data=f"spectate_game_{game['id']}"
+            ))
+        
+        navigation = []
+        if cursor:
+            navigation.append(InlineKeyboardButton("⏮️ First", callback_data=f"spectate_page_{sort}"))
+        if next_cursor:
+            navigation.append(InlineKeyboardButton("➡️ More", callback_data=f"spectate_page_{sort}_{next_cursor}"))
+        if navigation:
+            markup.row(*navigation)
+        
+        other_sort = 'popular' if sort == 'recent' else 'recent'
+        markup.row(
+            InlineKeyboardButton(SPECTATE_SORTS[other_sort], callback_data=f"spectate_page_{other_sort}"),
+            InlineKeyboardButton(f"🔄 Refresh", callback_data=f"spectate_page_{sort}")
+        )
+        markup.add(InlineKeyboardButton(f"{EMOJI_BACK} Back", callback_data="main_menu"))
+        
+        # The page covers its keys and the gap down to the next live key, which decides "More"
+        low = more
+        high = self.decode_cursor(cursor)
+        with self._lock:
+            if self._version == version:
+                if len(self._pages) >= SPECTATE_PAGE_CACHE_SIZE:
+                    self._pages = {}
+                self._pages[cache_key] = (low, high, text, markup)
+        return header + text, markup
+
+spectate_registry = SpectateRegistry()
+
+def register_spectatable_game(game):
+    """List a game in the spectate lobby once it has two human players"""
+    if game.get('is_over') or game.get('game_mode') == 'vs_ai':
+        return
+    bot_id = get_bot_id()
+    if len([p for p in game['players'] if p != bot_id]) == 2:
+        spectate_registry.add(game)
+
 def get_spectatable_games():
-    active_games = []
-    for game_id, game in games.items():
-        if not game.get('is_over', False) and game.get('game_mode') != 'vs_ai':
-            # Only show games with 2 human players
-            human_players = [p for p in game['players'] if p != bot.get_me().id]
-            if len(human_players) == 2:
-                active_games.append({
-                    'id': game_id,
-                    'players': [get_user_name(p) for p in human_players],
-                    'spectators': len(spectators.get(game_id, set())),
-                    'mode': game.get('game_mode', 'unknown')
-                })
-    return active_games
+    """All spectatable games, most recent first"""
+    entries, _ = spectate_registry.page('recent', size=len(spectate_registry))
+    return entries
 
+@traced('render')
 def create_spectator_board_markup(game, spectator_id):
     """Create a non-interactive board for spectators"""
     markup = InlineKeyboardMarkup(row_width=BOARD_SIZE)
@@ -718,29 +3425,164 @@ def create_spectator_board_markup(game, spectator_id):
     ]
     markup.row(*controls)
     
-    return markup
+    return markup
+
+# -------------------- NAME RESOLUTION --------------------
+NAME_CACHE_SIZE = 10000  # Max cached display names
+NAME_CACHE_TTL = 600  # Seconds before a cached name is looked up again
+
+class ProfileCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL"""
+    
+    def __init__(self, max_size=NAME_CACHE_SIZE, ttl=NAME_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+name_cache = ProfileCache()
+
+_bot_identity = None
+_bot_identity_lock = threading.Lock()
+
+def get_bot_identity():
+    """The bot's own user, fetched from the Bot API once per process"""
+    global _bot_identity
+    if _bot_identity is None:
+        with _bot_identity_lock:
+            if _bot_identity is None:
+                _bot_identity = bot.get_me()
+    return _bot_identity
+
+def get_bot_id():
+    return get_bot_identity().id
+
+@traced('game')
+def get_user_name(user_id):
+    if user_id == get_bot_id():
+        return "AI"
+    
+    name = name_cache.get(user_id)
+    if name is not None:
+        return name
+    
+    stats = get_user_stats(user_id)
+    if stats and stats.get('name'):
+        name = stats['name']
+    else:
+        try:
+            user = bot.get_chat(user_id)
+            name = user.first_name if user.first_name else "Player"
+        except:
+            return "Player"
+    
+    name_cache.set(user_id, name)
+    return name
+
+def snapshot_player_names(game):
+    """Store display names on the game so renders don't resolve them again"""
+    game['names'] = {p_id: get_user_name(p_id) for p_id in game['players']}
+
+def get_player_name(game, player_id):
+    """Display name of a player as snapshotted when the game started"""
+    names = game.get('names', {})
+    if player_id not in names:
+        names[player_id] = get_user_name(player_id)
+        game['names'] = names
+    return names[player_id]
 
 # -------------------- ENHANCED UI FUNCTIONS --------------------
-def get_user_name(user_id):
-    if user_id == bot.get_me().id:
-        return "AI"
+def create_replay_screen(record, step):
+    """Board of a finished game after `step` moves, with step controls"""
+    log = record['move_log']
+    total = move_log_length(log)
+    step = max(0, min(step, total))
     
-    stats = get_user_stats(user_id)
-    if stats and stats.get('name'):
-        return stats['name']
+    board = [[EMPTY] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+    delay = None
+    for i, (r, c, delay) in enumerate(itertools.islice(iter_move_log(log), step)):
+        board[r][c] = PLAYER_X if i % 2 == 0 else PLAYER_O
     
-    try:
-        user = bot.get_chat(user_id)
-        return user.first_name if user.first_name else "Player"
-    except:
-        return "Player"
+    p1_id, p2_id = record['player1_id'], record['player2_id']
+    text = f"{EMOJI_HISTORY} Replay\n\n"
+    text += f"{PLAYER_X} {get_user_name(p1_id)} vs {PLAYER_O} {get_user_name(p2_id)}\n\n"
+    text += '\n'.join(''.join(row) for row in board) + "\n\n"
+    text += f"Move {step}/{total}"
+    if step and delay is not None:
+        text += f" (+{delay:.1f}s)"
+    if step == total:
+        winner_id = record['winner_id']
+        text += f"\n{EMOJI_WIN} {get_user_name(winner_id)} won" if winner_id else f"\n{EMOJI_DRAW} No winner"
+    if log and log[0] == MOVE_LOG_RECONSTRUCTED:
+        text += "\n\n⚠️ Saved before move order was recorded: the order shown is approximate."
+    
+    history_id = record['id']
+    markup = InlineKeyboardMarkup(row_width=4)
+    markup.add(
+        InlineKeyboardButton("⏮", callback_data=f"replay_{history_id}_0"),
+        InlineKeyboardButton("◀️", callback_data=f"replay_{history_id}_{max(0, step - 1)}"),
+        InlineKeyboardButton("▶️", callback_data=f"replay_{history_id}_{min(total, step + 1)}"),
+        InlineKeyboardButton("⏭", callback_data=f"replay_{history_id}_{total}")
+    )
+    markup.add(InlineKeyboardButton(f"{EMOJI_BACK} History", callback_data="history"))
+    return text, markup
+
+def create_tournament_setup_screen(setup):
+    """Prize prompt with the format picker for a tournament being created"""
+    text = f"🏟️ Tournament Setup\n\n"
+    text += f"Name: {setup['tournament_name']}\n"
+    text += f"Max Players: {setup['max_players']}\n"
+    text += f"Format: {TOURNAMENT_FORMATS[setup['format']]}\n\n"
+    text += f"Pick a format, then enter the prize description (optional, or type 'Glory'):"
+    
+    markup = InlineKeyboardMarkup(row_width=1)
+    for tournament_format, label in TOURNAMENT_FORMATS.items():
+        selected = "✅ " if tournament_format == setup['format'] else ""
+        markup.add(InlineKeyboardButton(f"{selected}{label}", callback_data=f"tournament_format_{tournament_format}"))
+    markup.add(InlineKeyboardButton("🏆 Use 'Glory'", callback_data="tournament_prize_glory"))
+    markup.add(InlineKeyboardButton("❌ Cancel", callback_data="tournament_menu"))
+    return text, markup
+
+def format_tournament_standings(tournament, limit=10):
+    standings = tournament['standings']
+    text = f"📊 Standings:\n"
+    for position, player_id in enumerate(tournament_manager.get_ranking(tournament)[:limit], 1):
+        record = standings[player_id]
+        text += f"{position}. {get_user_name(player_id)} - {record['points']:g} pts "
+        text += f"({record['wins']}W {record['draws']}D {record['losses']}L)\n"
+    return text
+
 
 def safe_edit_message(chat_id, message_id, text, markup=None, parse_mode=None):
     """Safely edit message with error handling"""
     try:
         # Get current message to compare
         try:
-            current_msg = bot.get_message(chat_id, message_id)
+            with trace_span('api.get_message', 'api'):
+                current_msg = bot.get_message(chat_id, message_id)
             if current_msg.text == text and current_msg.reply_markup == markup:
                 return True  # No change needed
         except:
@@ -763,6 +3605,7 @@ def safe_edit_message(chat_id, message_id, text, markup=None, parse_mode=None):
         print(f"Error editing message: {e}")
         return False
 
+@traced('render')
 def create_enhanced_board_markup(game):
     markup = InlineKeyboardMarkup(row_width=BOARD_SIZE)
     
@@ -845,6 +3688,7 @@ def send_enhanced_main_menu(chat_id, message_id=None):
         InlineKeyboardButton(f"{EMOJI_SPECTATE} Spectate Games", callback_data="spectate")
     )
     markup.add(
+        InlineKeyboardButton(f"🎮 My Games", callback_data="my_games"),
         InlineKeyboardButton(f"{EMOJI_SETTINGS} Settings", callback_data="settings_menu")
     )
     
@@ -856,11 +3700,225 @@ def send_enhanced_main_menu(chat_id, message_id=None):
     except Exception as e:
         print(f"Error in send_enhanced_main_menu: {e}")
 
+# -------------------- SAMPLING PROFILER --------------------
+PROFILER_INTERVAL = 0.02  # Seconds between stack samples; each sample walks every thread while holding the GIL
+PROFILER_DEFAULT_SECONDS = 30
+PROFILER_MAX_SECONDS = 300
+
+_profiler_lock = threading.Lock()
+
+def sample_stacks(duration, interval=PROFILER_INTERVAL):
+    """Sample every other thread's stack for `duration` seconds.
+
+    Returns collapsed stacks ("root;...;leaf" -> sample count), the input
+    format of flamegraph.pl, speedscope and similar tools.
+    """
+    counts = defaultdict(int)
+    own_id = threading.get_ident()
+    deadline = time.monotonic() + duration
+    
+    while time.monotonic() < deadline:
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    
+    return counts
+
+def _run_profiler(chat_id, seconds):
+    if not _profiler_lock.acquire(blocking=False):
+        bot.send_message(chat_id, "⏳ A profiling session is already running!")
+        return
+    try:
+        counts = sample_stacks(seconds)
+        lines = [f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1])]
+        
+        document = io.BytesIO('\n'.join(lines).encode('utf-8'))
+        document.name = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed.txt"
+        
+        caption = f"🔬 Profile: {seconds}s, {sum(counts.values())} samples, {len(counts)} unique stacks\n"
+        caption += "Render with flamegraph.pl or speedscope.app"
+        bot.send_document(chat_id, document, caption=caption)
+    except Exception as e:
+        print(f"Error running profiler: {e}")
+        try:
+            bot.send_message(chat_id, f"❌ Profiler failed: {e}")
+        except:
+            pass
+    finally:
+        _profiler_lock.release()
+
+# -------------------- DATA EXPORT --------------------
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MAX_UPLOAD = 50 * 1024 * 1024  # Bot API upload limit; larger exports need the CLI
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_TABLES = {
+    # name: (table, date column, user columns)
+    'games': ('game_history', 'created_at', ('player1_id', 'player2_id')),
+    'users': ('user_stats', 'created_at', ('user_id',)),
+    'tournaments': ('tournaments', 'created_at', ('creator_id',)),
+    'tournament_matches': ('tournament_matches', 'created_at', ('player1_id', 'player2_id')),
+}
+
+_export_lock = threading.Lock()
+
+def iter_export_rows(cursor, name, since=None, until=None, user_id=None):
+    """Yield an export's column names, then its rows one keyset page at a time
+    
+    Each page is a short query, so a long export never holds a read lock that
+    would stall the bot's writes. `since` is inclusive, `until` exclusive.
+    """
+    table, date_column, user_columns = EXPORT_TABLES[name]
+    conditions, params = [], []
+    if since:
+        conditions.append(f'{date_column} >= ?')
+        params.append(since)
+    if until:
+        conditions.append(f'{date_column} < ?')
+        params.append(until)
+    if user_id is not None:
+        conditions.append('(' + ' OR '.join(f'{column} = ?' for column in user_columns) + ')')
+        params.extend([user_id] * len(user_columns))
+    where = ' AND '.join(conditions) or '1'
+    
+    if name == 'games':
+        yield GAME_HISTORY_COLUMNS.split(', ')
+        batches = iter_history_batches(cursor, GAME_HISTORY_COLUMNS, where=where, params=params,
+                                       batch_size=EXPORT_BATCH_SIZE,
+                                       first_month=since[:7] if since else None,
+                                       last_month=until[:7] if until else None)
+        for rows in batches:
+            yield from rows
+        return
+    
+    cursor.execute(f'SELECT * FROM {table} LIMIT 0')
+    yield [description[0] for description in cursor.description]
+    after = -2 ** 63
+    while True:
+        cursor.execute(f'''
+            SELECT rowid, * FROM {table}
+            WHERE rowid > ? AND ({where})
+            ORDER BY rowid LIMIT ?
+        ''', (after, *params, EXPORT_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        after = rows[-1][0]
+        for row in rows:
+            yield row[1:]
+
+def _export_value(value):
+    return value.hex() if isinstance(value, bytes) else value
+
+def write_export(rows, out, fmt):
+    """Write the header and rows from iter_export_rows to a text stream; returns the row count"""
+    header = next(rows)
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow([_export_value(value) for value in row])
+            count += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(dict(zip(header, map(_export_value, row))), ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def export_table(binary, name, fmt='ndjson', compress=True, since=None, until=None, user_id=None):
+    """Stream one export into a binary file object, optionally gzipped"""
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    target = gzip.GzipFile(fileobj=binary, mode='wb') if compress else binary
+    out = io.TextIOWrapper(target, encoding='utf-8', newline='')
+    try:
+        return write_export(iter_export_rows(conn.cursor(), name, since, until, user_id), out, fmt)
+    finally:
+        out.flush()
+        out.detach()  # Leave the caller's file open
+        if compress:
+            target.close()
+        conn.close()
+
+def parse_export_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+def parse_export_args(tokens):
+    """<table> [csv|ndjson] [since=YYYY-MM-DD] [until=YYYY-MM-DD] [user=ID] -> export options"""
+    if not tokens or tokens[0] not in EXPORT_TABLES:
+        raise ValueError(f"table must be one of: {', '.join(EXPORT_TABLES)}")
+    options = {'name': tokens[0], 'fmt': 'ndjson', 'since': None, 'until': None, 'user_id': None}
+    for token in tokens[1:]:
+        key, _, value = token.partition('=')
+        if token in EXPORT_FORMATS:
+            options['fmt'] = token
+        elif key in ('since', 'until') and value:
+            options[key] = parse_export_date(value)
+        elif key == 'user' and value:
+            options['user_id'] = int(value)
+        else:
+            raise ValueError(f"unknown option '{token}'")
+    return options
+
+def _run_export(chat_id, options):
+    if not _export_lock.acquire(blocking=False):
+        bot.send_message(chat_id, "⏳ An export is already running!")
+        return
+    try:
+        started = time.monotonic()
+        with tempfile.NamedTemporaryFile(prefix=f"export-{options['name']}-", suffix=f".{options['fmt']}.gz") as document:
+            count = export_table(document, options['name'], options['fmt'], True,
+                                 options['since'], options['until'], options['user_id'])
+            size = document.tell()
+            if size > EXPORT_MAX_UPLOAD:
+                bot.send_message(chat_id, f"❌ Export is {size / 1024 / 1024:.0f} MB, over the upload limit. "
+                                          f"Use: python main.py export {options['name']} ...")
+                return
+            document.seek(0)
+            caption = f"📦 {options['name']}: {count} rows, {size / 1024:.0f} KB gzipped in {time.monotonic() - started:.1f}s"
+            bot.send_document(chat_id, document, caption=caption)
+    except Exception as e:
+        print(f"Error running export: {e}")
+        try:
+            bot.send_message(chat_id, f"❌ Export failed: {e}")
+        except:
+            pass
+    finally:
+        _export_lock.release()
+
+def run_export_cli(argv):
+    """python main.py export <table> [--format csv|ndjson] [--gzip] [--since/--until YYYY-MM-DD] [--user ID] [-o FILE]"""
+    parser = argparse.ArgumentParser(prog='main.py export', description="Stream a table to CSV or NDJSON")
+    parser.add_argument('table', choices=list(EXPORT_TABLES))
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help="gzip the output")
+    parser.add_argument('--since', type=parse_export_date, help="first day to include (YYYY-MM-DD)")
+    parser.add_argument('--until', type=parse_export_date, help="first day to exclude (YYYY-MM-DD)")
+    parser.add_argument('--user', type=int, help="only rows involving this user id")
+    parser.add_argument('-o', '--output', default='-', help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+    
+    if args.output == '-':
+        count = export_table(sys.stdout.buffer, args.table, args.format, args.gzip, args.since, args.until, args.user)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, 'wb') as f:
+            count = export_table(f, args.table, args.format, args.gzip, args.since, args.until, args.user)
+    print(f"📦 Exported {count} rows", file=sys.stderr)
+
 # -------------------- BOT COMMAND HANDLERS --------------------
 @bot.message_handler(commands=['start', 'help'])
+@traced_handler
 def handle_start(message):
     user_id = message.from_user.id
-    online_users.add(user_id)
     
     if message.chat.type != 'private':
         bot.reply_to(message, "🎮 Start a private chat with me to access the full game menu!")
@@ -873,12 +3931,108 @@ def handle_start(message):
         return
 
     # Initialize user stats
-    if not get_user_stats(user_id):
+    stats = get_user_stats(user_id)
+    if not stats:
         update_user_stats(user_id, name=message.from_user.first_name or "Player")
+    elif stats.get('blocked_at'):
+        update_user_stats(user_id, blocked_at=None)  # Back after blocking the bot
     
     send_enhanced_main_menu(message.chat.id)
 
+@bot.message_handler(commands=['profile'])
+@traced_handler
+def handle_profile(message):
+    """Admin only: /profile [seconds] - sample the running bot and send a collapsed-stack file"""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ This command is only available to admins!")
+        return
+    
+    parts = message.text.split()
+    try:
+        seconds = int(parts[1]) if len(parts) > 1 else PROFILER_DEFAULT_SECONDS
+    except ValueError:
+        bot.reply_to(message, "❌ Usage: /profile [seconds]")
+        return
+    seconds = max(1, min(seconds, PROFILER_MAX_SECONDS))
+    
+    if _profiler_lock.locked():
+        bot.reply_to(message, "⏳ A profiling session is already running!")
+        return
+    
+    bot.reply_to(message, f"🔬 Profiling the bot for {seconds}s...")
+    threading.Thread(target=_run_profiler, args=(message.chat.id, seconds), daemon=True).start()
+
+@bot.message_handler(commands=['dashboard'])
+@traced_handler
+def handle_dashboard(message):
+    """Admin only: /dashboard - game volume, mode mix and AI win rates from the rollups"""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ This command is only available to admins!")
+        return
+    
+    try:
+        bot.reply_to(message, get_dashboard_text() + WATERMARK)
+    except Exception as e:
+        print(f"Error in dashboard: {e}")
+        bot.reply_to(message, "❌ Could not build the dashboard!")
+
+@bot.message_handler(commands=['broadcast'])
+@traced_handler
+def handle_broadcast(message):
+    """Admin only: /broadcast <text> | /broadcast status | /broadcast cancel"""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ This command is only available to admins!")
+        return
+    
+    text = message.text.partition(' ')[2].strip()
+    if not text:
+        bot.reply_to(message, "❌ Usage: /broadcast <text> | /broadcast status | /broadcast cancel")
+        return
+    
+    if text in ('status', 'cancel'):
+        broadcast = get_broadcast()
+        if not broadcast:
+            bot.reply_to(message, "📣 No broadcasts yet!")
+            return
+        if text == 'cancel' and broadcast['status'] == 'running':
+            _broadcast_cancelled.set()
+            bot.reply_to(message, f"⏹️ Stopping broadcast #{broadcast['id']} after the current batch...")
+            return
+        bot.reply_to(message, format_broadcast_status(broadcast) + WATERMARK)
+        return
+    
+    broadcast_id = create_broadcast(text, message.from_user.id)
+    if broadcast_id is None:
+        bot.reply_to(message, "⏳ A broadcast is already running! Send /broadcast status or /broadcast cancel")
+        return
+    
+    start_broadcast(broadcast_id)
+    bot.reply_to(message, f"📣 Broadcast #{broadcast_id} started! You'll get a summary when it's done.")
+
+@bot.message_handler(commands=['export'])
+@traced_handler
+def handle_export(message):
+    """Admin only: /export <table> [csv|ndjson] [since=YYYY-MM-DD] [until=YYYY-MM-DD] [user=ID]"""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.reply_to(message, "❌ This command is only available to admins!")
+        return
+    
+    try:
+        options = parse_export_args(message.text.split()[1:])
+    except ValueError as e:
+        bot.reply_to(message, f"❌ {e}\nUsage: /export <{'|'.join(EXPORT_TABLES)}> [csv|ndjson] "
+                              f"[since=YYYY-MM-DD] [until=YYYY-MM-DD] [user=ID]")
+        return
+    
+    if _export_lock.locked():
+        bot.reply_to(message, "⏳ An export is already running!")
+        return
+    
+    bot.reply_to(message, f"📦 Exporting {options['name']}...")
+    threading.Thread(target=_run_export, args=(message.chat.id, options), daemon=True).start()
+
 @bot.message_handler(func=lambda message: user_input_state.get(message.from_user.id, {}).get('state') == 'tournament_name')
+@traced_handler
 def handle_tournament_name(message):
     user_id = message.from_user.id
     tournament_name = message.text.strip()
@@ -909,6 +4063,7 @@ def handle_tournament_name(message):
     bot.reply_to(message, f"🏟️ Tournament: '{tournament_name}'\n\nChoose maximum number of players:", reply_markup=markup)
 
 @bot.message_handler(func=lambda message: user_input_state.get(message.from_user.id, {}).get('state') == 'tournament_prize')
+@traced_handler
 def handle_tournament_prize(message):
     user_id = message.from_user.id
     prize_pool = message.text.strip()
@@ -921,13 +4076,15 @@ def handle_tournament_prize(message):
     tournament_data = user_input_state[user_id]
     tournament_name = tournament_data['tournament_name']
     max_players = tournament_data['max_players']
+    tournament_format = tournament_data.get('format', DEFAULT_TOURNAMENT_FORMAT)
     
     # Create tournament
     tournament_id = tournament_manager.create_tournament(
         creator_id=user_id,
         name=tournament_name,
         max_players=max_players,
-        prize_pool=prize_pool
+        prize_pool=prize_pool,
+        tournament_format=tournament_format
     )
     
     if tournament_id:
@@ -938,6 +4095,7 @@ def handle_tournament_prize(message):
         text = f"🎉 Tournament Created Successfully!\n\n"
         text += f"🏟️ Name: {tournament_name}\n"
         text += f"👥 Max Players: {max_players}\n"
+        text += f"📐 Format: {TOURNAMENT_FORMATS[tournament_format]}\n"
         text += f"🏆 Prize: {prize_pool}\n"
         text += f"🆔 ID: {tournament_id}\n\n"
         text += f"Share this tournament ID with friends to join!"
@@ -955,6 +4113,7 @@ def handle_tournament_prize(message):
         del user_input_state[user_id]
 
 @bot.message_handler(func=lambda message: user_input_state.get(message.from_user.id, {}).get('state') == 'join_tournament')
+@traced_handler
 def handle_join_tournament_id(message):
     user_id = message.from_user.id
     tournament_id = message.text.strip()
@@ -1000,12 +4159,25 @@ def join_friend_game(game_id, p2_user):
         bot.send_message(p2_id, "❌ This game is already full!")
         return
 
+    if get_pair_game(p1_id, p2_id):
+        bot.send_message(p2_id, "❌ You already have a game in progress with this player!")
+        return
+
+    if not can_start_game(p2_id):
+        bot.send_message(p2_id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.")
+        return
+
+    game['players'].append(p2_id)
+    if not index_game(game_id):
+        game['players'].remove(p2_id)
+        bot.send_message(p2_id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.")
+        return
+
     # Initialize second player
     if not get_user_stats(p2_id):
         update_user_stats(p2_id, name=p2_user.first_name or "Player")
     
     # Complete game setup
-    game['players'].append(p2_id)
     game['player_symbols'] = {p1_id: PLAYER_X, p2_id: PLAYER_O}
     game['board'] = [[EMPTY] * BOARD_SIZE for _ in range(BOARD_SIZE)]
     game['turn'] = p1_id
@@ -1015,11 +4187,16 @@ def join_friend_game(game_id, p2_user):
     game['empty_symbol'] = '⬜'
     game['is_over'] = False
     game['game_id'] = game_id  # Ensure game_id is set
+    game['start_time'] = time.time()
+    snapshot_player_names(game)
+    start_game_clock(game, game.get('time_control', DEFAULT_FRIEND_TIME_CONTROL))
+    bump_game_version(game)
+    register_spectatable_game(game)
 
     # Update P1's message
     try:
         safe_edit_message(p1_id, game['message_ids'][p1_id], 
-                         f"🎮 Your opponent {get_user_name(p2_id)} has joined! Game starting..." + WATERMARK)
+                         f"🎮 Your opponent {get_player_name(game, p2_id)} has joined! Game starting..." + WATERMARK)
     except:
         pass
 
@@ -1033,6 +4210,7 @@ def join_friend_game(game_id, p2_user):
     # Update both players with the game board
     update_game_state(game_id)
 
+@traced('game')
 def update_game_state(game_id):
     if game_id not in games:
         return
@@ -1048,7 +4226,7 @@ def update_game_state(game_id):
             print(f"Error updating group game: {e}")
     else:  # DM vs AI or DM vs Friend
         for p_id in game['players']:
-            if p_id == bot.get_me().id:
+            if p_id == get_bot_id():
                 continue
             text = get_game_status_text(game, p_id) + WATERMARK
             try:
@@ -1059,27 +4237,54 @@ def update_game_state(game_id):
     # Update spectators
     if game_id in spectators:
         spectator_markup = create_spectator_board_markup(game, None)
+        spectator_text = get_spectator_status_text(game) + WATERMARK
         for spectator_id in spectators[game_id]:
             try:
-                spectator_text = get_spectator_status_text(game) + WATERMARK
                 safe_edit_message(spectator_id, game.get('spectator_messages', {}).get(spectator_id), 
                                 spectator_text, spectator_markup)
             except Exception as e:
                 print(f"Error updating spectator {spectator_id}: {e}")
 
+# -------------------- RENDER CACHE --------------------
+def game_lock(game):
+    """Lock serializing moves, resignations and clock deadlines on one game"""
+    return game.setdefault('lock', threading.RLock())
+
+def bump_game_version(game):
+    """Mark the game state as changed; texts rendered for older versions are dropped"""
+    game['version'] = game.get('version', 0) + 1
+
+def _get_render_cache(game):
+    """Texts already rendered for the game's current state version"""
+    version = game.get('version', 0)
+    if game.get('render_version') != version:
+        game['render_cache'] = {}
+        game['render_version'] = version
+    return game['render_cache']
+
+@traced('render')
 def get_spectator_status_text(game):
-    """Get status text for spectators"""
+    """Get status text for spectators, rendered once per state version"""
+    cache = _get_render_cache(game)
+    if 'spectator' not in cache:
+        cache['spectator'] = _render_spectator_status_text(game)
+    return cache['spectator']
+
+def _render_spectator_status_text(game):
     p1_id, p2_id = game['players']
-    p1_name = get_user_name(p1_id)
-    p2_name = get_user_name(p2_id)
+    p1_name = get_player_name(game, p1_id)
+    p2_name = get_player_name(game, p2_id)
     
     header = f"👁️ Spectating: {p1_name} ({PLAYER_X}) vs {p2_name} ({PLAYER_O})\n"
     
     if game.get('is_over'):
         return header + game.get('end_message', "Game Over!")
     
-    current_player_name = get_user_name(game['turn'])
+    current_player_name = get_player_name(game, game['turn'])
     status = f"🎯 {current_player_name}'s turn"
+    if 'clocks' in game:
+        status += f"\n{EMOJI_TIMER} {p1_name} {format_clock(get_time_left(game, p1_id))} | "
+        status += f"{p2_name} {format_clock(get_time_left(game, p2_id))}"
     
     # Add spectator count
     spectator_count = len(spectators.get(game.get('game_id', ''), set()))
@@ -1088,29 +4293,41 @@ def get_spectator_status_text(game):
     
     return header + status
 
+@traced('render')
 def get_game_status_text(game, perspective_of_player_id=None):
+    """Get status text for a player (or the group), rendered once per state version"""
+    cache = _get_render_cache(game)
+    key = ('player', perspective_of_player_id)
+    if key not in cache:
+        cache[key] = _render_game_status_text(game, perspective_of_player_id)
+    return cache[key]
+
+def _render_game_status_text(game, perspective_of_player_id=None):
     p1_id, p2_id = game['players']
 
     if game['game_mode'] == 'group':
-        p1_mention = f"[{get_user_name(p1_id)}](tg://user?id={p1_id})"
-        p2_mention = f"[{get_user_name(p2_id)}](tg://user?id={p2_id})"
+        p1_mention = f"[{get_player_name(game, p1_id)}](tg://user?id={p1_id})"
+        p2_mention = f"[{get_player_name(game, p2_id)}](tg://user?id={p2_id})"
         header = f"{p1_mention} ({PLAYER_X}) vs {p2_mention} ({PLAYER_O})\n"
         if game.get('is_over'):
             return header + game.get('end_message', "Game Over!")
-        turn_mention = f"[{get_user_name(game['turn'])}](tg://user?id={game['turn']})"
+        turn_mention = f"[{get_player_name(game, game['turn'])}](tg://user?id={game['turn']})"
         status = f"🎯 It's {turn_mention}'s turn."
     else:  # DM or AI game
         you_id = perspective_of_player_id
         opponent_id = p2_id if you_id == p1_id else p1_id
         you_symbol = game['player_symbols'][you_id]
         opponent_symbol = game['player_symbols'][opponent_id]
-        opponent_name = "AI" if opponent_id == bot.get_me().id else get_user_name(opponent_id)
+        opponent_name = get_player_name(game, opponent_id)
         header = f"You ({you_symbol}) vs {opponent_name} ({opponent_symbol})\n"
         
         if game.get('is_over'):
             return header + game.get('end_message', "Game Over!")
         
         status = f"🎯 Your turn!" if game['turn'] == you_id else f"⏳ Waiting for {opponent_name}..."
+        if 'clocks' in game:
+            status += f"\n{EMOJI_TIMER} You {format_clock(get_time_left(game, you_id))} | "
+            status += f"{opponent_name} {format_clock(get_time_left(game, opponent_id))}"
 
     # Add spectator count if applicable
     game_id = game.get('game_id', '')
@@ -1119,104 +4336,193 @@ def get_game_status_text(game, perspective_of_player_id=None):
 
     return header + status
 
-def end_game(game_id, winner_id=None, is_draw=False, resigned_id=None):
-    if game_id not in games or games[game_id].get('is_over'):
+@traced('game')
+def end_game(game_id, winner_id=None, is_draw=False, resigned_id=None, timed_out_id=None):
+    """Close a game and publish it; saving, ratings, tournaments and final messages run on the event bus"""
+    game = games.get(game_id)
+    if not game:
         return
-    
-    game = games[game_id]
-    game['is_over'] = True
+    with game_lock(game):
+        if game.get('is_over'):
+            return
+        game['is_over'] = True
+    game['ended_at'] = time.time()
+    stop_game_clock(game)
     
     p1_id, p2_id = game['players']
     
-    # Save game to history
-    duration = int(time.time() - game.get('start_time', time.time()))
-    moves_count = len(game.get('move_history', []))
-    board_state = json.dumps(game['board'])
-    
-    game_data = (
-        game_id,
-        p1_id,
-        p2_id,
-        winner_id,
-        game.get('game_mode', 'unknown'),
-        duration,
-        moves_count,
-        board_state
-    )
+    # A player who runs out of time forfeits like a resignation
+    forfeit_id = resigned_id or timed_out_id
+    if forfeit_id:
+        winner_id = p2_id if forfeit_id == p1_id else p1_id
     
-    try:
-        save_game_history(game_data)
-    except Exception as e:
-        print(f"Error saving game history: {e}")
-    
-    # Update user stats
-    if resigned_id:
-        winner_id = p2_id if resigned_id == p1_id else p1_id
-        loser_id = resigned_id
-        winner_name = "AI" if winner_id == bot.get_me().id else get_user_name(winner_id)
-        loser_name = "AI" if loser_id == bot.get_me().id else get_user_name(loser_id)
-        end_message = f"{EMOJI_RESIGN} {loser_name} resigned! {EMOJI_WIN} {winner_name} wins!"
-        
-        if winner_id != bot.get_me().id:
-            stats = get_user_stats(winner_id) or {}
-            update_user_stats(winner_id, 
-                wins=stats.get('wins', 0) + 1,
-                total_games=stats.get('total_games', 0) + 1,
-                current_streak=stats.get('current_streak', 0) + 1,
-                longest_streak=max(stats.get('longest_streak', 0), stats.get('current_streak', 0) + 1)
-            )
-        if loser_id != bot.get_me().id:
-            stats = get_user_stats(loser_id) or {}
-            update_user_stats(loser_id,
-                losses=stats.get('losses', 0) + 1,
-                total_games=stats.get('total_games', 0) + 1,
-                current_streak=0
-            )
-            
+    if forfeit_id:
+        loser_id = forfeit_id
+        winner_name = get_player_name(game, winner_id)
+        loser_name = get_player_name(game, loser_id)
+        if resigned_id:
+            end_message = f"{EMOJI_RESIGN} {loser_name} resigned! {EMOJI_WIN} {winner_name} wins!"
+        else:
+            end_message = f"{EMOJI_TIMER} {loser_name} ran out of time! {EMOJI_WIN} {winner_name} wins!"
     elif is_draw:
         end_message = f"{EMOJI_DRAW} It's a draw! Well played!"
-        for player_id in [p1_id, p2_id]:
-            if player_id != bot.get_me().id:
-                stats = get_user_stats(player_id) or {}
-                update_user_stats(player_id,
-                    draws=stats.get('draws', 0) + 1,
-                    total_games=stats.get('total_games', 0) + 1
-                )
-            
     elif winner_id:
-        loser_id = p1_id if winner_id == p2_id else p2_id
-        winner_name = "AI" if winner_id == bot.get_me().id else get_user_name(winner_id)
+        winner_name = get_player_name(game, winner_id)
         end_message = f"{EMOJI_WIN} {winner_name} wins!"
-        
-        if winner_id != bot.get_me().id:
-            stats = get_user_stats(winner_id) or {}
-            update_user_stats(winner_id,
-                wins=stats.get('wins', 0) + 1,
-                total_games=stats.get('total_games', 0) + 1,
-                current_streak=stats.get('current_streak', 0) + 1,
-                longest_streak=max(stats.get('longest_streak', 0), stats.get('current_streak', 0) + 1)
-            )
-        if loser_id != bot.get_me().id:
-            stats = get_user_stats(loser_id) or {}
-            update_user_stats(loser_id,
-                losses=stats.get('losses', 0) + 1,
-                total_games=stats.get('total_games', 0) + 1,
-                current_streak=0
-            )
     else:
         end_message = "Game Over!"
-
     game['end_message'] = end_message
     
-    # Check if this is a tournament game
-    tournament_id = game.get('tournament_id')
-    if tournament_id and winner_id:
-        success, msg = tournament_manager.advance_tournament(tournament_id, winner_id)
-        if success:
-            end_message += f"\n\n🏟️ Tournament: {msg}"
+    # Clean up; subscribers get the game itself and a copy of its spectators
+    watchers = set(spectators.get(game_id, ()))
+    unindex_game(game_id, game)
+    spectate_registry.remove(game_id)
+    if game_id in games:
+        del games[game_id]
+    if game_id in spectators:
+        del spectators[game_id]
+    
+    event_bus.publish('game_finished', {
+        'game_id': game_id,
+        'game': game,
+        'winner_id': winner_id,
+        'is_draw': is_draw,
+        'finished': bool(forfeit_id or is_draw or winner_id),
+        'spectators': watchers,
+    })
+
+def persist_finished_game(event):
+    """game_finished -> save history, stats, ratings and achievements, then publish game_recorded
+    
+    Failed writes are retried; a game that still can't be saved goes to the
+    dead-letter file and is replayed at the next start.
+    """
+    game, game_id, winner_id, is_draw = event['game'], event['game_id'], event['winner_id'], event['is_draw']
+    p1_id, p2_id = game['players']
+    bot_id = get_bot_id()
+    humans = [player_id for player_id in (p1_id, p2_id) if player_id != bot_id]
+    event['humans'] = humans
+    event['rated'] = game.get('game_mode') in RATED_GAME_MODES and len(humans) == 2
+    event['rating_changes'], event['unlocked'] = {}, {}
+    
+    ai_outcome = None
+    if game.get('game_mode') == 'vs_ai':
+        ai_outcome = (game.get('difficulty', 'easy'), winner_id == bot_id, winner_id is not None and winner_id != bot_id)
+    
+    record = {
+        'game_id': game_id,
+        'players': [p1_id, p2_id],
+        'winner_id': winner_id,
+        'game_mode': game.get('game_mode', 'unknown'),
+        'duration': int(game['ended_at'] - game.get('start_time', game['ended_at'])),
+        'moves_count': len(game.get('move_history', [])),
+        'move_log': encode_game_moves(game).hex(),
+        'ai_outcome': ai_outcome,
+        'humans': humans,
+        'own_moves': [sum(1 for move in game.get('move_history', []) if move[0] == player_id) for player_id in humans],
+        'result_winner_id': None if is_draw else winner_id,
+        'rated': event['rated'],
+        'is_draw': bool(is_draw),
+        'finished': event['finished'],
+        'history_saved': False,
+        'result_saved': False,
+    }
+    try:
+        event['rating_changes'], event['unlocked'] = run_with_retries(lambda: write_game_record(record))
+    except Exception as e:
+        print(f"Error saving game {game_id}, keeping it for replay: {e}")
+        dead_letter_game(record)
+    finally:
+        event_bus.publish('game_recorded', event)
+
+def write_game_record(record):
+    """Save a finished game's history row, then its stats; returns (rating_changes, unlocked)
+    
+    Each step is its own transaction and marks itself done on the record, so
+    calling this again after a failure never saves a step twice.
+    """
+    if not record['history_saved']:
+        game_data = (record['game_id'], *record['players'], record['winner_id'], record['game_mode'],
+                     record['duration'], record['moves_count'], bytes.fromhex(record['move_log']))
+        save_game_history(game_data, record['ai_outcome'], record.get('is_draw', False))
+        record['history_saved'] = True
+    
+    if not record['finished'] or record['result_saved']:
+        return {}, {}
+    result = record_game_result(
+        record['game_id'], record['humans'], record['result_winner_id'], record['rated'],
+        record['game_mode'], record['duration'], dict(zip(record['humans'], record.get('own_moves', []))))
+    record['result_saved'] = True
+    return result
+
+def dead_letter_game(record):
+    with _failed_games_lock:
+        with open(FAILED_GAMES_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+def replay_failed_games():
+    """Retry games that couldn't be saved before; returns how many were saved now"""
+    with _failed_games_lock:
+        try:
+            with open(FAILED_GAMES_FILE, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return 0
+        
+        remaining = []
+        for record in records:
+            try:
+                write_game_record(record)
+            except Exception as e:
+                print(f"Error replaying game {record['game_id']}: {e}")
+                remaining.append(record)
+        
+        if remaining:
+            with open(FAILED_GAMES_FILE + '.tmp', 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(record) + '\n' for record in remaining)
+            os.replace(FAILED_GAMES_FILE + '.tmp', FAILED_GAMES_FILE)
+        else:
+            os.remove(FAILED_GAMES_FILE)
+    return len(records) - len(remaining)
+
+def advance_finished_tournament_game(event):
+    """game_recorded -> advance the game's tournament, if any, then publish game_settled"""
+    game = event['game']
+    try:
+        if game.get('tournament_id'):
+            event['tournament_message'] = run_with_retries(
+                lambda: on_tournament_game_finished(game, event['winner_id'], event['is_draw']))
+    except Exception as e:
+        # Nothing was applied; resume_tournaments relaunches the match on the next start
+        print(f"Error advancing tournament {game['tournament_id']}: {e}")
+    finally:
+        event_bus.publish('game_settled', event)
+
+def notify_game_finished(event):
+    """game_settled -> show the final board and result to players and spectators"""
+    game = event['game']
+    end_message = game['end_message']
+    
+    if event['rated'] and event['rating_changes']:
+        changes = ', '.join(f"{get_player_name(game, player_id)} {event['rating_changes'][player_id]:+d}"
+                            for player_id in event['humans'])
+        end_message += f"\n📈 Rating: {changes}"
+    for player_id, bits in event['unlocked'].items():
+        if bits:
+            end_message += f"\n🏅 {get_player_name(game, player_id)} unlocked: {describe_achievements(bits)}"
+    if event.get('tournament_message'):
+        end_message += f"\n\n🏟️ Tournament: {event['tournament_message']}"
+    
+    game['end_message'] = end_message
+    bump_game_version(game)
     
     # Create end game markup
-    if game['game_mode'] != 'group':
+    if game['game_mode'] == 'tournament':
+        end_markup = InlineKeyboardMarkup(row_width=2).add(
+            InlineKeyboardButton(f"{EMOJI_TOURNAMENT} Tournament", callback_data=f"view_tournament_{game['tournament_id']}"),
+            InlineKeyboardButton(f"{EMOJI_BACK} Main Menu", callback_data="main_menu")
+        )
+    elif game['game_mode'] != 'group':
         if game['game_mode'] == 'vs_ai':
             difficulty = game.get('difficulty', 'easy')
             rematch_data = f"rematch_ai_{difficulty}"
@@ -1240,7 +4546,7 @@ def end_game(game_id, winner_id=None, is_draw=False, resigned_id=None):
             print(f"Error in end_game group: {e}")
     else:
         for p_id in game['players']:
-            if p_id == bot.get_me().id:
+            if p_id == get_bot_id():
                 continue
             text = get_game_status_text(game, p_id) + WATERMARK
             try:
@@ -1249,26 +4555,26 @@ def end_game(game_id, winner_id=None, is_draw=False, resigned_id=None):
                 print(f"Error in end_game DM: {e}")
 
     # Update spectators with final result
-    if game_id in spectators:
+    if event['spectators']:
         final_spectator_text = get_spectator_status_text(game) + WATERMARK
         spectator_markup = InlineKeyboardMarkup()
         spectator_markup.add(InlineKeyboardButton(f"{EMOJI_BACK} Spectate Menu", callback_data="spectate"))
         
-        for spectator_id in spectators[game_id]:
+        for spectator_id in event['spectators']:
             try:
                 safe_edit_message(spectator_id, game.get('spectator_messages', {}).get(spectator_id), 
                                 final_spectator_text, spectator_markup)
             except Exception as e:
                 print(f"Error updating final spectator {spectator_id}: {e}")
 
-    # Clean up
-    if game_id in games:
-        del games[game_id]
-    if game_id in spectators:
-        del spectators[game_id]
+# A finished game flows persistence -> tournaments -> notifications, each on its own worker
+event_bus.subscribe('game_finished', persist_finished_game, name='persistence')
+event_bus.subscribe('game_recorded', advance_finished_tournament_game, name='tournaments')
+event_bus.subscribe('game_settled', notify_game_finished, name='notifications')
 
 # -------------------- ENHANCED CALLBACK HANDLER --------------------
 @bot.callback_query_handler(func=lambda call: True)
+@traced_handler
 def handle_enhanced_callback(call):
     user_id = call.from_user.id
     data_parts = call.data.split('_')
@@ -1304,36 +4610,66 @@ def handle_enhanced_callback(call):
         
         # VS Friend Menu
         elif action == 'vs' and len(data_parts) > 2 and data_parts[1] == 'friend' and data_parts[2] == 'menu':
-            game_id = str(uuid.uuid4())[:8]
-            games[game_id] = {
-                'game_id': game_id,
-                'players': [user_id],
-                'message_ids': {user_id: call.message.message_id},
-                'game_mode': 'friend_dm',
-                'created_at': time.time(),
-                'start_time': time.time()
-            }
+            # Opening the menu shows the invitation already shared; only "New Invitation"
+            # and the time-control buttons (which name a time control) replace it
+            game_id = None if len(data_parts) > 3 else get_pending_invitation(user_id)
+            if game_id:
+                game = games[game_id]
+                game['message_ids'][user_id] = call.message.message_id
+                time_control = game['time_control']
+                answer = "🔗 Your invitation is still open. Share the link with a friend."
+            else:
+                cancel_pending_invitations(user_id)
+                time_control = data_parts[3] if len(data_parts) > 3 and data_parts[3] in TIME_CONTROLS else DEFAULT_FRIEND_TIME_CONTROL
+                game_id = str(uuid.uuid4())[:8]
+                game = games[game_id] = {
+                    'game_id': game_id,
+                    'players': [user_id],
+                    'message_ids': {user_id: call.message.message_id},
+                    'game_mode': 'friend_dm',
+                    'time_control': time_control,
+                    'created_at': time.time(),
+                    'start_time': time.time()
+                }
+                if not index_game(game_id):
+                    games.pop(game_id, None)
+                    bot.answer_callback_query(call.id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.", show_alert=True)
+                    return
+                clock_scheduler.schedule(time.time() + INVITATION_TTL, _expire_invitation, game_id)
+                answer = "🔗 Invitation created! Share the link with a friend."
+            minutes_left = max(1, math.ceil((game['created_at'] + INVITATION_TTL - time.time()) / 60))
             
-            bot_username = bot.get_me().username
+            bot_username = get_bot_identity().username
             share_link = f"https://t.me/{bot_username}?start={game_id}"
+            tc = TIME_CONTROLS[time_control]
             
             text = f"👥 Waiting for a Friend...\n\n"
             text += f"Share this link with a friend to play:\n"
             text += f"`{share_link}`\n\n"
-            text += f"⏰ This invitation expires in 10 minutes."
+            text += f"{EMOJI_TIMER} Time control: {tc['name']} ({format_clock(tc['initial'])} per player"
+            text += f", +{tc['increment']}s per move)\n" if tc['increment'] else ")\n"
+            text += f"⏰ This invitation expires in {minutes_left} minutes."
             
             markup = InlineKeyboardMarkup()
+            markup.add(*[
+                InlineKeyboardButton(other['name'], callback_data=f"vs_friend_menu_{name}")
+                for name, other in TIME_CONTROLS.items() if name != time_control
+            ])
             markup.add(
-                InlineKeyboardButton(f"{EMOJI_REFRESH} New Invitation", callback_data="vs_friend_menu"),
+                InlineKeyboardButton(f"{EMOJI_REFRESH} New Invitation", callback_data=f"vs_friend_menu_{time_control}"),
                 InlineKeyboardButton(f"{EMOJI_BACK} Back", callback_data="main_menu")
             )
             
             safe_edit_message(user_id, call.message.message_id, text + WATERMARK, markup)
-            bot.answer_callback_query(call.id, "🔗 Invitation created! Share the link with a friend.")
+            bot.answer_callback_query(call.id, answer)
         
         # AI Difficulty Selection
         elif action == 'ai':
             if len(data_parts) > 1:
+                if not can_start_game(user_id):
+                    bot.answer_callback_query(call.id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.", show_alert=True)
+                    return
+                
                 difficulty = data_parts[1]
                 game_id = str(uuid.uuid4())[:8]
                 
@@ -1341,8 +4677,8 @@ def handle_enhanced_callback(call):
                     'game_id': game_id,
                     'chat_id': user_id,
                     'message_ids': {user_id: call.message.message_id},
-                    'players': [user_id, bot.get_me().id],
-                    'player_symbols': {user_id: PLAYER_X, bot.get_me().id: PLAYER_O},
+                    'players': [user_id, get_bot_id()],
+                    'player_symbols': {user_id: PLAYER_X, get_bot_id(): PLAYER_O},
                     'board': [[EMPTY] * BOARD_SIZE for _ in range(BOARD_SIZE)],
                     'turn': user_id,
                     'is_over': False,
@@ -1354,12 +4690,21 @@ def handle_enhanced_callback(call):
                     'created_at': time.time(),
                     'start_time': time.time()
                 }
+                if not index_game(game_id):
+                    games.pop(game_id, None)
+                    bot.answer_callback_query(call.id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.", show_alert=True)
+                    return
+                snapshot_player_names(games[game_id])
                 
                 bot.answer_callback_query(call.id, f"🤖 Started game vs {difficulty.title()} AI!")
                 update_game_state(game_id)
         
         # Rematch AI
         elif action == 'rematch' and len(data_parts) > 2 and data_parts[1] == 'ai':
+            if not can_start_game(user_id):
+                bot.answer_callback_query(call.id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.", show_alert=True)
+                return
+            
             difficulty = data_parts[2]
             game_id = str(uuid.uuid4())[:8]
             
@@ -1367,8 +4712,8 @@ def handle_enhanced_callback(call):
                 'game_id': game_id,
                 'chat_id': user_id,
                 'message_ids': {user_id: call.message.message_id},
-                'players': [user_id, bot.get_me().id],
-                'player_symbols': {user_id: PLAYER_X, bot.get_me().id: PLAYER_O},
+                'players': [user_id, get_bot_id()],
+                'player_symbols': {user_id: PLAYER_X, get_bot_id(): PLAYER_O},
                 'board': [[EMPTY] * BOARD_SIZE for _ in range(BOARD_SIZE)],
                 'turn': user_id,
                 'is_over': False,
@@ -1380,6 +4725,11 @@ def handle_enhanced_callback(call):
                 'created_at': time.time(),
                 'start_time': time.time()
             }
+            if not index_game(game_id):
+                games.pop(game_id, None)
+                bot.answer_callback_query(call.id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.", show_alert=True)
+                return
+            snapshot_player_names(games[game_id])
             
             bot.answer_callback_query(call.id, f"🔁 New game vs {difficulty.title()} AI!")
             update_game_state(game_id)
@@ -1394,55 +4744,61 @@ def handle_enhanced_callback(call):
                 return
 
             game = games[game_id]
-            if user_id != game['turn']:
-                bot.answer_callback_query(call.id, "❌ It's not your turn!")
-                return
-            if game['board'][r][c] != EMPTY:
-                bot.answer_callback_query(call.id, "❌ This spot is already taken!")
-                return
+            with game_lock(game):
+                if game.get('is_over'):
+                    bot.answer_callback_query(call.id, "❌ This game has ended!", show_alert=True)
+                    return
+                if user_id != game['turn']:
+                    bot.answer_callback_query(call.id, "❌ It's not your turn!")
+                    return
+                if game['board'][r][c] != EMPTY:
+                    bot.answer_callback_query(call.id, "❌ This spot is already taken!")
+                    return
 
-            # Make the move
-            game['board'][r][c] = game['player_symbols'][user_id]
-            game.setdefault('move_history', []).append((user_id, r, c, time.time()))
+                # Make the move
+                game['board'][r][c] = game['player_symbols'][user_id]
+                game.setdefault('move_history', []).append((user_id, r, c, time.time()))
             
-            # Check for win
-            if check_win(game['board'], game['player_symbols'][user_id]):
-                end_game(game_id, winner_id=user_id)
-                bot.answer_callback_query(call.id, "🎉 You won!")
-                return
+                # Check for win
+                if check_win(game['board'], game['player_symbols'][user_id]):
+                    bot.answer_callback_query(call.id, "🎉 You won!")
+                    end_game(game_id, winner_id=user_id)
+                    return
             
-            # Check for draw
-            if is_board_full(game['board']):
-                end_game(game_id, is_draw=True)
-                bot.answer_callback_query(call.id, "🤝 It's a draw!")
-                return
+                # Check for draw
+                if is_board_full(game['board']):
+                    bot.answer_callback_query(call.id, "🤝 It's a draw!")
+                    end_game(game_id, is_draw=True)
+                    return
 
-            # Switch turn
-            game['turn'] = game['players'][1] if user_id == game['players'][0] else game['players'][0]
+                # Switch turn
+                game['turn'] = game['players'][1] if user_id == game['players'][0] else game['players'][0]
+                switch_turn_clock(game, user_id)
 
-            # Handle AI move if it's an AI game
-            if game['game_mode'] == 'vs_ai' and game['turn'] == bot.get_me().id:
-                difficulty = game.get('difficulty', 'easy')
-                ai = AdvancedAI(difficulty)
-                ai_move = ai.get_move(game['board'], PLAYER_O)
+                # Handle AI move if it's an AI game
+                if game['game_mode'] == 'vs_ai' and game['turn'] == get_bot_id():
+                    difficulty = game.get('difficulty', 'easy')
+                    ai = AdvancedAI(difficulty)
+                    ai_move = ai.get_move(game['board'], PLAYER_O)
                 
-                if ai_move != (-1, -1):
-                    game['board'][ai_move[0]][ai_move[1]] = PLAYER_O
-                    game['move_history'].append(('AI', ai_move[0], ai_move[1], time.time()))
-
-                    if check_win(game['board'], PLAYER_O):
-                        end_game(game_id, winner_id=bot.get_me().id)
-                        bot.answer_callback_query(call.id, "🤖 AI wins!")
-                        return
-                    elif is_board_full(game['board']):
-                        end_game(game_id, is_draw=True)
-                        bot.answer_callback_query(call.id, "🤝 It's a draw!")
-                        return
-                    else:
-                        game['turn'] = user_id
+                    if ai_move != (-1, -1):
+                        game['board'][ai_move[0]][ai_move[1]] = PLAYER_O
+                        game['move_history'].append(('AI', ai_move[0], ai_move[1], time.time()))
 
-            update_game_state(game_id)
-            bot.answer_callback_query(call.id, "✅ Move made!")
+                        if check_win(game['board'], PLAYER_O):
+                            bot.answer_callback_query(call.id, "🤖 AI wins!")
+                            end_game(game_id, winner_id=get_bot_id())
+                            return
+                        elif is_board_full(game['board']):
+                            bot.answer_callback_query(call.id, "🤝 It's a draw!")
+                            end_game(game_id, is_draw=True)
+                            return
+                        else:
+                            game['turn'] = user_id
+
+                bump_game_version(game)
+                update_game_state(game_id)
+                bot.answer_callback_query(call.id, "✅ Move made!")
         
         # Game Hints
         elif action == 'hint':
@@ -1490,7 +4846,10 @@ def handle_enhanced_callback(call):
                     game['board'][r][c] = EMPTY
             
             # Reset turn to current player
+            previous_turn = game['turn']
             game['turn'] = user_id
+            switch_turn_clock(game, previous_turn)
+            bump_game_version(game)
             update_game_state(game_id)
             bot.answer_callback_query(call.id, "↩️ Last moves undone!")
         
@@ -1501,11 +4860,20 @@ def handle_enhanced_callback(call):
                 bot.answer_callback_query(call.id, "❌ This game has ended!", show_alert=True)
                 return
             
-            end_game(game_id, resigned_id=user_id)
-            bot.answer_callback_query(call.id, "🏳️ You have resigned!")
+            game = games[game_id]
+            with game_lock(game):
+                if game.get('is_over'):
+                    bot.answer_callback_query(call.id, "❌ This game has ended!", show_alert=True)
+                    return
+                bot.answer_callback_query(call.id, "🏳️ You have resigned!")
+                end_game(game_id, resigned_id=user_id)
         
         # Quick Match System
         elif action == 'quick' and len(data_parts) > 1 and data_parts[1] == 'match':
+            if not can_start_game(user_id):
+                bot.answer_callback_query(call.id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.", show_alert=True)
+                return
+            
             # Try to find a match immediately
             opponent_id = find_quick_match(user_id)
             
@@ -1528,16 +4896,24 @@ def handle_enhanced_callback(call):
                     'created_at': time.time(),
                     'start_time': time.time()
                 }
+                if not index_game(game_id):
+                    games.pop(game_id, None)
+                    add_to_quick_match_queue(opponent_id)
+                    bot.answer_callback_query(call.id, f"❌ You already have {MAX_ACTIVE_GAMES_PER_USER} active games! Finish one first.", show_alert=True)
+                    return
+                snapshot_player_names(games[game_id])
+                start_game_clock(games[game_id], QUICK_MATCH_TIME_CONTROL)
+                register_spectatable_game(games[game_id])
                 
                 # Send game to both players
                 for player_id in [user_id, opponent_id]:
                     if player_id == user_id:
                         games[game_id]['message_ids'][player_id] = call.message.message_id
                         safe_edit_message(call.message.chat.id, call.message.message_id,
-                                        f"⚔️ Quick Match Found!\n\nOpponent: {get_user_name(opponent_id)}" + WATERMARK)
+                                        f"⚔️ Quick Match Found!\n\nOpponent: {get_player_name(games[game_id], opponent_id)}" + WATERMARK)
                     else:
                         try:
-                            msg = bot.send_message(player_id, f"⚔️ Quick Match Found!\n\nOpponent: {get_user_name(user_id)}" + WATERMARK)
+                            msg = bot.send_message(player_id, f"⚔️ Quick Match Found!\n\nOpponent: {get_player_name(games[game_id], user_id)}" + WATERMARK)
                             games[game_id]['message_ids'][player_id] = msg.message_id
                         except Exception as e:
                             print(f"Error sending quick match message to {player_id}: {e}")
@@ -1580,7 +4956,8 @@ def handle_enhanced_callback(call):
                 text += f"{EMOJI_CROWN} Admin Access Enabled\n\n"
             
             text += f"🎯 Active Tournaments: {len(active_tournaments)}\n"
-            text += f"🏆 Your Tournament Wins: {get_user_stats(user_id).get('tournament_wins', 0) if get_user_stats(user_id) else 0}"
+            stats = get_user_stats(user_id) or {}
+            text += f"🏆 Your Tournament Wins: {stats.get('tournament_wins', 0)}"
             
             markup = InlineKeyboardMarkup(row_width=2)
             
@@ -1622,19 +4999,25 @@ def handle_enhanced_callback(call):
             max_players = int(data_parts[2])
             user_input_state[user_id]['max_players'] = max_players
             user_input_state[user_id]['state'] = 'tournament_prize'
+            user_input_state[user_id].setdefault('format', DEFAULT_TOURNAMENT_FORMAT)
             
-            text = f"🏟️ Tournament Setup\n\n"
-            text += f"Name: {user_input_state[user_id]['tournament_name']}\n"
-            text += f"Max Players: {max_players}\n\n"
-            text += f"Enter the prize description (optional, or type 'Glory'):"
-            
-            markup = InlineKeyboardMarkup()
-            markup.add(InlineKeyboardButton("🏆 Use 'Glory'", callback_data="tournament_prize_glory"))
-            markup.add(InlineKeyboardButton("❌ Cancel", callback_data="tournament_menu"))
-            
+            text, markup = create_tournament_setup_screen(user_input_state[user_id])
             safe_edit_message(call.message.chat.id, call.message.message_id, text + WATERMARK, markup)
             bot.answer_callback_query(call.id, "🏆 Enter prize description...")
         
+        # Tournament Format Selection
+        elif action == 'tournament' and len(data_parts) > 2 and data_parts[1] == 'format':
+            setup = user_input_state.get(user_id, {})
+            tournament_format = '_'.join(data_parts[2:])
+            if setup.get('state') != 'tournament_prize' or tournament_format not in TOURNAMENT_FORMATS:
+                bot.answer_callback_query(call.id, "❌ Tournament setup expired!")
+                return
+            
+            setup['format'] = tournament_format
+            text, markup = create_tournament_setup_screen(setup)
+            safe_edit_message(call.message.chat.id, call.message.message_id, text + WATERMARK, markup)
+            bot.answer_callback_query(call.id, f"{TOURNAMENT_FORMATS[tournament_format]} selected")
+        
         # Tournament Prize Glory
         elif action == 'tournament' and len(data_parts) > 2 and data_parts[1] == 'prize' and data_parts[2] == 'glory':
             # Simulate message with "Glory" as prize
@@ -1642,6 +5025,8 @@ def handle_enhanced_callback(call):
                 def __init__(self, text):
                     self.text = text
                     self.from_user = call.from_user
+                    self.chat = call.message.chat
+                    self.message_id = call.message.message_id
             
             handle_tournament_prize(MockMessage("Glory"))
             bot.answer_callback_query(call.id)
@@ -1704,6 +5089,7 @@ def handle_enhanced_callback(call):
             text += f"🆔 ID: {tournament_id}\n"
             text += f"👑 Creator: {get_user_name(tournament['creator'])}\n"
             text += f"👥 Players: {len(tournament['participants'])}/{tournament['max_players']}\n"
+            text += f"📐 Format: {TOURNAMENT_FORMATS[tournament['format']]}\n"
             text += f"📊 Status: {tournament['status'].title()}\n"
             text += f"🏆 Prize: {tournament.get('prize_pool', 'Glory')}\n\n"
             
@@ -1713,7 +5099,12 @@ def handle_enhanced_callback(call):
                     text += f"{i}. {get_user_name(participant_id)}\n"
             elif tournament['status'] == 'active':
                 text += f"🔥 Tournament in progress!\n"
-                text += f"Current Round: {tournament.get('current_round', 1)}"
+                text += f"Current Round: {tournament.get('current_round', 1)}/{tournament['total_rounds']}\n\n"
+            elif tournament.get('winner'):
+                text += f"{EMOJI_CROWN} Champion: {get_user_name(tournament['winner'])}\n\n"
+            
+            if tournament['status'] != 'waiting' and tournament['format'] != 'elimination':
+                text += format_tournament_standings(tournament)
             
             markup = InlineKeyboardMarkup()
             
@@ -1751,6 +5142,7 @@ def handle_enhanced_callback(call):
             success, msg = tournament_manager.start_tournament(tournament_id, user_id)
             
             if success:
+                launch_tournament_round(tournament_id)
                 bot.answer_callback_query(call.id, f"🚀 {msg}")
                 # Refresh tournament view
                 handle_enhanced_callback(type('obj', (object,), {'data': f'view_tournament_{tournament_id}', 'id': call.id, 'from_user': call.from_user, 'message': call.message})())
@@ -1759,30 +5151,10 @@ def handle_enhanced_callback(call):
         
         # Spectate System
         elif action == 'spectate':
-            if len(data_parts) == 1:  # Main spectate menu
-                active_games = get_spectatable_games()
-                
-                if not active_games:
-                    text = f"👁️ Spectate Games\n\nNo active games to spectate right now.\nCheck back later!"
-                    markup = InlineKeyboardMarkup()
-                    markup.add(InlineKeyboardButton(f"{EMOJI_BACK} Back", callback_data="main_menu"))
-                else:
-                    text = f"👁️ Active Games ({len(active_games)} available)\n\n"
-                    markup = InlineKeyboardMarkup(row_width=1)
-                    
-                    for game in active_games[:5]:  # Show max 5 games
-                        players_text = " vs ".join(game['players'])
-                        spectator_text = f" ({game['spectators']} watching)" if game['spectators'] > 0 else ""
-                        
-                        markup.add(InlineKeyboardButton(
-                            f"👁️ {players_text}{spectator_text}",
-                            callback_data=f"spectate_game_{game['id']}"
-                        ))
-                    
-                    markup.add(
-                        InlineKeyboardButton(f"🔄 Refresh", callback_data="spectate"),
-                        InlineKeyboardButton(f"{EMOJI_BACK} Back", callback_data="main_menu")
-                    )
+            if len(data_parts) == 1 or data_parts[1] == 'page':  # Spectate lobby page
+                sort = data_parts[2] if len(data_parts) > 2 and data_parts[2] in SPECTATE_SORTS else 'recent'
+                cursor = data_parts[3] if len(data_parts) > 3 else None
+                text, markup = spectate_registry.render_page(sort, cursor)
                 
                 safe_edit_message(call.message.chat.id, call.message.message_id, text + WATERMARK, markup)
                 bot.answer_callback_query(call.id)
@@ -1853,26 +5225,28 @@ def handle_enhanced_callback(call):
                 markup.add(InlineKeyboardButton(f"{EMOJI_BACK} Back", callback_data="main_menu"))
             else:
                 text = f"📜 Game History (Last 10 games)\n\n"
+                replay_buttons = []
                 
                 for i, game_record in enumerate(history, 1):
-                    # Unpack the game record properly
-                    if len(game_record) >= 9:
-                        game_id, p1_id, p2_id, winner_id, game_mode, duration, moves, board_state, created_at = game_record[:9]
-                        
-                        opponent_id = p2_id if p1_id == user_id else p1_id
-                        opponent_name = "AI" if opponent_id == bot.get_me().id else get_user_name(opponent_id)
-                        
-                        if winner_id == user_id:
-                            result = "🎉 Won"
-                        elif winner_id is None:
-                            result = "🤝 Draw"
-                        else:
-                            result = "❌ Lost"
-                        
-                        text += f"`{i}.` vs {opponent_name} - {result}\n"
-                        text += f"   ⏱️ {duration}s | 📊 {moves} moves | {game_mode}\n\n"
+                    history_id, game_id, p1_id, p2_id, winner_id, game_mode, duration, moves, created_at = game_record
+                    
+                    opponent_id = p2_id if p1_id == user_id else p1_id
+                    opponent_name = get_user_name(opponent_id)
+                    
+                    if winner_id == user_id:
+                        result = "🎉 Won"
+                    elif winner_id is None:
+                        result = "🤝 Draw"
+                    else:
+                        result = "❌ Lost"
+                    
+                    text += f"`{i}.` vs {opponent_name} - {result}\n"
+                    text += f"   ⏱️ {duration}s | 📊 {moves} moves | {game_mode}\n\n"
+                    replay_buttons.append(InlineKeyboardButton(f"▶️ {i}", callback_data=f"replay_{history_id}_0"))
                 
-                markup = InlineKeyboardMarkup(row_width=2)
+                text += f"Tap a number to replay that game."
+                markup = InlineKeyboardMarkup(row_width=5)
+                markup.add(*replay_buttons)
                 markup.add(
                     InlineKeyboardButton(f"🔄 Refresh", callback_data="history")
                 )
@@ -1881,6 +5255,17 @@ def handle_enhanced_callback(call):
             safe_edit_message(call.message.chat.id, call.message.message_id, text + WATERMARK, markup)
             bot.answer_callback_query(call.id)
         
+        # Game Replay
+        elif action == 'replay' and len(data_parts) > 2:
+            record = get_game_record(int(data_parts[1]))
+            if not record or user_id not in (record['player1_id'], record['player2_id']):
+                bot.answer_callback_query(call.id, "❌ Game not found!")
+                return
+            
+            text, markup = create_replay_screen(record, int(data_parts[2]))
+            safe_edit_message(call.message.chat.id, call.message.message_id, text + WATERMARK, markup)
+            bot.answer_callback_query(call.id)
+        
         # Statistics Menu
         elif action == 'stats' and len(data_parts) > 1 and data_parts[1] == 'menu':
             stats = get_user_stats(user_id) or {}
@@ -1891,7 +5276,8 @@ def handle_enhanced_callback(call):
             text += f"✅ Wins: `{stats.get('wins', 0)}`\n"
             text += f"❌ Losses: `{stats.get('losses', 0)}`\n"
             text += f"🤝 Draws: `{stats.get('draws', 0)}`\n"
-            text += f"📈 Win Rate: `{win_rate:.1f}%`\n\n"
+            text += f"📈 Win Rate: `{win_rate:.1f}%`\n"
+            text += f"⭐ Rating: `{stats.get('elo_rating', ELO_DEFAULT_RATING)}`\n\n"
             text += f"🔥 Current Streak: `{stats.get('current_streak', 0)} wins`\n"
             text += f"🏆 Longest Streak: `{stats.get('longest_streak', 0)} wins`\n\n"
             text += f"🤖 vs AI: {stats.get('ai_wins', 0)}W-{stats.get('ai_losses', 0)}L\n"
@@ -1911,7 +5297,7 @@ def handle_enhanced_callback(call):
             text = f"⚙️ Settings\n\n"
             text += f"👤 Name: {get_user_name(user_id)}\n"
             text += f"🎨 Theme: {current_theme.title()}\n"
-            text += f"🏅 Achievements: {len(json.loads(stats.get('achievements', '[]')))}"
+            text += f"🏅 Achievements: {count_achievements(stats)}"
             
             markup = InlineKeyboardMarkup(row_width=1)
             markup.add(
@@ -1951,7 +5337,7 @@ def handle_enhanced_callback(call):
                 text = f"⚙️ Settings\n\n"
                 text += f"👤 Name: {get_user_name(user_id)}\n"
                 text += f"🎨 Theme: {current_theme.title()}\n"
-                text += f"🏅 Achievements: {len(json.loads(stats.get('achievements', '[]')))}"
+                text += f"🏅 Achievements: {count_achievements(stats)}"
                 
                 markup = InlineKeyboardMarkup(row_width=1)
                 markup.add(
@@ -1965,30 +5351,19 @@ def handle_enhanced_callback(call):
         # Achievements
         elif action == 'achievements':
             stats = get_user_stats(user_id) or {}
-            user_achievements = json.loads(stats.get('achievements', '[]'))
-            
-            # Define all achievements
-            all_achievements = [
-                {'id': 'first_win', 'name': 'First Victory', 'desc': 'Win your first game', 'icon': '🥇'},
-                {'id': 'streak_5', 'name': 'Streak Master', 'desc': 'Win 5 games in a row', 'icon': '🔥'},
-                {'id': 'ai_destroyer', 'name': 'AI Destroyer', 'desc': 'Beat the AI 10 times', 'icon': '🤖💥'},
-                {'id': 'social_player', 'name': 'Social Player', 'desc': 'Play 25 games with friends', 'icon': '👥'},
-                {'id': 'veteran', 'name': 'Veteran', 'desc': 'Play 100 total games', 'icon': '🎖️'},
-                {'id': 'unbeatable', 'name': 'Unbeatable', 'desc': 'Win 10 games in a row', 'icon': '🛡️'},
-                {'id': 'tournament_champion', 'name': 'Tournament Champion', 'desc': 'Win a tournament', 'icon': '🏆'},
-            ]
+            bits = stats.get('achievement_bits') or 0
             
             text = "🏅 Your Achievements\n\n"
             unlocked_count = 0
             
-            for ach in all_achievements:
-                if ach['id'] in user_achievements:
+            for ach in ACHIEVEMENTS:
+                if bits & ACHIEVEMENT_BITS[ach['id']]:
                     text += f"✅ {ach['icon']} {ach['name']}\n   {ach['desc']}\n\n"
                     unlocked_count += 1
                 else:
                     text += f"🔒 {ach['name']}\n   {ach['desc']}\n\n"
             
-            text += f"📊 Progress: {unlocked_count}/{len(all_achievements)} unlocked"
+            text += f"📊 Progress: {unlocked_count}/{len(ACHIEVEMENTS)} unlocked"
             
             markup = InlineKeyboardMarkup()
             markup.add(InlineKeyboardButton(f"{EMOJI_BACK} Back", callback_data="main_menu"))
@@ -1996,6 +5371,44 @@ def handle_enhanced_callback(call):
             safe_edit_message(user_id, call.message.message_id, text + WATERMARK, markup)
             bot.answer_callback_query(call.id)
         
+        # My Games
+        elif action == 'my' and len(data_parts) > 1 and data_parts[1] == 'games':
+            my_games = [games[gid] for gid in get_user_game_ids(user_id) if gid in games]
+            my_games.sort(key=lambda g: g.get('created_at', 0), reverse=True)
+            
+            text = f"🎮 My Games ({len(my_games)}/{MAX_ACTIVE_GAMES_PER_USER})\n\n"
+            markup = InlineKeyboardMarkup(row_width=1)
+            
+            if not my_games:
+                text += "You have no games in progress."
+            for game in my_games:
+                if len(game['players']) < 2:
+                    text += f"⏳ Invitation {game['game_id']} waiting for a friend\n"
+                    continue
+                opponent_id = next(p for p in game['players'] if p != user_id)
+                turn_text = "your turn" if game.get('turn') == user_id else "waiting"
+                markup.add(InlineKeyboardButton(
+                    f"▶️ vs {get_player_name(game, opponent_id)} ({turn_text})",
+                    callback_data=f"resume_game_{game['game_id']}"
+                ))
+            
+            markup.add(InlineKeyboardButton(f"{EMOJI_BACK} Back", callback_data="main_menu"))
+            safe_edit_message(user_id, call.message.message_id, text + WATERMARK, markup)
+            bot.answer_callback_query(call.id)
+        
+        # Resume Game (move the board into this message)
+        elif action == 'resume' and len(data_parts) > 2 and data_parts[1] == 'game':
+            game_id = data_parts[2]
+            game = games.get(game_id)
+            if not game or user_id not in game['players'] or game['game_mode'] == 'group':
+                bot.answer_callback_query(call.id, "❌ This game has ended!", show_alert=True)
+                return
+            
+            game['message_ids'][user_id] = call.message.message_id
+            text = get_game_status_text(game, user_id) + WATERMARK
+            safe_edit_message(user_id, call.message.message_id, text, create_enhanced_board_markup(game))
+            bot.answer_callback_query(call.id)
+        
         # Coming soon features
         elif action in ['my', 'change'] and len(data_parts) > 1:
             if data_parts[1] in ['tournaments', 'name'] or (action == 'tournament' and data_parts[1] == 'history'):
@@ -2035,20 +5448,57 @@ def main():
     init_database()
     print("✅ Database initialized")
     
+    # Resolve the bot's own identity once instead of per render
+    print(f"🤖 Running as @{get_bot_identity().username}")
+    
+    # Move old games out of the main database in the background
+    start_history_archiver()
+    
+    # Drop cached stats that other bot processes change
+    start_stats_invalidation_listener()
+    
+    # Active-user sketches are restored from and saved back to the database
+    start_presence_tracking()
+    
+    # Games whose results couldn't be saved last time
+    replayed = replay_failed_games()
+    if replayed:
+        print(f"💾 Saved {replayed} game(s) left over from the last run")
+    
+    # Tournaments load lazily; only rounds in progress need their games recreated
+    resumed = resume_tournaments()
+    if resumed:
+        print(f"🏟️ Resumed {resumed} active tournament(s)")
+    
+    broadcast_id = resume_broadcasts()
+    if broadcast_id:
+        print(f"📣 Resumed broadcast #{broadcast_id}")
+    
     # Start bot
     print("🎮 Advanced Tic-Tac-Toe Bot is now running!")
     print("Features: AI opponents, Quick Match, Game History, Themes, Tournaments, and more!")
     print(f"👑 Admin ID: {ADMIN_IDS[0]}")
     
-    try:
-        bot.infinity_polling(timeout=10, long_polling_timeout=5)
-    except Exception as e:
-        print(f"❌ FATAL ERROR: {e}")
-        time.sleep(15)
-        main()  # Restart on error
+    # Only polling restarts on error; the setup above must run once per process
+    while True:
+        try:
+            bot.infinity_polling(timeout=10, long_polling_timeout=5)
+            break
+        except Exception as e:
+            print(f"❌ FATAL ERROR: {e}")
+            time.sleep(15)
 
 if __name__ == '__main__':
-
-    main()
+    if sys.argv[1:2] == ['recompute-ratings']:
+        # python main.py recompute-ratings [--restart]
+        init_database()
+        recompute_ratings(restart='--restart' in sys.argv[2:])
+    elif sys.argv[1:2] == ['export']:
+        # python main.py export <table> [options], see run_export_cli
+        with redirect_stdout(sys.stderr):  # Keep migration messages out of an export to stdout
+            init_database()
+        run_export_cli(sys.argv[2:])
+    else:
+        main()
 
 
@@ -0,0 +1,171 @@
+"""Replay a recorded update stream against the bot and a fake Bot API.
+
+Reads a log written with RECORD_UPDATES_FILE (gzip NDJSON, one anonymized
+update per line) and feeds it to the bot through the fake API from
+loadtest.py, keeping the recorded pacing at 1x, Nx or maximum speed.
+Updates of one user are replayed in order; different users run concurrently,
+so bursts and spectator spikes reach the bot as they did in production.
+
+Usage:
+    python replay.py updates.ndjson.gz                 # real time
+    python replay.py updates.ndjson.gz --speed 10      # 10x faster
+    python replay.py updates.ndjson.gz --speed 0 --json replay.json   # as fast as possible
+"""
+import argparse
+import gzip
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+from loadtest import FakeBotAPI, RateLimiter, SimUser, build_report, print_report, start_bot
+
+ID_PATTERN = re.compile(r'[0-9a-f]{8}')
+
+
+def read_records(path):
+    """Stream records from a (possibly multi-member) gzip NDJSON log"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class Replayer:
+    """Maps recorded message and game/tournament IDs onto the ones minted during replay"""
+
+    def __init__(self, api, route_of):
+        self.api = api
+        self.route_of = route_of
+        self.limiter = RateLimiter(0)
+        self.users = {}
+        self.id_map = {}
+        self.lock = threading.Lock()
+
+    def user(self, user_id):
+        with self.lock:
+            if user_id not in self.users:
+                self.users[user_id] = SimUser(user_id, self.api, self.limiter, self.route_of)
+            return self.users[user_id]
+
+    def _map_ids(self, text):
+        return ID_PATTERN.sub(lambda m: self.id_map.get(m.group(0), m.group(0)), text)
+
+    def _resolve_callback(self, user, data):
+        """Find the button on the user's screen matching the recorded callback data"""
+        mapped = self._map_ids(data)
+        parts = data.split('_')
+        for message_id in sorted(self.api.messages[user.id], reverse=True):
+            buttons = [b.get('callback_data', '') for b in user.screen(message_id)['buttons']]
+            if mapped in buttons:
+                return message_id, mapped
+            for button in buttons:
+                button_parts = button.split('_')
+                if len(button_parts) != len(parts):
+                    continue
+                if all(a == b or (ID_PATTERN.fullmatch(a) and ID_PATTERN.fullmatch(b))
+                       for a, b in zip(parts, button_parts)):
+                    with self.lock:
+                        for a, b in zip(parts, button_parts):
+                            if a != b:
+                                self.id_map[a] = b
+                    return message_id, button
+        return user.latest_message_id(), mapped
+
+    def replay(self, record):
+        user = self.user(record['user'])
+        if record['kind'] == 'callback':
+            message_id, data = self._resolve_callback(user, record['data'])
+            if message_id is not None:
+                user.tap(message_id, data)
+        else:
+            text = record['text']
+            inviter = record.get('invite_from')
+            if inviter is not None:
+                for message_id in sorted(self.api.messages[inviter], reverse=True):
+                    match = re.search(r'start=(\w+)', self.api.messages[inviter][message_id]['text'])
+                    if match:
+                        text = f"/start {match.group(1)}"
+                        break
+            user.send_text(self._map_ids(text))
+
+
+def run_replay(path, speed, workers):
+    api = FakeBotAPI().start()
+    main = start_bot(api)
+    replayer = Replayer(api, main.get_update_route)
+    queues = [queue.Queue() for _ in range(workers)]
+    lag = []
+
+    def worker(q):
+        while True:
+            record = q.get()
+            if record is None:
+                return
+            try:
+                replayer.replay(record)
+            except Exception as e:
+                print(f"Replay error for record {record}: {e}")
+
+    threads = [threading.Thread(target=worker, args=(q,), daemon=True) for q in queues]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    first_t = None
+    count = 0
+    for record in read_records(path):
+        if first_t is None:
+            first_t = record['t']
+        if speed > 0:
+            due = started + (record['t'] - first_t) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                lag.append(-delay)
+        # A user's updates always go to the same worker so they replay in order
+        queues[hash(record['user']) % workers].put(record)
+        count += 1
+
+    for q in queues:
+        q.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    main.bot.stop_polling()
+    api.stop()
+
+    report = build_report(api, elapsed)
+    report['records'] = count
+    report['speed'] = speed
+    report['max_schedule_lag_ms'] = max(lag) * 1000 if lag else 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded update log against a fake Bot API")
+    parser.add_argument('log', help="gzip NDJSON log written by RECORD_UPDATES_FILE")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed multiplier (0 = as fast as possible)")
+    parser.add_argument('--workers', type=int, default=64, help="concurrent replay workers")
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    log_path = os.path.abspath(args.log)
+    output = os.path.abspath(args.json) if args.json else None
+    report = run_replay(log_path, args.speed, max(1, args.workers))
+    print(f"\n▶️  Replayed {report['records']} updates at "
+          f"{'max' if args.speed <= 0 else f'{args.speed:g}x'} speed "
+          f"(worst schedule lag {report['max_schedule_lag_ms']:.0f} ms)")
+    print_report(report)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
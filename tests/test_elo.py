@@ -0,0 +1,38 @@
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('rating1, rating2', [(1200, 1200), (1500, 1100), (900, 2000), (1234, 1233)])
+@pytest.mark.parametrize('score1', [1.0, 0.5, 0.0])
+def test_elo_deltas_are_zero_sum(rating1, rating2, score1):
+    delta1, delta2 = main.elo_deltas(rating1, rating2, score1)
+    assert delta1 + delta2 == 0
+    assert abs(delta1) <= main.ELO_K_FACTOR
+
+
+def test_elo_deltas_favour_the_underdog():
+    assert main.elo_deltas(1200, 1200, 1.0) == (main.ELO_K_FACTOR // 2, -(main.ELO_K_FACTOR // 2))
+    assert main.elo_deltas(1200, 1200, 0.5) == (0, 0)
+    upset, _ = main.elo_deltas(1000, 1400, 1.0)
+    expected_win, _ = main.elo_deltas(1400, 1000, 1.0)
+    assert upset > expected_win > 0
+    assert main.elo_deltas(1000, 1400, 0.5)[0] > 0
+
+
+def test_recorded_games_keep_total_rating_constant():
+    main.init_database()
+    main.record_game_result('g1', [1, 2], 1, True)
+    main.record_game_result('g2', [2, 3], None, True)
+    main.record_game_result('g3', [1, 3], 3, True)
+    main.record_game_result('g4', [1], None, False)
+    
+    conn = sqlite3.connect('tictactoe_advanced.db')
+    ratings = dict(conn.execute('SELECT user_id, elo_rating FROM user_stats').fetchall())
+    history = conn.execute('SELECT COUNT(*), SUM(rating_after - rating_before) FROM rating_history').fetchone()
+    conn.close()
+    assert sum(ratings.values()) == 3 * main.ELO_DEFAULT_RATING
+    assert ratings[1] != main.ELO_DEFAULT_RATING
+    assert history == (6, 0)  # The unrated game against the AI adds no history
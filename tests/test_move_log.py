@@ -0,0 +1,45 @@
+import random
+
+import main
+
+
+def test_timed_log_round_trips():
+    rng = random.Random(42)
+    cells = rng.sample(range(main.BOARD_SIZE ** 2), 9)
+    start = 1000.0
+    times, moved_at = [], start
+    for _ in cells:
+        moved_at += rng.choice([0.0, 0.1, 3.7, 12.8, 600.0, 86400.0])  # Multi-byte varints included
+        times.append(moved_at)
+    
+    log = main.encode_move_log(cells, times, start)
+    assert main.move_log_length(log) == len(cells)
+    
+    decoded = list(main.iter_move_log(log))
+    assert [row * main.BOARD_SIZE + col for row, col, _ in decoded] == cells
+    previous = start
+    for (_, _, delay), moved_at in zip(decoded, times):
+        assert abs(delay - (moved_at - previous)) < main.MOVE_LOG_TIME_UNIT
+        previous = moved_at
+
+
+def test_game_moves_round_trip():
+    game = {'start_time': 50.0, 'move_history': [(1, 1, 1, 52.0), (2, 0, 0, 53.5), (1, 2, 2, 60.0)]}
+    decoded = list(main.iter_move_log(main.encode_game_moves(game)))
+    assert [(row, col) for row, col, _ in decoded] == [(1, 1), (0, 0), (2, 2)]
+    assert [round(delay, 1) for _, _, delay in decoded] == [2.0, 1.5, 6.5]
+
+
+def test_reconstructed_board_has_no_timing():
+    board = [[main.PLAYER_X, main.PLAYER_O, main.EMPTY],
+             [main.EMPTY, main.PLAYER_X, main.PLAYER_O],
+             [main.EMPTY, main.EMPTY, main.PLAYER_X]]
+    decoded = list(main.iter_move_log(main.board_to_move_log(board)))
+    assert [(row, col) for row, col, _ in decoded] == [(0, 0), (0, 1), (1, 1), (1, 2), (2, 2)]
+    assert all(delay is None for _, _, delay in decoded)
+
+
+def test_empty_logs():
+    assert list(main.iter_move_log(main.encode_move_log([], [], 0.0))) == []
+    assert list(main.iter_move_log(None)) == []
+    assert main.move_log_length(None) == 0
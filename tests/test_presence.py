@@ -0,0 +1,44 @@
+import pytest
+
+import main
+
+
+def sketch_of(user_ids):
+    sketch = main.HyperLogLog()
+    for user_id in user_ids:
+        sketch.add(main.hash_user_id(user_id))
+    return sketch
+
+
+@pytest.mark.parametrize('distinct', [10_000, 100_000])
+def test_hyperloglog_estimate_within_a_few_percent(distinct):
+    estimate = sketch_of(range(distinct)).count()
+    assert abs(estimate - distinct) / distinct < 0.05
+
+
+def test_hyperloglog_small_counts_and_duplicates():
+    assert main.HyperLogLog().count() == 0
+    assert sketch_of([7] * 1000).count() == 1
+    assert abs(sketch_of(range(100)).count() - 100) <= 3
+
+
+def test_hyperloglog_merge_is_a_union():
+    merged = sketch_of(range(0, 30_000)).merge(sketch_of(range(20_000, 50_000)))
+    assert abs(merged.count() - 50_000) / 50_000 < 0.05
+
+
+def test_presence_tracker_windows():
+    tracker = main.PresenceTracker()
+    now = 1_700_000_000.0
+    for user_id in range(500):
+        tracker.touch(user_id, now - 2 * 86400)  # Two days ago
+    for user_id in range(400, 600):
+        tracker.touch(user_id, now - 3600)
+    for user_id in range(550, 650):
+        tracker.touch(user_id, now)
+    
+    metrics = tracker.metrics(now)
+    assert abs(metrics['online'] - 100) <= 5
+    assert abs(metrics['dau'] - 250) <= 10
+    assert abs(metrics['wau'] - 650) <= 20
+    assert metrics['mau'] == metrics['wau']
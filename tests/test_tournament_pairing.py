@@ -0,0 +1,100 @@
+import itertools
+import random
+
+import pytest
+
+import main
+
+
+def play_round(manager, tournament, matches, rng):
+    """Finish every match of a round with a random result and fold it into the standings"""
+    for match in matches:
+        if match['status'] != 'completed':
+            match['winner'] = rng.choice([match['player1'], match['player2'], None])
+            match['status'] = 'completed'
+        manager._apply_result(tournament, match)
+
+
+def new_tournament(tournament_format, players):
+    tournament = {'format': tournament_format, 'participants': list(range(1, players + 1)), 'bracket': {}}
+    main.TournamentManager()._init_standings(tournament)
+    return tournament
+
+
+@pytest.mark.parametrize('players', [2, 7, 8, 33, 64])
+def test_swiss_has_no_rematches_or_repeat_byes(players):
+    rng = random.Random(players)
+    manager = main.TournamentManager()
+    tournament = new_tournament('swiss', players)
+    seen_pairs = set()
+    bye_players = []
+    
+    for round_number in range(1, tournament['total_rounds'] + 1):
+        matches = manager._pair_round(tournament, round_number)
+        tournament['bracket'][round_number] = matches
+        
+        in_round = [p for match in matches for p in (match['player1'], match['player2']) if p is not None]
+        assert sorted(in_round) == tournament['participants']
+        for match in matches:
+            if match['player2'] is None:
+                bye_players.append(match['player1'])
+            else:
+                pair = frozenset((match['player1'], match['player2']))
+                assert pair not in seen_pairs
+                seen_pairs.add(pair)
+        play_round(manager, tournament, matches, rng)
+    
+    assert len(bye_players) == len(set(bye_players))
+
+
+def test_swiss_pairs_leaders_together():
+    standings = {p: main.new_standing() for p in range(1, 9)}
+    for p in (1, 2):
+        standings[p]['points'] = 2.0
+    matches = main.pair_swiss([1, 2, 3, 4, 5, 6, 7, 8], standings)
+    assert (matches[0]['player1'], matches[0]['player2']) == (1, 2)
+
+
+@pytest.mark.parametrize('players', [2, 3, 6, 9, 16])
+def test_round_robin_plays_every_pair_once(players):
+    participants = list(range(1, players + 1))
+    rounds = main.count_tournament_rounds('round_robin', players)
+    pairs = []
+    byes = []
+    
+    for round_number in range(1, rounds + 1):
+        matches = main.pair_round_robin(participants, round_number)
+        in_round = [p for match in matches for p in (match['player1'], match['player2']) if p is not None]
+        assert sorted(in_round) == participants
+        for match in matches:
+            if match['player2'] is None:
+                byes.append(match['player1'])
+            else:
+                pairs.append(frozenset((match['player1'], match['player2'])))
+    
+    assert sorted(pairs, key=sorted) == sorted(map(frozenset, itertools.combinations(participants, 2)), key=sorted)
+    assert sorted(byes) == (participants if players % 2 else [])
+
+
+def test_standings_and_ranking_follow_results():
+    manager = main.TournamentManager()
+    tournament = new_tournament('round_robin', 4)
+    results = [
+        {'player1': 1, 'player2': 2, 'winner': 1},
+        {'player1': 3, 'player2': 4, 'winner': None},
+        {'player1': 1, 'player2': 3, 'winner': 3},
+        {'player1': 2, 'player2': 4, 'winner': 4},
+        {'player1': 5, 'player2': None, 'winner': 5},
+    ]
+    tournament['participants'].append(5)
+    tournament['standings'][5] = main.new_standing()
+    for match in results:
+        manager._apply_result(tournament, match)
+    
+    standings = tournament['standings']
+    assert standings[1] == {'points': 1.0, 'wins': 1, 'draws': 0, 'losses': 1, 'byes': 0, 'opponents': {2, 3}}
+    assert standings[3]['points'] == 1.5 and standings[3]['draws'] == 1
+    assert standings[4]['points'] == 1.5 and standings[4]['wins'] == 1
+    assert standings[5] == {'points': 1.0, 'wins': 0, 'draws': 0, 'losses': 0, 'byes': 1, 'opponents': set()}
+    # Points first, then wins, then seeding order
+    assert manager.get_ranking(tournament) == [3, 4, 1, 5, 2]